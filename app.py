@@ -1,15 +1,24 @@
+import io
 import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 import streamlit as st
 import pandas as pd
 import numpy as np
 import cv2
 from PIL import Image
-import tempfile
 import json
 from pathlib import Path
 
-from ocr_utils import extract_text_from_file, extract_loan_details, extract_table_data
-from preprocessing import process_image_for_ocr, convert_pdf_to_images
+from ocr_utils import extract_table_data, OCR_ENGINE_MODE, OCR_MODES, DEFAULT_OCR_MODE
+from ocr_cache import params_fingerprint
+from document_profiles import page_has_tables
+from preprocessing import process_image_for_ocr, iter_pdf_pages, iter_tiff_pages, PREPROCESSING_PARAMS
+from results_store import save_document_result
+from job_service import (JobQueue, JobClient, QueueFullError, JobNotFoundError, JOB_SERVICE_URL,
+                         QUEUED, RUNNING, FAILED, CANCELLED)
 
 # Set page configuration
 st.set_page_config(
@@ -22,13 +31,74 @@ st.set_page_config(
 # Directory for sample documents
 SAMPLE_DOCS_DIR = Path("sample_docs")
 
-def save_uploaded_file(uploaded_file):
-    """Save the uploaded file to a temporary location and return the path."""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp:
-        tmp.write(uploaded_file.getvalue())
-        return tmp.name
+# Seconds between status checks while a document is being processed
+JOB_POLL_INTERVAL = 1.0
 
-def display_extracted_info(extracted_info):
+# Processed documents kept in memory for all sessions, keyed by file hash and settings
+RESULT_CACHE_ENTRIES = int(os.environ.get("APP_RESULT_CACHE_ENTRIES", "32"))
+
+# Width in pixels of first-page previews
+THUMBNAIL_WIDTH = 800
+
+class ResultCache:
+    """Thread-safe LRU of processed document results, bounded by entry count."""
+    
+    def __init__(self, max_entries=RESULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+            return result
+    
+    def put(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+@st.cache_resource
+def get_result_cache():
+    """Return the result cache shared by all sessions."""
+    return ResultCache()
+
+def file_hash(data):
+    """Return the SHA-256 of a document's bytes, the key of every per-file cache."""
+    return hashlib.sha256(data).hexdigest()
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def first_page_thumbnail(doc_hash, file_ext, _data, width=THUMBNAIL_WIDTH):
+    """Render a preview of the first page only, cached per file hash."""
+    if file_ext == '.pdf':
+        # The PDF is piped to poppler from memory
+        return next(iter_pdf_pages(_data, page_numbers=[1], width=width))
+    if file_ext in ('.tif', '.tiff'):
+        # Only the first page is decoded, and downscaled while it is read
+        image = next(iter_tiff_pages(_data, page_numbers=[1], width=width))
+        return image[:, :, ::-1] if image.ndim == 3 else image
+    image = Image.open(io.BytesIO(_data))
+    image.thumbnail((width, width * 4))
+    return image
+
+def display_preview(data, file_name, doc_hash, caption_pdf="First Page"):
+    """Show the first page of a PDF or image, or the contents of a text file."""
+    file_ext = os.path.splitext(file_name)[1].lower()
+    if file_ext == '.txt':
+        with st.expander("Text File Content", expanded=True):
+            st.code(data.decode('utf-8', errors='replace'))
+        return
+    try:
+        caption = caption_pdf if file_ext == '.pdf' else "Document Image"
+        st.image(first_page_thumbnail(doc_hash, file_ext, data), caption=caption, use_column_width=True)
+    except Exception as e:
+        st.error(f"Error loading preview: {e}")
+
+def display_extracted_info(extracted_info, doc_id=None, pages=None, file_name=None):
     """Display extracted information in a formatted way."""
     if not extracted_info:
         st.warning("No information could be extracted from the document.")
@@ -89,22 +159,147 @@ def display_extracted_info(extracted_info):
     
     # Add button to save edits
     if st.button("Save Edits"):
+        if doc_id is not None:
+            try:
+                # Edits change fields only; OCR words are stored with the first save
+                saved = st.session_state.setdefault('saved_word_docs', set())
+                save_document_result(doc_id, edited_info, pages=None if doc_id in saved else pages,
+                                     file_name=file_name, edited=True)
+                saved.add(doc_id)
+            except Exception as e:
+                st.error(f"Could not save the edits: {e}")
+                return extracted_info
         st.success("Information updated successfully!")
-        # In a real app, you would save this information to a database or file
         return edited_info
     
     return extracted_info
 
-def process_document(file_path):
-    """Process document to extract text and information."""
-    with st.spinner("Processing document..."):
-        # Extract text from the document
-        extracted_text = extract_text_from_file(file_path)
-        
-        # Extract structured information
-        extracted_info = extract_loan_details(extracted_text)
-        
-        return extracted_text, extracted_info
+def display_tables(pages, doc_type='unknown'):
+    """Display tables reconstructed from the word data of OCRed pages."""
+    ocr_pages = [page for page in pages if page.get('words')]
+    if not ocr_pages:
+        st.info("No OCR word data available (text was read directly from the document).")
+        return
+    
+    # Only parse pages whose document and page profiles expect tables
+    table_pages = [page for page in ocr_pages if page_has_tables(page, doc_type)]
+    if not table_pages:
+        st.info("No table pages detected in this document.")
+        return
+    
+    for page in table_pages:
+        # Reuse the page's OCR result instead of running OCR again
+        table = extract_table_data(ocr_result=page)
+        if not table.empty:
+            st.write(f"Page {page['page']}")
+            st.dataframe(table)
+
+def display_timings(timings):
+    """Show how long each processing stage took for the current document."""
+    if not timings:
+        return
+    with st.expander("Processing Time"):
+        timings = pd.DataFrame.from_dict(timings, orient='index')
+        for column in ('rss_peak', 'rss_delta'):
+            timings[column] = (timings[column].astype(float) / (1024 * 1024)).round(1)
+        timings.columns = ['Calls', 'Wall Time (s)', 'CPU Time (s)', 'Peak Memory Growth (MB)',
+                           'Memory Change (MB)']
+        st.dataframe(timings)
+
+@st.cache_resource
+def get_job_queue():
+    """Return the job service client, or an in-process job queue shared by all sessions."""
+    if JOB_SERVICE_URL:
+        return JobClient(JOB_SERVICE_URL)
+    return JobQueue()
+
+def get_pipeline_settings():
+    """Return the session's pipeline settings that differ from the defaults."""
+    return st.session_state.get('pipeline_settings', {})
+
+def result_key(doc_hash, settings):
+    """Key of a document's result: its file hash, plus a fingerprint of non-default settings."""
+    if not settings:
+        return doc_hash
+    return f"{doc_hash}-{params_fingerprint(settings)[:16]}"
+
+def submit_document(data, file_name, doc_hash):
+    """Queue a document for processing with the session's settings unless its result is already cached."""
+    settings = get_pipeline_settings()
+    key = result_key(doc_hash, settings)
+    requested = st.session_state.setdefault('requested_docs', set())
+    if get_result_cache().get(key) is not None:
+        requested.add(key)
+        return
+    try:
+        st.session_state[f"job_{key}"] = get_job_queue().submit(data, file_name, settings)
+        requested.add(key)
+    except QueueFullError:
+        st.warning("The server is busy processing other documents. Please try again in a moment.")
+    except Exception as e:
+        st.error(f"Could not submit the document: {e}")
+
+def get_document_result(doc_hash):
+    """
+    Return the processed result of a document the session asked for, or None.
+    
+    Results come from the shared result cache, so reruns and other sessions
+    reuse them without any OCR. While the document's job is queued or running
+    the script reruns every JOB_POLL_INTERVAL seconds, so the page stays
+    responsive and the job can be cancelled. Results are per settings, so
+    after the settings change the document must be processed again.
+    """
+    key = result_key(doc_hash, get_pipeline_settings())
+    if key not in st.session_state.get('requested_docs', ()):
+        return None
+    
+    results = get_result_cache()
+    result = results.get(key)
+    job_key = f"job_{key}"
+    
+    if result is None and job_key in st.session_state:
+        result = _poll_job(job_key)
+        if result is not None:
+            results.put(key, result)
+    if result is None:
+        return None
+    
+    st.caption(f"Document type: {result.get('document_type', 'unknown').replace('_', ' ')}")
+    for page in result['pages']:
+        if page['error']:
+            st.warning(f"Page {page['page']} could not be processed: {page['error']}")
+    display_timings(result['timings'])
+    return result
+
+def _poll_job(job_key):
+    """Show the progress of a job; return its result once done, None if it ended otherwise."""
+    job_id = st.session_state[job_key]
+    jobs = get_job_queue()
+    try:
+        status = jobs.status(job_id)
+    except JobNotFoundError:
+        del st.session_state[job_key]
+        st.warning("The processing result has expired. Please process the document again.")
+        return None
+    
+    if status['status'] in (QUEUED, RUNNING):
+        if status['status'] == QUEUED:
+            st.info("Waiting for a free worker...")
+        else:
+            st.info(f"Processing document... {status['pages_done']} page(s) done")
+        if st.button("Cancel", key=f"{job_key}_cancel"):
+            jobs.cancel(job_id)
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+    
+    del st.session_state[job_key]
+    if status['status'] == CANCELLED:
+        st.info("Processing was cancelled.")
+        return None
+    if status['status'] == FAILED:
+        st.error(f"Error processing document: {status['error']}")
+        return None
+    return jobs.result(job_id)
 
 def main():
     """Main function to run the Streamlit app."""
@@ -134,43 +329,35 @@ def main():
             }
             st.write("File Details:", file_details)
             
-            # Save the uploaded file temporarily
-            temp_file_path = save_uploaded_file(uploaded_file)
+            data = uploaded_file.getvalue()
+            doc_hash = file_hash(data)
             
             # Add a button to process the document
             if st.button("Process Document"):
-                # Process the document
-                extracted_text, extracted_info = process_document(temp_file_path)
+                submit_document(data, uploaded_file.name, doc_hash)
+            
+            result = get_document_result(doc_hash)
+            if result is not None:
+                extracted_text, extracted_info, pages = result['text'], result['fields'], result['pages']
                 
                 # Display tabs for different views
-                tab1, tab2, tab3 = st.tabs(["Extracted Information", "Raw Text", "Document Image"])
+                tab1, tab2, tab3, tab4 = st.tabs(["Extracted Information", "Raw Text", "Tables", "Document Image"])
                 
                 with tab1:
-                    display_extracted_info(extracted_info)
+                    display_extracted_info(extracted_info, doc_hash, pages, file_name=uploaded_file.name)
                 
                 with tab2:
                     st.subheader("Extracted Raw Text")
                     st.text_area("Text", extracted_text, height=400)
                 
                 with tab3:
+                    st.subheader("Extracted Tables")
+                    display_tables(pages, result.get('document_type', 'unknown'))
+                
+                with tab4:
                     st.subheader("Document Preview")
                     # Display the document (first page if PDF)
-                    file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-                    if file_ext == '.pdf':
-                        images = convert_pdf_to_images(temp_file_path)
-                        st.image(images[0], caption="First Page", use_column_width=True)
-                    elif file_ext in ['.png', '.jpg', '.jpeg', '.tiff']:
-                        st.image(Image.open(temp_file_path), caption="Document Image", use_column_width=True)
-                    elif file_ext == '.txt':
-                        with st.expander("Text File Content", expanded=True):
-                            with open(temp_file_path, 'r') as f:
-                                st.code(f.read())
-            
-            # Clean up the temporary file
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+                    display_preview(data, uploaded_file.name, doc_hash)
     
     elif app_mode == "Sample Documents":
         st.header("Sample Documents")
@@ -200,47 +387,50 @@ def main():
         if selected_file:
             st.write(f"Selected: {selected_file.name}")
             
+            data = selected_file.read_bytes()
+            doc_hash = file_hash(data)
+            
             # Display a preview of the document
-            file_ext = selected_file.suffix.lower()
-            if file_ext == '.pdf':
-                try:
-                    images = convert_pdf_to_images(selected_file)
-                    st.image(images[0], caption="First Page", use_column_width=True)
-                except Exception as e:
-                    st.error(f"Error loading PDF: {e}")
-            elif file_ext in ['.png', '.jpg', '.jpeg', '.tiff']:
-                try:
-                    st.image(Image.open(selected_file), caption="Document Image", use_column_width=True)
-                except Exception as e:
-                    st.error(f"Error loading image: {e}")
-            elif file_ext == '.txt':
-                with st.expander("Text File Content", expanded=True):
-                    try:
-                        with open(selected_file, 'r') as f:
-                            st.code(f.read())
-                    except Exception as e:
-                        st.error(f"Error loading text file: {e}")
+            display_preview(data, selected_file.name, doc_hash)
             
             # Add a button to process the document
             if st.button("Process Sample Document"):
-                # Process the document
-                extracted_text, extracted_info = process_document(selected_file)
+                submit_document(data, selected_file.name, doc_hash)
+            
+            result = get_document_result(doc_hash)
+            if result is not None:
+                extracted_text, extracted_info, pages = result['text'], result['fields'], result['pages']
                 
                 # Display tabs for different views
-                tab1, tab2 = st.tabs(["Extracted Information", "Raw Text"])
+                tab1, tab2, tab3 = st.tabs(["Extracted Information", "Raw Text", "Tables"])
                 
                 with tab1:
-                    display_extracted_info(extracted_info)
+                    display_extracted_info(extracted_info, doc_hash, pages, file_name=selected_file.name)
                 
                 with tab2:
                     st.subheader("Extracted Raw Text")
                     st.text_area("Text", extracted_text, height=400)
+                
+                with tab3:
+                    st.subheader("Extracted Tables")
+                    display_tables(pages, result.get('document_type', 'unknown'))
     
     elif app_mode == "Settings":
         st.header("Settings")
         
         # OCR Settings
         st.subheader("OCR Settings")
+        st.markdown("""
+        Settings apply to documents processed afterwards in this session. Pages
+        processed before are not OCRed from scratch: only the preprocessing
+        stages after the first changed setting, and OCR, run again.
+        """)
+        
+        defaults = dict(PREPROCESSING_PARAMS, oem=OCR_ENGINE_MODE, ocr_mode=DEFAULT_OCR_MODE)
+        current = dict(defaults, **get_pipeline_settings())
+        threshold_options = ["adaptive", "otsu", "binary"]
+        engine_options = ["0 - Legacy engine only", "1 - Neural nets LSTM engine only",
+                          "2 - Legacy + LSTM engines", "3 - Default, based on what is available"]
         
         # Create columns for settings
         col1, col2 = st.columns(2)
@@ -249,16 +439,16 @@ def main():
             # Threshold type
             threshold_type = st.selectbox(
                 "Thresholding Method",
-                options=["adaptive", "otsu", "binary"],
-                index=0
+                options=threshold_options,
+                index=threshold_options.index(current['threshold_type'])
             )
             
-            # Denoise strength
+            # Denoise strength (filter strength of non-local means denoising on noisy pages)
             denoise_strength = st.slider(
                 "Denoising Strength",
                 min_value=1,
                 max_value=20,
-                value=10
+                value=int(current['denoise_h'])
             )
         
         with col2:
@@ -267,28 +457,39 @@ def main():
                 "Resize Width (pixels)",
                 min_value=800,
                 max_value=3000,
-                value=1700,
+                value=int(current['resize_width']),
                 step=100
             )
             
             # OCR engine mode
             ocr_engine_mode = st.selectbox(
                 "OCR Engine Mode",
-                options=["1 - Legacy engine only", "2 - Neural nets LSTM engine only", "3 - Default, based on what is available"],
-                index=2,
+                options=engine_options,
+                index=int(current['oem']),
                 format_func=lambda x: x
             )
+            
+            # Two-tier mode preprocesses lightly and reprocesses only low-confidence lines
+            ocr_mode = st.selectbox(
+                "OCR Mode",
+                options=list(OCR_MODES),
+                index=OCR_MODES.index(current['ocr_mode'])
+            )
         
         # Save settings button
         if st.button("Save Settings"):
             settings = {
                 "threshold_type": threshold_type,
-                "denoise_strength": denoise_strength,
-                "resize_width": resize_width,
-                "ocr_engine_mode": ocr_engine_mode.split(" - ")[0]
+                "denoise_h": denoise_strength,
+                "resize_width": int(resize_width),
+                "oem": int(ocr_engine_mode.split(" - ")[0]),
+                "ocr_mode": ocr_mode
+            }
+            # Only settings that differ from the defaults are kept, so default
+            # settings share results with everyone else
+            st.session_state['pipeline_settings'] = {
+                key: value for key, value in settings.items() if value != defaults[key]
             }
-            
-            # In a real app, you would save these settings to a file or database
             st.success("Settings saved successfully!")
             st.json(settings)
 
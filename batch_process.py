@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from ocr_utils import (
+    extract_pages_from_file, extract_document_fields, IncrementalExtraction, FIELD_RULES, SUPPORTED_EXTENSIONS
+)
+from ocr_cache import file_digest
+from results_store import ParquetResultWriter
+from instrumentation import trace, summarize, merge_spans, render_metrics, start_metrics_server
+
+def discover_files(source):
+    """
+    List the documents to process.
+
+    Args:
+        source: Directory to scan recursively, or a manifest file with one
+            document path per line (relative paths are resolved against the
+            manifest's directory; blank lines and # comments are ignored)
+
+    Returns:
+        Sorted list of document paths as strings
+    """
+    source = Path(source)
+    if source.is_dir():
+        files = (
+            Path(root) / name
+            for root, _, names in os.walk(source)
+            for name in names
+            if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+        )
+    else:
+        with open(source, 'r', encoding='utf-8') as manifest:
+            lines = (line.strip() for line in manifest)
+            files = [source.parent / line for line in lines if line and not line.startswith('#')]
+    return sorted(str(path) for path in files)
+
+def load_checkpoint(output_path, retry_failed=False):
+    """Return the set of documents already recorded in an existing results file."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as output:
+        for line in output:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            if retry_failed and record.get('error'):
+                continue
+            done.add(record['path'])
+    return done
+
+def _trim_partial_line(output_path):
+    """Cut a truncated last line off a results file so appended records start on a new line."""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, 'rb+') as output:
+        end = output.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(position, 1 << 16)
+            output.seek(position - step)
+            newline = output.read(step).rfind(b'\n')
+            if newline >= 0:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position < end:
+            output.truncate(position)
+
+def process_file(path, include_text=False, include_pages=False, required_fields=None):
+    """
+    Extract text and loan fields from one document, returning a JSON-ready record.
+
+    With required_fields, pages are processed only until those fields are
+    found; 'pages' then counts the processed pages and 'complete' tells
+    whether the whole document was read.
+
+    With include_pages the page records are returned under '_pages' so the
+    caller can store OCR word data, and the raw stage spans are returned under
+    '_spans' for the caller's metrics; neither is meant for the JSONL output.
+    The per-stage trace of the document is kept under 'timings'.
+    """
+    start = time.perf_counter()
+    record = {'path': path, 'doc_id': None, 'document_type': None, 'pages': 0, 'fields': {},
+              'page_errors': [], 'error': None}
+    with trace() as spans:
+        try:
+            # The digest is also the OCR cache key, so the file is hashed only once
+            record['doc_id'] = file_digest(path)
+            # Parallelism is across documents, so each document runs sequentially
+            if required_fields:
+                with IncrementalExtraction(path, workers=1, digest=record['doc_id']) as extraction:
+                    record['fields'] = extraction.extract(required_fields)
+                    record['complete'] = extraction.complete
+                    record['document_type'] = extraction.document_type
+                    pages = extraction.pages
+                text = "\n\n".join(page['text'] for page in pages if not page['error'])
+            else:
+                pages = extract_pages_from_file(path, workers=1, digest=record['doc_id'])
+                text = "\n\n".join(page['text'] for page in pages if not page['error'])
+                record['document_type'], record['fields'] = extract_document_fields(pages)
+            record['pages'] = len(pages)
+            record['page_errors'] = [
+                {'page': page['page'], 'error': page['error']} for page in pages if page['error']
+            ]
+            if include_text:
+                record['text'] = text
+            if include_pages:
+                record['_pages'] = pages
+        except Exception as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    record['timings'] = summarize(spans)
+    record['_spans'] = spans
+    return record
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class ProgressReporter:
+    """Prints throughput and ETA to stderr at most every `interval` seconds."""
+
+    def __init__(self, total, interval=5.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.start = time.monotonic()
+        self.last_report = 0.0
+        self.done = 0
+        self.failed = 0
+        self.pages = 0
+
+    def update(self, record, force=False):
+        if record is not None:
+            self.done += 1
+            self.pages += record['pages']
+            self.failed += bool(record['error'])
+
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        remaining = (self.total - self.done) / rate if rate else float('inf')
+        eta = _format_duration(remaining) if rate else '--:--:--'
+        print(
+            f"[{_format_duration(elapsed)}] {self.done}/{self.total} docs "
+            f"({self.failed} failed) | {rate:.2f} docs/s, {self.pages / elapsed:.2f} pages/s | ETA {eta}",
+            file=self.stream, flush=True
+        )
+
+def run_batch(source, output_path, workers=None, include_text=False, retry_failed=False,
+              report_interval=5.0, parquet_dir=None, parquet_batch_size=500, required_fields=None):
+    """
+    Process every document in `source` across a process pool, appending results to JSONL.
+
+    Documents already recorded in `output_path` are skipped, so an interrupted
+    run can simply be restarted with the same arguments. With `parquet_dir`,
+    fields and OCR words are also appended to the Parquet datasets there;
+    JSONL lines are then written only after their batch reached Parquet, so
+    the checkpoint never gets ahead of the datasets. With `required_fields`,
+    each document stops being processed once those fields are found.
+
+    Returns:
+        Number of documents processed in this run
+    """
+    files = discover_files(source)
+    done = load_checkpoint(output_path, retry_failed=retry_failed)
+    pending = [path for path in files if path not in done]
+    print(f"{len(files)} documents found, {len(files) - len(pending)} already processed, "
+          f"{len(pending)} to go", file=sys.stderr, flush=True)
+    if not pending:
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    progress = ProgressReporter(len(pending), interval=report_interval)
+    todo = iter(pending)
+    writer = ParquetResultWriter(parquet_dir, batch_size=float('inf')) if parquet_dir else None
+    unsaved = []
+
+    def save(output, force=False):
+        if writer is not None:
+            if not force and len(unsaved) < parquet_batch_size:
+                return
+            writer.flush()
+        for record in unsaved:
+            output.write(json.dumps(record) + '\n')
+        output.flush()
+        unsaved.clear()
+
+    # A run killed mid-write can leave a truncated last line, which
+    # load_checkpoint skipped and which must not swallow the next record
+    _trim_partial_line(output_path)
+    with open(output_path, 'a', encoding='utf-8') as output, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep a bounded number of documents in flight instead of queueing them all
+        in_flight = set()
+        try:
+            while True:
+                while len(in_flight) < 2 * workers:
+                    path = next(todo, None)
+                    if path is None:
+                        break
+                    in_flight.add(executor.submit(process_file, path, include_text, writer is not None,
+                                                    required_fields))
+                if not in_flight:
+                    break
+
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    # Stages ran in a worker process; fold them into this process's metrics
+                    merge_spans(record.pop('_spans'))
+                    if writer is not None and record['doc_id']:
+                        writer.add(record['doc_id'], record['fields'], pages=record.pop('_pages', None),
+                                   file_name=os.path.basename(record['path']), error=record['error'])
+                    # One complete line per document doubles as the checkpoint
+                    unsaved.append(record)
+                    save(output)
+                    progress.update(record)
+            save(output, force=True)
+        except KeyboardInterrupt:
+            for future in in_flight:
+                future.cancel()
+            save(output, force=True)
+            print("Interrupted; finished documents are saved and will be skipped on restart.",
+                  file=sys.stderr, flush=True)
+            raise
+
+    progress.update(None, force=True)
+    return progress.done
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract loan document fields in bulk and write results as JSON lines."
+    )
+    parser.add_argument('source', help="Directory of documents or a manifest file listing document paths")
+    parser.add_argument('-o', '--output', default='results.jsonl', help="Results file (default: results.jsonl)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--include-text', action='store_true', help="Store the extracted text in each record")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Reprocess documents recorded with an error in a previous run")
+    parser.add_argument('--parquet', metavar='DIR', default=None,
+                        help="Also append fields and OCR word data to Parquet datasets in DIR")
+    parser.add_argument('--parquet-batch-size', type=int, default=500,
+                        help="Documents per Parquet write (default: 500)")
+    parser.add_argument('--required-fields', default=None,
+                        help="Comma-separated fields; stop processing a document once all are found")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Serve Prometheus-format stage metrics on this port at /metrics")
+    parser.add_argument('--metrics-file', default=None,
+                        help="Write Prometheus-format stage metrics to this file when the run ends")
+    parser.add_argument('--report-interval', type=float, default=5.0,
+                        help="Seconds between progress reports (default: 5)")
+    args = parser.parse_args(argv)
+
+    required_fields = None
+    if args.required_fields:
+        required_fields = [field.strip() for field in args.required_fields.split(',') if field.strip()]
+        unknown = sorted(set(required_fields) - set(FIELD_RULES))
+        if unknown:
+            parser.error(f"Unknown fields: {', '.join(unknown)} (choose from {', '.join(FIELD_RULES)})")
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    try:
+        run_batch(args.source, args.output, workers=args.workers, include_text=args.include_text,
+                  retry_failed=args.retry_failed, report_interval=args.report_interval,
+                  parquet_dir=args.parquet, parquet_batch_size=args.parquet_batch_size,
+                  required_fields=required_fields)
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if args.metrics_file:
+            with open(args.metrics_file, 'w', encoding='utf-8') as metrics:
+                metrics.write(render_metrics())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
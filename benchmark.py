@@ -0,0 +1,339 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from convert_to_pdf import text_to_pdf
+from convert_to_image import text_to_image
+
+# Bump when the layout of the results file changes
+BENCHMARK_FORMAT_VERSION = 1
+
+SAMPLE_DOCS_DIR = Path("sample_docs")
+
+PERCENTILES = (50, 90, 99)
+
+# Environment of the measuring process: results of pages processed earlier, in
+# this run or a previous one, must not be reused, so every page is really
+# preprocessed and OCRed
+BENCHMARK_ENV = {'PAGE_INDEX': '0', 'STAGE_MEMO_MB': '0'}
+
+def augment_image(image, rng, noise=0.0, blur=0.0, skew=0.0):
+    """
+    Degrade a rendered page so it looks more like a scan.
+
+    Args:
+        image: Grayscale page as a uint8 array
+        rng: numpy Generator used for the random noise and skew angle
+        noise: Standard deviation of additive Gaussian noise, in gray levels
+        blur: Gaussian blur sigma in pixels
+        skew: Maximum absolute rotation in degrees (the angle is drawn uniformly)
+
+    Returns:
+        Augmented uint8 array
+    """
+    if skew:
+        angle = rng.uniform(-skew, skew)
+        h, w = image.shape[:2]
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        image = cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=255)
+    if blur:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    if noise:
+        noisy = image.astype(np.float32) + rng.normal(0, noise, image.shape)
+        image = np.clip(noisy, 0, 255).astype(np.uint8)
+    return image
+
+def _render_page(text, work_dir):
+    """Render text to a grayscale page array with convert_to_image.text_to_image."""
+    txt_path = os.path.join(work_dir, 'page.txt')
+    png_path = os.path.join(work_dir, 'page.png')
+    with open(txt_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    # The generators report every file they write; keep the benchmark output clean
+    with contextlib.redirect_stdout(io.StringIO()):
+        text_to_image(txt_path, png_path)
+    return np.asarray(Image.open(png_path).convert('L'))
+
+def generate_corpus(corpus_dir, templates, docs=10, pages=1, doc_format='scan', noise=0.0, blur=0.0,
+                    skew=0.0, seed=0):
+    """
+    Synthesize a benchmark corpus from ground-truth text templates.
+
+    Every document uses one template, chosen with `seed`. Its pages are
+    copies of the template, and the template text is saved next to the
+    document as ground truth.
+
+    Args:
+        corpus_dir: Directory to write the documents to
+        templates: List of template .txt paths
+        docs: Number of documents
+        pages: Pages (template copies) per document
+        doc_format: 'scan' renders pages to images (PNG for one page, an
+            image-only PDF otherwise) with optional augmentation; 'text-pdf'
+            writes PDFs with a text layer via convert_to_pdf.text_to_pdf
+        noise, blur, skew: Augmentation applied to scanned pages (see augment_image)
+        seed: Seed for template choice and augmentation
+
+    Returns:
+        List of {'path', 'truth', 'template'} dicts
+    """
+    corpus_dir = Path(corpus_dir)
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    chooser = random.Random(seed)
+    corpus = []
+
+    for i in range(docs):
+        template = chooser.choice(templates)
+        with open(template, 'r', encoding='utf-8') as file:
+            text = file.read()
+        stem = corpus_dir / f"doc_{i:05d}"
+        truth_path = stem.with_suffix('.truth.txt')
+        truth_path.write_text(text, encoding='utf-8')
+
+        if doc_format == 'text-pdf':
+            source = stem.with_suffix('.src.txt')
+            source.write_text('\n'.join([text] * pages), encoding='utf-8')
+            path = stem.with_suffix('.pdf')
+            with contextlib.redirect_stdout(io.StringIO()):
+                text_to_pdf(str(source), str(path))
+            source.unlink()
+        elif doc_format == 'scan':
+            rng = np.random.default_rng([seed, i])
+            with tempfile.TemporaryDirectory(prefix='bench-') as work_dir:
+                page = _render_page(text, work_dir)
+            images = [Image.fromarray(augment_image(page, rng, noise, blur, skew)) for _ in range(pages)]
+            if pages == 1:
+                path = stem.with_suffix('.png')
+                images[0].save(path)
+            else:
+                path = stem.with_suffix('.pdf')
+                images[0].save(path, save_all=True, append_images=images[1:], resolution=200)
+        else:
+            raise ValueError(f"Unknown document format: {doc_format}")
+
+        corpus.append({'path': str(path), 'truth': str(truth_path), 'template': Path(template).name})
+    return corpus
+
+def _normalize(value):
+    return ' '.join(str(value).lower().split()).strip(' .,;:')
+
+def score_fields(expected, extracted):
+    """Return {field: True/False} for every field present in the ground truth."""
+    return {
+        field: field in extracted and _normalize(extracted[field]) == _normalize(value)
+        for field, value in expected.items()
+    }
+
+def percentiles(values):
+    """Return mean and PERCENTILES of a list of numbers (empty dict for no values)."""
+    if not len(values):
+        return {}
+    values = np.asarray(values, dtype=float)
+    stats = {f"p{p}": round(float(np.percentile(values, p)), 6) for p in PERCENTILES}
+    stats['mean'] = round(float(values.mean()), 6)
+    stats['total'] = round(float(values.sum()), 6)
+    return stats
+
+def _init_benchmark_process():
+    """Pool initializer: apply BENCHMARK_ENV before the pipeline is imported."""
+    os.environ.update(BENCHMARK_ENV)
+
+def run_benchmark(corpus, workers=1, use_text_layer=True, warmup=1):
+    """
+    Process a corpus without the OCR cache, page index or stage memo and measure speed, memory and accuracy.
+
+    Meant to run in a fresh process (see main) so peak RSS reflects only the
+    processing, not corpus generation, and BENCHMARK_ENV applies.
+
+    Returns:
+        Results dict with 'summary', 'stages' and per-document 'documents'
+    """
+    # Imported here so the pipeline is loaded in the measuring process
+    from ocr_utils import extract_pages_from_file, extract_loan_details, extract_document_fields
+    from instrumentation import trace, peak_rss
+
+    for entry in corpus[:warmup]:
+        with contextlib.suppress(Exception):
+            extract_pages_from_file(entry['path'], workers=workers, use_text_layer=use_text_layer,
+                                    cache=False, index=False)
+
+    documents = []
+    stage_walls = {}
+    stage_cpu = {}
+    field_hits = {}
+    start = time.perf_counter()
+
+    for entry in corpus:
+        with open(entry['truth'], 'r', encoding='utf-8') as file:
+            expected = extract_loan_details(file.read())
+
+        doc = {'path': entry['path'], 'template': entry['template'], 'pages': 0, 'error': None}
+        doc_start = time.perf_counter()
+        with trace() as spans:
+            try:
+                pages = extract_pages_from_file(entry['path'], workers=workers,
+                                                use_text_layer=use_text_layer, cache=False, index=False)
+                doc['pages'] = len(pages)
+                doc['page_errors'] = sum(1 for page in pages if page['error'])
+                extracted = extract_document_fields(pages)[1]
+            except Exception as e:
+                doc['error'] = f"{type(e).__name__}: {e}"
+                extracted = {}
+        doc['seconds'] = round(time.perf_counter() - doc_start, 6)
+
+        scores = score_fields(expected, extracted)
+        doc['fields_expected'] = len(scores)
+        doc['fields_correct'] = sum(scores.values())
+        for field, correct in scores.items():
+            hits = field_hits.setdefault(field, [0, 0])
+            hits[0] += correct
+            hits[1] += 1
+        for span in spans:
+            stage_walls.setdefault(span['stage'], []).append(span['wall'])
+            stage_cpu[span['stage']] = stage_cpu.get(span['stage'], 0.0) + span['cpu']
+        documents.append(doc)
+
+    wall = time.perf_counter() - start
+    total_pages = sum(doc['pages'] for doc in documents)
+    expected_total = sum(hits[1] for hits in field_hits.values())
+    correct_total = sum(hits[0] for hits in field_hits.values())
+
+    summary = {
+        'documents': len(documents),
+        'pages': total_pages,
+        'errors': sum(1 for doc in documents if doc['error']),
+        'page_errors': sum(doc.get('page_errors', 0) for doc in documents),
+        'wall_seconds': round(wall, 6),
+        'pages_per_sec': round(total_pages / wall, 6) if wall else None,
+        'docs_per_sec': round(len(documents) / wall, 6) if wall else None,
+        'peak_rss_bytes': peak_rss(),
+        'document_latency': percentiles([doc['seconds'] for doc in documents]),
+        'field_accuracy': round(correct_total / expected_total, 6) if expected_total else None,
+        'field_accuracy_by_field': {
+            field: round(hits[0] / hits[1], 6) for field, hits in sorted(field_hits.items())
+        },
+    }
+    stages = {
+        stage: dict(percentiles(walls), count=len(walls), cpu_total=round(stage_cpu[stage], 6))
+        for stage, walls in sorted(stage_walls.items())
+    }
+    return {'summary': summary, 'stages': stages, 'documents': documents}
+
+def environment_info():
+    """Describe the machine and pipeline configuration the benchmark ran with."""
+    from ocr_utils import ocr_params
+    from ocr_cache import params_fingerprint
+    from page_index import get_default_index
+    from preprocessing import get_stage_memo
+
+    params = ocr_params()
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'ocr_backend': params['ocr_backend'],
+        'tesseract': params['tesseract'],
+        'params_fingerprint': params_fingerprint(params),
+        'page_index': get_default_index() is not None,
+        'stage_memo': bool(get_stage_memo()),
+    }
+
+def compare_results(baseline, current):
+    """Return printable lines comparing the headline metrics of two result files."""
+    def change(old, new):
+        if old in (None, 0) or new is None:
+            return f"{old} -> {new}"
+        return f"{old:.4g} -> {new:.4g} ({(new - old) / old * 100:+.1f}%)"
+
+    lines = []
+    for key in ('pages_per_sec', 'docs_per_sec', 'peak_rss_bytes', 'field_accuracy'):
+        lines.append(f"{key}: {change(baseline['summary'].get(key), current['summary'].get(key))}")
+    for stage in sorted(set(baseline['stages']) | set(current['stages'])):
+        old = baseline['stages'].get(stage, {}).get('p50')
+        new = current['stages'].get(stage, {}).get('p50')
+        lines.append(f"stage {stage} p50: {change(old, new)}")
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the document pipeline on a synthetic loan document corpus."
+    )
+    parser.add_argument('--docs', type=int, default=10, help="Number of documents (default: 10)")
+    parser.add_argument('--pages', type=int, default=1, help="Pages per document (default: 1)")
+    parser.add_argument('--format', dest='doc_format', choices=['scan', 'text-pdf'], default='scan',
+                        help="scan: rendered page images; text-pdf: PDFs with a text layer (default: scan)")
+    parser.add_argument('--noise', type=float, default=0.0, help="Gaussian noise sigma for scanned pages")
+    parser.add_argument('--blur', type=float, default=0.0, help="Gaussian blur sigma for scanned pages")
+    parser.add_argument('--skew', type=float, default=0.0, help="Maximum random skew in degrees for scanned pages")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument('--workers', type=int, default=1, help="OCR worker processes per PDF (default: 1)")
+    parser.add_argument('--no-text-layer', action='store_true', help="OCR PDF pages even if they have a text layer")
+    parser.add_argument('--warmup', type=int, default=1, help="Documents processed before timing starts (default: 1)")
+    parser.add_argument('--templates', default=str(SAMPLE_DOCS_DIR),
+                        help="Directory of ground-truth .txt templates (default: sample_docs)")
+    parser.add_argument('--corpus-dir', default=None, help="Keep the generated corpus in this directory")
+    parser.add_argument('-o', '--output', default='benchmark.json', help="Results file (default: benchmark.json)")
+    parser.add_argument('--compare', metavar='BASELINE', default=None,
+                        help="Print the change of key metrics against an earlier results file")
+    args = parser.parse_args(argv)
+
+    templates = sorted(str(path) for path in Path(args.templates).glob('*.txt'))
+    if not templates:
+        parser.error(f"No .txt templates found in {args.templates}")
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ('output', 'compare', 'corpus_dir', 'templates')}
+    config['templates'] = [Path(path).name for path in templates]
+
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix='loan-benchmark-')
+    try:
+        print(f"Generating {args.docs} documents in {corpus_dir}...", file=sys.stderr)
+        corpus = generate_corpus(corpus_dir, templates, docs=args.docs, pages=args.pages,
+                                 doc_format=args.doc_format, noise=args.noise, blur=args.blur,
+                                 skew=args.skew, seed=args.seed)
+
+        print("Running benchmark...", file=sys.stderr)
+        # A fresh process keeps corpus generation out of the peak RSS measurement
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1, initializer=_init_benchmark_process) as pool:
+            results = pool.apply(run_benchmark, (corpus, args.workers, not args.no_text_layer, args.warmup))
+            environment = pool.apply(environment_info)
+    finally:
+        if args.corpus_dir is None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    results = {'format_version': BENCHMARK_FORMAT_VERSION, 'config': config,
+               'environment': environment, **results}
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    summary = results['summary']
+    print(f"{summary['documents']} documents, {summary['pages']} pages in {summary['wall_seconds']:.2f}s: "
+          f"{summary['pages_per_sec']:.2f} pages/s, peak RSS {summary['peak_rss_bytes'] / 2**20:.0f} MB, "
+          f"field accuracy {summary['field_accuracy']}", file=sys.stderr)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        for line in compare_results(baseline, results):
+            print(line)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import os
+import re
+import cv2
+import numpy as np
+
+from instrumentation import timed
+
+# Set DOCUMENT_PROFILES=0 to OCR every page and search every field, as before
+ENABLED = os.environ.get("DOCUMENT_PROFILES", "1") != "0"
+
+# Width of the low-resolution copy that page layout is classified on
+CLASSIFY_WIDTH = 400
+
+# A page is blank when fewer pixels than this share are darker than the
+# background by INK_CONTRAST grey levels
+BLANK_INK_RATIO = 0.002
+INK_CONTRAST = 40
+
+# Share of text lines that must look like table rows for a page to be a table
+TABLE_LINE_RATIO = 0.4
+
+# Per page type: skip OCR entirely, and whether tables are parsed from the
+# page's words. Images are only told apart as blank or not before OCR; table
+# pages are recognized from the OCR text, so every OCRed page uses OCR_CONFIG.
+PAGE_PROFILES = {
+    'blank': {'skip': True, 'tables': False},
+    'table': {'skip': False, 'tables': True},
+    'text': {'skip': False, 'tables': False},
+}
+
+# Title keywords of each document type. Each title line is checked against
+# every type in order, most specific first: a "Mortgage Loan Agreement" is a
+# mortgage and a "Loan Agreement Payment Schedule" is a schedule.
+DOCUMENT_KEYWORDS = [
+    ('mortgage', ('mortgage',)),
+    ('amortization_schedule', ('amortization schedule', 'payment schedule')),
+    ('loan_agreement', ('loan agreement', 'promissory note')),
+    ('loan_application', ('loan application', 'application for')),
+]
+
+# Per document type: fields to search (None = all) and whether tables are
+# parsed on every page rather than only on table pages
+DOCUMENT_PROFILES = {
+    'loan_application': {
+        'fields': ['loan_amount', 'interest_rate', 'loan_term', 'loan_type', 'borrower_name',
+                   'borrower_address', 'borrower_phone', 'borrower_email', 'social_security',
+                   'application_date', 'collateral'],
+        'tables': False,
+    },
+    'loan_agreement': {'fields': None, 'tables': False},
+    'mortgage': {'fields': None, 'tables': False},
+    'amortization_schedule': {
+        'fields': ['loan_amount', 'interest_rate', 'loan_term', 'borrower_name', 'lender_name',
+                   'application_date'],
+        'tables': True,
+    },
+    'unknown': {'fields': None, 'tables': True},
+}
+
+# Number of non-empty lines at the top of the first page searched for title
+# keywords. Body text is not searched: an agreement that refers to its
+# "payment schedule" is still an agreement.
+TITLE_LINES = 3
+
+_TABLE_CELL = re.compile(r'\$?\d[\d,./:-]*%?')
+
+def profile_params():
+    """Return every classifier setting that affects page text, for cache keys."""
+    if not ENABLED:
+        return None
+    return {
+        'classify_width': CLASSIFY_WIDTH,
+        'blank_ink_ratio': BLANK_INK_RATIO,
+        'ink_contrast': INK_CONTRAST,
+        'page_profiles': PAGE_PROFILES,
+    }
+
+@timed('classify')
+def classify_page_image(image):
+    """Label a page image 'blank' or 'text' from a low-resolution copy, before any OCR.
+
+    The page is reduced to CLASSIFY_WIDTH pixels wide and its ink (pixels
+    clearly darker than the background) is measured, which takes a few
+    milliseconds against seconds for preprocessing and OCR.
+    """
+    if not ENABLED:
+        return 'text'
+    gray = image if len(image.shape) == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = CLASSIFY_WIDTH / gray.shape[1]
+    if scale < 1.0:
+        gray = cv2.resize(gray, (CLASSIFY_WIDTH, max(1, int(gray.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    # A median filter removes scanner speckle that would otherwise count as ink
+    gray = cv2.medianBlur(gray, 3)
+    background = np.median(gray)
+    ink_ratio = np.count_nonzero(gray < background - INK_CONTRAST) / gray.size
+    return 'blank' if ink_ratio < BLANK_INK_RATIO else 'text'
+
+def classify_page_text(text):
+    """Label page text 'blank', 'table' or 'text'.
+
+    Table rows are lines with column separators or at least three numbers,
+    dates or amounts.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return 'blank'
+    rows = sum(line.count('|') >= 2 or len(_TABLE_CELL.findall(line)) >= 3 for line in lines)
+    return 'table' if rows / len(lines) >= TABLE_LINE_RATIO else 'text'
+
+def classify_document(pages):
+    """Return the document type of a list of page records from its first page with text.
+
+    The title lines of the page are searched from the top, and the first
+    line with a keyword decides the type.
+    """
+    if not ENABLED:
+        return 'unknown'
+    for page in pages:
+        if page['error'] or not page['text'].strip():
+            continue
+        lines = [' '.join(line.lower().split()) for line in page['text'].splitlines() if line.strip()]
+        for line in lines[:TITLE_LINES]:
+            for doc_type, keywords in DOCUMENT_KEYWORDS:
+                if any(keyword in line for keyword in keywords):
+                    return doc_type
+        return 'unknown'
+    return 'unknown'
+
+def document_fields(doc_type):
+    """Return the fields searched for a document type (None = all fields)."""
+    return DOCUMENT_PROFILES.get(doc_type, DOCUMENT_PROFILES['unknown'])['fields']
+
+def page_has_tables(page, doc_type='unknown'):
+    """Check whether tables should be parsed from a page record."""
+    if not ENABLED:
+        return True
+    page_type = page.get('page_type', 'text')
+    if PAGE_PROFILES[page_type]['skip']:
+        return False
+    return PAGE_PROFILES[page_type]['tables'] or DOCUMENT_PROFILES.get(
+        doc_type, DOCUMENT_PROFILES['unknown'])['tables']
@@ -0,0 +1,340 @@
+import os
+import sys
+import time
+import bisect
+import resource
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Set INSTRUMENTATION=0 to turn stage timing off entirely
+ENABLED = os.environ.get("INSTRUMENTATION", "1") != "0"
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "loan_doc"
+
+# Span lists currently collecting (see trace) and the page being processed
+_collectors = contextvars.ContextVar('collectors', default=())
+_current_page = contextvars.ContextVar('current_page', default=None)
+
+# Subprocess CPU totals of the stages currently running (see subprocess_cpu)
+_child_cpu = contextvars.ContextVar('child_cpu', default=())
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# /proc/self/statm counts memory in pages
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Seconds between RSS samples taken while stages run, to catch the peak of
+# memory freed again before a stage ends (0 = only sample at start and end)
+RSS_SAMPLE_INTERVAL = float(os.environ.get("RSS_SAMPLE_INTERVAL", "0.01"))
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+def current_rss():
+    """Return the current resident set size of this process in bytes, or None without /proc."""
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+class _RSSSampler:
+    """
+    Background thread tracking the highest RSS seen while each stage runs.
+
+    The thread is started by the first stage and sleeps on a condition while
+    no stage is running, so idle processes pay nothing.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        # Called again in forked children, where the thread does not exist
+        self._cond = threading.Condition()
+        self._peaks = {}
+        self._thread = None
+
+    def start(self, rss):
+        """Start tracking the peak of a stage that began at `rss`; returns its token."""
+        peak = [rss]
+        if rss is None or RSS_SAMPLE_INTERVAL <= 0:
+            return peak
+        with self._cond:
+            self._peaks[id(peak)] = peak
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return peak
+
+    def stop(self, peak, rss):
+        """Stop tracking a stage that ended at `rss` and return its peak RSS."""
+        with self._cond:
+            self._peaks.pop(id(peak), None)
+            if rss is not None and peak[0] is not None:
+                peak[0] = max(peak[0], rss)
+            return peak[0]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._peaks)
+            rss = current_rss()
+            with self._cond:
+                for peak in self._peaks.values():
+                    if rss is not None and rss > peak[0]:
+                        peak[0] = rss
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+_rss_sampler = _RSSSampler()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_rss_sampler._reset)
+
+def _children_cpu():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return children.ru_utime + children.ru_stime
+
+@contextmanager
+def subprocess_cpu():
+    """
+    Count the CPU time of subprocesses run in the enclosed block towards the enclosing stages.
+
+    Wrap code that starts and waits for a subprocess (tesseract, poppler
+    tools); the kernel reports a child's CPU time once it has been waited for.
+    """
+    totals = _child_cpu.get()
+    if not totals:
+        yield
+        return
+    start = _children_cpu()
+    try:
+        yield
+    finally:
+        used = _children_cpu() - start
+        for total in totals:
+            total[0] += used
+
+class MetricsRegistry:
+    """
+    Thread-safe aggregate of stage spans.
+
+    For every stage it keeps a histogram of wall time, the total CPU time and
+    the largest peak RSS growth of one run, and renders them in the Prometheus
+    text format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def observe(self, span):
+        """Add one span ({'stage', 'wall', 'cpu', 'rss_peak', ...}) to the aggregates."""
+        index = bisect.bisect_left(self.buckets, span['wall'])
+        with self._lock:
+            stats = self._stages.get(span['stage'])
+            if stats is None:
+                stats = self._stages[span['stage']] = {
+                    'buckets': [0] * len(self.buckets), 'count': 0,
+                    'wall': 0.0, 'cpu': 0.0, 'rss_peak': None,
+                }
+            if index < len(self.buckets):
+                stats['buckets'][index] += 1
+            stats['count'] += 1
+            stats['wall'] += span['wall']
+            stats['cpu'] += span['cpu']
+            stats['rss_peak'] = _max_delta(stats['rss_peak'], span['rss_peak'])
+
+    def snapshot(self):
+        """Return a copy of the per-stage aggregates."""
+        with self._lock:
+            return {stage: dict(stats, buckets=list(stats['buckets']))
+                    for stage, stats in self._stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        stages = sorted(self.snapshot().items())
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_seconds Wall-clock time spent in each pipeline stage.",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds histogram",
+        ]
+        for stage, stats in stages:
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats['buckets']):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {stats["wall"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_stage_cpu_seconds_total CPU time spent in each pipeline stage.",
+            f"# TYPE {METRIC_PREFIX}_stage_cpu_seconds_total counter",
+        ]
+        for stage, stats in stages:
+            lines.append(f'{METRIC_PREFIX}_stage_cpu_seconds_total{{stage="{stage}"}} {stats["cpu"]:.6f}')
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_stage_rss_peak_growth_bytes Largest growth of the resident set size above its start during one run of each stage.",
+            f"# TYPE {METRIC_PREFIX}_stage_rss_peak_growth_bytes gauge",
+        ]
+        for stage, stats in stages:
+            if stats['rss_peak'] is not None:
+                lines.append(f'{METRIC_PREFIX}_stage_rss_peak_growth_bytes{{stage="{stage}"}} {stats["rss_peak"]}')
+        return '\n'.join(lines) + '\n'
+
+def _max_delta(current, delta):
+    # RSS deltas are None where the current RSS cannot be read
+    if delta is None:
+        return current
+    return delta if current is None else max(current, delta)
+
+REGISTRY = MetricsRegistry()
+
+def record_span(span):
+    """Add a finished span to the registry and to every active trace."""
+    REGISTRY.observe(span)
+    for spans in _collectors.get():
+        spans.append(span)
+
+def merge_spans(spans):
+    """Record spans measured in another process, e.g. returned by a pool worker."""
+    for span in spans or ():
+        record_span(span)
+
+@contextmanager
+def stage(name, page=None):
+    """
+    Measure wall time, CPU time and resident memory of the enclosed block.
+
+    CPU time is that of the calling thread, so work of other threads is not
+    attributed to the stage, plus the CPU time of subprocesses the block runs
+    inside subprocess_cpu. 'rss_peak' is the largest growth of the RSS above
+    its value at the start, sampled every RSS_SAMPLE_INTERVAL seconds, so
+    memory freed again before the block ends still counts; 'rss_delta' is
+    the net change between start and end. Both are None without /proc. RSS
+    is process-wide, so concurrent stages in other threads add to the peak.
+
+    The span is attributed to `page`, or to the page of the enclosing trace.
+    The overhead is a few clock and /proc reads, so stages are cheap enough
+    to leave on. Nested stages are each recorded in full, so the time of an
+    inner stage is also part of its outer stage.
+    """
+    if not ENABLED:
+        yield
+        return
+    children = [0.0]
+    child_token = _child_cpu.set(_child_cpu.get() + (children,))
+    rss_start = current_rss()
+    peak = _rss_sampler.start(rss_start)
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        cpu = time.thread_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        _child_cpu.reset(child_token)
+        rss = current_rss()
+        rss_peak = _rss_sampler.stop(peak, rss)
+        known = rss is not None and rss_start is not None
+        record_span({
+            'stage': name,
+            'page': page if page is not None else _current_page.get(),
+            'wall': wall,
+            'cpu': cpu + children[0],
+            'rss_delta': rss - rss_start if known else None,
+            'rss_peak': rss_peak - rss_start if known else None,
+        })
+
+def timed(name):
+    """Decorator that runs the whole function as stage `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def trace(page=None):
+    """
+    Collect the spans recorded in the enclosed block.
+
+    Args:
+        page: Page number to attach to spans recorded inside the block
+
+    Yields:
+        List that receives each span as it finishes
+    """
+    spans = []
+    collectors_token = _collectors.set(_collectors.get() + (spans,))
+    page_token = _current_page.set(page) if page is not None else None
+    try:
+        yield spans
+    finally:
+        if page_token is not None:
+            _current_page.reset(page_token)
+        _collectors.reset(collectors_token)
+
+def summarize(spans):
+    """
+    Aggregate spans per stage.
+
+    Returns:
+        Dict of stage -> {'count', 'wall', 'cpu', 'rss_peak', 'rss_delta'}, in
+        first-seen order; 'rss_peak' and 'rss_delta' are the largest peak
+        growth and net change of the RSS in one run
+    """
+    summary = {}
+    for span in spans:
+        stats = summary.setdefault(span['stage'], {'count': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                   'rss_peak': None, 'rss_delta': None})
+        stats['count'] += 1
+        stats['wall'] += span['wall']
+        stats['cpu'] += span['cpu']
+        stats['rss_peak'] = _max_delta(stats['rss_peak'], span['rss_peak'])
+        stats['rss_delta'] = _max_delta(stats['rss_delta'], span['rss_delta'])
+    for stats in summary.values():
+        stats['wall'] = round(stats['wall'], 6)
+        stats['cpu'] = round(stats['cpu'], 6)
+    return summary
+
+def render_metrics():
+    """Return the process-wide metrics in the Prometheus text format."""
+    return REGISTRY.render()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Serve /metrics over HTTP from a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from contextlib import closing
+
+from ocr_utils import iter_pages_from_file, extract_document_fields, check_settings, SUPPORTED_EXTENSIONS
+from instrumentation import trace, summarize, render_metrics
+
+logger = logging.getLogger(__name__)
+
+# Base URL of a running job service (e.g. http://localhost:8765); unset = in-process queue
+JOB_SERVICE_URL = os.environ.get("JOB_SERVICE_URL")
+
+# Defaults for the worker pool and its limits
+DEFAULT_JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+DEFAULT_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "16"))
+DEFAULT_MAX_UPLOAD_MB = int(os.environ.get("JOB_MAX_UPLOAD_MB", "50"))
+
+# Number of finished jobs whose results are kept for polling
+DEFAULT_MAX_FINISHED = 100
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its pending limit."""
+
+class JobNotFoundError(KeyError):
+    """Raised for unknown or expired job ids."""
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job is cancelled between pages."""
+
+class Job:
+    """State of one document job, updated by the worker that runs it."""
+
+    def __init__(self, file_name, data, settings=None):
+        self.id = uuid.uuid4().hex
+        self.file_name = file_name
+        self.data = data
+        self.settings = settings
+        self.status = QUEUED
+        self.pages_done = 0
+        self.error = None
+        self.result = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self):
+        """Return the job status (without the result) as a JSON-ready dict."""
+        return {
+            'id': self.id,
+            'file_name': self.file_name,
+            'settings': self.settings,
+            'status': self.status,
+            'pages_done': self.pages_done,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+class JobQueue:
+    """
+    Bounded queue of document jobs processed by background worker threads.
+
+    Submitting keeps the document in memory (nothing is written to disk) and
+    returns a job id immediately; callers poll status() and result(). At most
+    `max_pending` jobs may wait at once, beyond which submit raises
+    QueueFullError. Running jobs are cancelled cooperatively between pages.
+    """
+
+    def __init__(self, workers=DEFAULT_JOB_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 max_finished=DEFAULT_MAX_FINISHED):
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._threads = [
+            threading.Thread(target=self._worker, name=f'ocr-job-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, data, file_name, settings=None):
+        """
+        Queue a document for processing.
+
+        Args:
+            data: Document contents as bytes
+            file_name: Original file name; its extension selects the pipeline
+            settings: Optional pipeline settings (see ocr_utils.check_settings)
+
+        Returns:
+            Job id
+        """
+        suffix = os.path.splitext(file_name)[1].lower()
+        if suffix not in SUPPORTED_EXTENSIONS:
+            raise ValueError(f"Unsupported file type: {suffix or file_name}")
+        check_settings(settings)
+
+        job = Job(file_name, bytes(data), settings or None)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+            self._pending += 1
+            self._jobs[job.id] = job
+        self._queue.put(job)
+        return job.id
+
+    def _get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(job_id)
+        return job
+
+    def status(self, job_id):
+        """Return the status dict of a job."""
+        job = self._get(job_id)
+        with self._lock:
+            return job.to_dict()
+
+    def result(self, job_id):
+        """Return the result of a finished job ({'text', 'fields', 'document_type', 'pages', 'timings'}), or None."""
+        return self._get(job_id).result
+
+    def cancel(self, job_id):
+        """Cancel a job. Queued jobs never start; running jobs stop before their next page."""
+        job = self._get(job_id)
+        job.cancel_event.set()
+        with self._lock:
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED)
+            return job.to_dict()
+
+    def stats(self):
+        """Return counts of jobs per status."""
+        with self._lock:
+            counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def _finish(self, job, status, error=None):
+        """Move a job to a finished state. Must be called with the lock held."""
+        if job.status == QUEUED:
+            self._pending -= 1
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job.data = None
+
+        # Forget the oldest finished jobs beyond the retention limit
+        finished = [job_id for job_id, other in self._jobs.items() if other.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status != QUEUED:
+                    continue
+                self._pending -= 1
+                job.status = RUNNING
+                job.started_at = time.time()
+            try:
+                result = self._run(job)
+            except JobCancelled:
+                with self._lock:
+                    self._finish(job, CANCELLED)
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job.id, job.file_name)
+                with self._lock:
+                    self._finish(job, FAILED, f"{type(e).__name__}: {e}")
+            else:
+                job.result = result
+                with self._lock:
+                    self._finish(job, DONE)
+
+    def _run(self, job):
+        pages = []
+        with trace() as spans:
+            with closing(iter_pages_from_file(job.data, file_name=job.file_name,
+                                              settings=job.settings)) as page_iter:
+                for page in page_iter:
+                    if job.cancel_event.is_set():
+                        raise JobCancelled()
+                    pages.append(page)
+                    job.pages_done = len(pages)
+            text = "\n\n".join(page['text'] for page in pages if not page['error'])
+            document_type, fields = extract_document_fields(pages)
+        return {'text': text, 'fields': fields, 'document_type': document_type, 'pages': pages,
+                'timings': summarize(spans)}
+
+class JobClient:
+    """Client for a job service started with `python job_service.py`, with JobQueue's interface."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _call(self, method, path, data=None):
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error')
+            except ValueError:
+                message = str(e)
+            if e.code == 429:
+                raise QueueFullError(message)
+            if e.code == 404:
+                raise JobNotFoundError(path)
+            if e.code == 400:
+                raise ValueError(message)
+            raise
+
+    def submit(self, data, file_name, settings=None):
+        query = {'name': file_name}
+        if settings:
+            query['settings'] = json.dumps(settings)
+        query = urllib.parse.urlencode(query)
+        return self._call('POST', f'/jobs?{query}', data=data)['id']
+
+    def status(self, job_id):
+        return self._call('GET', f'/jobs/{job_id}')
+
+    def result(self, job_id):
+        return self._call('GET', f'/jobs/{job_id}/result').get('result')
+
+    def cancel(self, job_id):
+        return self._call('DELETE', f'/jobs/{job_id}')
+
+    def stats(self):
+        return self._call('GET', '/jobs')
+
+def make_app(jobs):
+    """Build the tornado application exposing `jobs` over HTTP."""
+    import tornado.web
+
+    class BaseHandler(tornado.web.RequestHandler):
+        def write_json(self, payload, status=200):
+            self.set_status(status)
+            self.set_header('Content-Type', 'application/json')
+            self.finish(json.dumps(payload))
+
+    class JobsHandler(BaseHandler):
+        def get(self):
+            self.write_json(jobs.stats())
+
+        def post(self):
+            file_name = self.get_query_argument('name', None)
+            if not file_name:
+                self.write_json({'error': "Missing 'name' query argument"}, 400)
+                return
+            try:
+                settings = json.loads(self.get_query_argument('settings', 'null'))
+                job_id = jobs.submit(self.request.body, file_name, settings)
+            except QueueFullError as e:
+                # Backpressure: tell the client to retry later
+                self.set_header('Retry-After', '5')
+                self.write_json({'error': str(e)}, 429)
+                return
+            except ValueError as e:
+                self.write_json({'error': str(e)}, 400)
+                return
+            self.write_json({'id': job_id}, 202)
+
+    class JobHandler(BaseHandler):
+        def get(self, job_id):
+            try:
+                self.write_json(jobs.status(job_id))
+            except JobNotFoundError:
+                self.write_json({'error': 'Unknown job'}, 404)
+
+        def delete(self, job_id):
+            try:
+                self.write_json(jobs.cancel(job_id))
+            except JobNotFoundError:
+                self.write_json({'error': 'Unknown job'}, 404)
+
+    class JobResultHandler(BaseHandler):
+        def get(self, job_id):
+            try:
+                self.write_json({'result': jobs.result(job_id)})
+            except JobNotFoundError:
+                self.write_json({'error': 'Unknown job'}, 404)
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.finish(render_metrics())
+
+    return tornado.web.Application([
+        (r'/jobs', JobsHandler),
+        (r'/jobs/([0-9a-f]+)', JobHandler),
+        (r'/jobs/([0-9a-f]+)/result', JobResultHandler),
+        (r'/metrics', MetricsHandler),
+    ])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the document processing job service.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_JOB_WORKERS,
+                        help=f"Documents processed concurrently (default: {DEFAULT_JOB_WORKERS})")
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                        help=f"Queued jobs accepted before rejecting with 429 (default: {DEFAULT_MAX_PENDING})")
+    parser.add_argument('--max-upload-mb', type=int, default=DEFAULT_MAX_UPLOAD_MB,
+                        help=f"Largest accepted document in MB (default: {DEFAULT_MAX_UPLOAD_MB})")
+    args = parser.parse_args(argv)
+
+    import tornado.ioloop
+
+    logging.basicConfig(level=logging.INFO)
+    jobs = JobQueue(workers=args.workers, max_pending=args.max_pending)
+    app = make_app(jobs)
+    app.listen(args.port, address=args.host, max_body_size=args.max_upload_mb * 1024 * 1024)
+    logger.info("Job service listening on http://%s:%d", args.host, args.port)
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
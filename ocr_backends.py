@@ -0,0 +1,230 @@
+import io
+import os
+import shlex
+import logging
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+import pytesseract
+from PIL import Image
+
+from instrumentation import subprocess_cpu
+
+logger = logging.getLogger(__name__)
+
+# Backend used by perform_ocr: "auto", "tesserocr", "tesseract-batch" or "pytesseract"
+DEFAULT_OCR_BACKEND = os.environ.get("OCR_BACKEND", "auto")
+
+# Pages OCRed per tesseract run by the tesseract-batch backend
+DEFAULT_BATCH_PAGES = int(os.environ.get("OCR_BATCH_PAGES", "8"))
+
+# Columns of Tesseract's TSV output, as returned by pytesseract.image_to_data
+TSV_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text']
+
+_backends = {}
+
+def _to_pil(image):
+    """Convert an OpenCV array to a PIL image, passing PIL images through."""
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image)
+    return image
+
+def parse_tsv(tsv, header=True):
+    """Parse Tesseract TSV output into a DataFrame with TSV_COLUMNS."""
+    if not tsv.strip():
+        return pd.DataFrame(columns=TSV_COLUMNS)
+    df = pd.read_csv(io.StringIO(tsv), sep='\t', quoting=3, keep_default_na=False,
+                     header=0 if header else None, names=None if header else TSV_COLUMNS,
+                     dtype={'text': str})
+    df['conf'] = pd.to_numeric(df['conf'], errors='coerce')
+    return df
+
+class OCRBackend:
+    """Interface for OCR engines used by perform_ocr and extract_table_data."""
+
+    name = None
+
+    # Pages worth sending to images_to_data at once; backends without a cheaper
+    # batch call keep 1, so each page is yielded as soon as it is OCRed
+    batch_pages = 1
+
+    def image_to_string(self, image, config):
+        """Return the text recognized in a single image."""
+        raise NotImplementedError
+
+    def image_to_data(self, image, config):
+        """Return word-level results for a single image as a TSV_COLUMNS DataFrame."""
+        raise NotImplementedError
+
+    def images_to_string(self, images, config):
+        """Return the text of each image in a batch."""
+        return [self.image_to_string(image, config) for image in images]
+
+    def images_to_data(self, images, config):
+        """Return the word-level results of each image in a batch."""
+        return [self.image_to_data(image, config) for image in images]
+
+    def close(self):
+        """Release engine resources."""
+
+class PytesseractBackend(OCRBackend):
+    """One tesseract subprocess per call through pytesseract (the original behavior)."""
+
+    name = 'pytesseract'
+
+    def image_to_string(self, image, config):
+        with subprocess_cpu():
+            return pytesseract.image_to_string(_to_pil(image), config=config)
+
+    def image_to_data(self, image, config):
+        with subprocess_cpu():
+            return pytesseract.image_to_data(_to_pil(image), config=config,
+                                             output_type=pytesseract.Output.DATAFRAME)
+
+class TesseractBatchBackend(OCRBackend):
+    """
+    Runs the tesseract CLI once per batch of pages.
+
+    The language model is loaded once per invocation and all pages of the batch
+    are passed in a single list file, so per-page process startup is amortized.
+    """
+
+    name = 'tesseract-batch'
+
+    def __init__(self, tesseract_cmd=None, batch_pages=DEFAULT_BATCH_PAGES):
+        self.tesseract_cmd = tesseract_cmd or pytesseract.pytesseract.tesseract_cmd
+        self.batch_pages = max(1, batch_pages)
+
+    def _run(self, images, config, output_format=None):
+        with tempfile.TemporaryDirectory(prefix='ocr-batch-') as tmp_dir:
+            paths = []
+            for i, image in enumerate(images):
+                # Uncompressed PNG keeps the write cheap
+                path = os.path.join(tmp_dir, f'page-{i:05d}.png')
+                _to_pil(image).save(path, compress_level=0)
+                paths.append(path)
+            list_path = os.path.join(tmp_dir, 'pages.txt')
+            with open(list_path, 'w') as list_file:
+                list_file.write('\n'.join(paths) + '\n')
+
+            args = [self.tesseract_cmd, list_path, 'stdout'] + shlex.split(config)
+            if output_format:
+                args.append(output_format)
+            with subprocess_cpu():
+                result = subprocess.run(args, capture_output=True, check=True)
+        return result.stdout.decode('utf-8', errors='replace')
+
+    def image_to_string(self, image, config):
+        return self.images_to_string([image], config)[0]
+
+    def images_to_string(self, images, config):
+        if not images:
+            return []
+        # The text renderer terminates every page with a form feed
+        texts = self._run(images, config).split('\f')
+        return (texts + [''] * len(images))[:len(images)]
+
+    def image_to_data(self, image, config):
+        return self.images_to_data([image], config)[0]
+
+    def images_to_data(self, images, config):
+        if not images:
+            return []
+        # One TSV for the whole list; page_num tells the images apart
+        data = parse_tsv(self._run(images, config, output_format='tsv'))
+        return [data[data['page_num'] == i].reset_index(drop=True) for i in range(1, len(images) + 1)]
+
+class TesserocrBackend(OCRBackend):
+    """
+    Keeps a warm Tesseract engine per thread through the tesserocr C API binding.
+
+    The language model is loaded once and reused for every page, and images are
+    passed in memory, so there is no process startup or temp-file I/O per call.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, lang='eng'):
+        try:
+            import tesserocr
+        except ImportError:
+            raise ImportError("tesserocr is required for this backend. Install it with: pip install tesserocr")
+        self._tesserocr = tesserocr
+        self.lang = lang
+        self._local = threading.local()
+        self._apis = []
+
+    def _api(self, config):
+        """Return this thread's engine, recreating it if the OEM changes."""
+        tesserocr = self._tesserocr
+        args = shlex.split(config)
+        oem = int(args[args.index('--oem') + 1]) if '--oem' in args else 3
+        psm = int(args[args.index('--psm') + 1]) if '--psm' in args else 3
+
+        api = getattr(self._local, 'api', None)
+        # Engines inherited through fork are not reused; each process warms its own
+        if api is None or self._local.oem != oem or self._local.pid != os.getpid():
+            if api is not None and self._local.pid == os.getpid():
+                api.End()
+            # tesserocr's OEM and PSM are plain int constants, so the modes are passed as ints
+            api = tesserocr.PyTessBaseAPI(lang=self.lang, oem=oem)
+            self._local.api = api
+            self._local.oem = oem
+            self._local.pid = os.getpid()
+            self._apis.append(api)
+        api.SetPageSegMode(psm)
+        return api
+
+    def image_to_string(self, image, config):
+        api = self._api(config)
+        api.SetImage(_to_pil(image))
+        return api.GetUTF8Text()
+
+    def image_to_data(self, image, config):
+        api = self._api(config)
+        api.SetImage(_to_pil(image))
+        api.Recognize()
+        return parse_tsv(api.GetTSVText(0), header=False)
+
+    def close(self):
+        for api in self._apis:
+            api.End()
+        self._apis = []
+        self._local = threading.local()
+
+BACKENDS = {
+    'pytesseract': PytesseractBackend,
+    'tesseract-batch': TesseractBatchBackend,
+    'tesserocr': TesserocrBackend,
+}
+
+def get_backend(name=None):
+    """
+    Return a shared OCR backend instance for the current process.
+
+    Args:
+        name: Backend name, or None for DEFAULT_OCR_BACKEND. "auto" prefers the
+            warm tesserocr engine and falls back to pytesseract.
+
+    Returns:
+        OCRBackend instance
+    """
+    name = name or DEFAULT_OCR_BACKEND
+    if name == 'auto':
+        if 'auto' not in _backends:
+            try:
+                _backends['auto'] = get_backend('tesserocr')
+            except ImportError:
+                logger.warning("tesserocr is not installed; OCR starts one tesseract process per call. "
+                               "Install it with: pip install tesserocr")
+                _backends['auto'] = get_backend('pytesseract')
+        return _backends['auto']
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name}")
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
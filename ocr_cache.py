@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+from pathlib import Path
+
+# Bump when the layout of cached page records changes, or which pages they cover
+# (3: every page of multi-page TIFFs, previously only the first)
+CACHE_FORMAT_VERSION = 3
+
+DEFAULT_CACHE_DIR = Path(os.environ.get(
+    "OCR_CACHE_DIR", Path.home() / ".cache" / "loan-document-processing"
+))
+DEFAULT_CACHE_MAX_MB = int(os.environ.get("OCR_CACHE_MAX_MB", "512"))
+
+_default_cache = None
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def params_fingerprint(params):
+    """Return a stable hash of the parameters that affect OCR output."""
+    payload = json.dumps({'format': CACHE_FORMAT_VERSION, 'params': params},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def make_cache_key(source, params, digest=None):
+    """
+    Build a content-addressed cache key for a document.
+
+    Args:
+        source: Path to the document, or its contents as bytes
+        params: Dict of preprocessing/OCR parameters used to produce the result
+        digest: SHA-256 hex digest of the contents if the caller already has
+            it (see file_digest), so the document is not hashed again
+
+    Returns:
+        Cache key combining the content hash and the parameter fingerprint
+    """
+    if digest is None:
+        if isinstance(source, bytes):
+            digest = hashlib.sha256(source).hexdigest()
+        else:
+            digest = file_digest(source)
+    return f"{digest}:{params_fingerprint(params)}"
+
+class OCRCache:
+    """
+    Persistent, size-bounded LRU cache of per-page OCR results.
+
+    Entries live in a SQLite database in WAL mode, so several worker processes
+    can read and write the same cache concurrently. When the total stored size
+    exceeds `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / "ocr_cache.sqlite"
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " data BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # A fresh connection per operation keeps the cache safe to use after fork
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def get(self, key):
+        """Return the cached page records for `key`, or None on a miss."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        finally:
+            conn.close()
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, key, pages):
+        """Store page records under `key` and evict old entries beyond the size limit."""
+        data = zlib.compress(json.dumps(pages).encode('utf-8'))
+        if len(data) > self.max_bytes:
+            return
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, data, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time())
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evict = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", evict)
+
+    def clear(self):
+        """Remove all cached entries."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM entries")
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Return the number of entries and total stored bytes."""
+        conn = self._connect()
+        try:
+            count, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        finally:
+            conn.close()
+        return {'entries': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+def get_default_cache():
+    """Return the process-wide cache, or None if disabled with OCR_CACHE_MAX_MB=0."""
+    global _default_cache
+    if DEFAULT_CACHE_MAX_MB <= 0:
+        return None
+    if _default_cache is None:
+        _default_cache = OCRCache()
+    return _default_cache
@@ -1,187 +1,1368 @@
 import os
 import re
+import logging
+import subprocess
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import pytesseract
 import cv2
 import numpy as np
 import pandas as pd
-from PIL import Image
-from preprocessing import process_image_for_ocr, convert_pdf_to_images
+from preprocessing import (process_image_for_ocr, run_preprocessing, iter_pdf_pages_for_ocr,
+                           iter_tiff_pages_for_ocr, load_image, get_pdf_page_count, get_tiff_page_count,
+                           resolve_params, get_stage_memo, stage_key, preprocess_region, is_path, as_bytes,
+                           PREPROCESSING_PARAMS, LIGHT_PARAMS, REGION_VARIANTS)
+from document_profiles import (classify_page_image, classify_page_text, classify_document, document_fields,
+                               profile_params, PAGE_PROFILES)
+from ocr_cache import get_default_cache, make_cache_key, params_fingerprint
+from ocr_backends import get_backend
+from page_buffers import create_pool, open_page
+from page_index import get_default_index
+from instrumentation import stage, timed, trace, merge_spans, subprocess_cpu
 
-def perform_ocr(image):
+logger = logging.getLogger(__name__)
+
+# Number of worker processes used to OCR PDF pages (1 = sequential)
+DEFAULT_OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "1"))
+
+# Tesseract configuration used for page OCR
+OCR_ENGINE_MODE = 3
+PAGE_SEGMENTATION_MODE = 6
+OCR_CONFIG = f'--oem {OCR_ENGINE_MODE} --psm {PAGE_SEGMENTATION_MODE}'
+
+# "full" runs the complete preprocessing on every page; "two-tier" OCRs a lightly
+# preprocessed page and reprocesses only its low-confidence lines
+OCR_MODES = ('full', 'two-tier')
+DEFAULT_OCR_MODE = os.environ.get("OCR_MODE", "full")
+
+# Two-tier mode: lines whose mean word confidence is below REPROCESS_MIN_CONF are
+# reprocessed; when more than REPROCESS_MAX_LINE_SHARE of the lines are weak, the
+# whole page goes through full preprocessing instead
+REPROCESS_MIN_CONF = float(os.environ.get("REPROCESS_MIN_CONF", "60"))
+REPROCESS_MAX_LINE_SHARE = 0.5
+
+# Margin in pixels around a reprocessed line, and the page segmentation mode used on it
+REGION_PADDING = 6
+LINE_SEGMENTATION_MODE = 7
+
+# Most field lines OCRed again to verify a near-duplicate page; pages with more
+# are OCRed in full instead, which costs about the same
+VERIFY_MAX_LINES = int(os.environ.get("PAGE_INDEX_MAX_VERIFY_LINES", "40"))
+
+# Keys accepted in pipeline settings: PREPROCESSING_PARAMS overrides, the OCR
+# engine mode and the OCR mode
+SETTINGS_KEYS = set(PREPROCESSING_PARAMS) | {'oem', 'ocr_mode'}
+
+def check_settings(settings):
+    """Raise ValueError if pipeline settings are not a dict or contain unknown keys."""
+    if settings is not None and not isinstance(settings, dict):
+        raise ValueError("Pipeline settings must be a dict")
+    unknown = sorted(set(settings or ()) - SETTINGS_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown pipeline settings: {', '.join(unknown)}")
+    mode = (settings or {}).get('ocr_mode', DEFAULT_OCR_MODE)
+    if mode not in OCR_MODES:
+        raise ValueError(f"Unknown OCR mode: {mode} (choose from {', '.join(OCR_MODES)})")
+
+def ocr_config(psm=None, oem=None):
+    """Return the Tesseract configuration with another page segmentation or engine mode, if given."""
+    if psm is None and oem is None:
+        return OCR_CONFIG
+    return (f'--oem {OCR_ENGINE_MODE if oem is None else int(oem)} '
+            f'--psm {PAGE_SEGMENTATION_MODE if psm is None else int(psm)}')
+
+# Word-level columns kept from Tesseract's TSV output in OCR results
+WORD_COLUMNS = ['block_num', 'par_num', 'line_num', 'word_num',
+                'left', 'top', 'width', 'height', 'conf', 'text']
+
+# Minimum number of alphanumeric characters for a PDF page's text layer to be used
+MIN_TEXT_LAYER_CHARS = 20
+
+# File types accepted by iter_pages_from_file
+SUPPORTED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff', '.txt'}
+
+@timed('ocr')
+def perform_ocr(image, backend=None):
     """
-    Perform OCR on the processed image using pytesseract.
+    Perform OCR on the processed image.
     
     Args:
         image: Processed image ready for OCR
+        backend: OCR backend name or instance (None = DEFAULT_OCR_BACKEND)
         
     Returns:
         Extracted text as a string
     """
-    if isinstance(image, np.ndarray):
-        # Convert OpenCV image to PIL format
-        image = Image.fromarray(image)
-    
-    # Configure pytesseract parameters for better results
-    custom_config = r'--oem 3 --psm 6'
+    if not hasattr(backend, 'image_to_string'):
+        backend = get_backend(backend)
     
     # Perform OCR
-    text = pytesseract.image_to_string(image, config=custom_config)
+    text = backend.image_to_string(image, OCR_CONFIG)
     
     return text
 
-def extract_text_from_file(file_path):
+def words_to_text(words):
+    """Rebuild page text from word rows: lines joined by newlines, paragraphs by blank lines."""
+    if words.empty:
+        return ''
+    lines = words.groupby(['block_num', 'par_num', 'line_num'], sort=True)['text'].agg(' '.join)
+    paragraphs = lines.groupby(level=['block_num', 'par_num'], sort=True).agg('\n'.join)
+    return '\n\n'.join(paragraphs) + '\n'
+
+def _page_result(data):
+    """Build an OCR result ({'text', 'words'}) from a backend's TSV_COLUMNS DataFrame."""
+    # Keep word-level rows (level 5) that contain text
+    words = data[data['level'] == 5].copy()
+    words['text'] = words['text'].fillna('').astype(str).str.strip()
+    words = words[words['text'] != ''][WORD_COLUMNS].reset_index(drop=True)
+    return {'text': words_to_text(words), 'words': words}
+
+@timed('ocr')
+def ocr_page_data(image, backend=None, config=None):
     """
-    Extract text from an image, PDF file, or text file.
+    Run a single OCR pass that returns text, word boxes and confidences together.
     
     Args:
-        file_path: Path to the image, PDF, or text file
+        image: Processed image ready for OCR
+        backend: OCR backend name or instance (None = DEFAULT_OCR_BACKEND)
+        config: Tesseract configuration (None = OCR_CONFIG)
         
     Returns:
-        Extracted text as a string
+        Dict with 'text' (reconstructed page text) and 'words' (DataFrame with
+        WORD_COLUMNS: block/paragraph/line/word numbers, bounding box, confidence
+        and text of every recognized word)
+    """
+    if not hasattr(backend, 'image_to_data'):
+        backend = get_backend(backend)
+    return _page_result(backend.image_to_data(image, config or OCR_CONFIG))
+
+def page_words(page):
+    """Return the word DataFrame stored in a page record, or None for non-OCR pages."""
+    if not page.get('words'):
+        return None
+    return pd.DataFrame(page['words'], columns=WORD_COLUMNS)
+
+@timed('ocr')
+def perform_ocr_batch(images, backend=None, config=None):
+    """
+    Perform OCR on a batch of processed images in as few engine calls as possible.
+    
+    Args:
+        images: List of processed images ready for OCR
+        backend: OCR backend name or instance (None = DEFAULT_OCR_BACKEND)
+        config: Tesseract configuration (None = OCR_CONFIG)
+        
+    Returns:
+        List of results as returned by ocr_page_data, one per image
+    """
+    if not hasattr(backend, 'images_to_data'):
+        backend = get_backend(backend)
+    return [_page_result(data) for data in backend.images_to_data(list(images), config or OCR_CONFIG)]
+
+def _init_ocr_worker():
+    """Keep OpenCV single-threaded inside pool workers to avoid oversubscription."""
+    cv2.setNumThreads(1)
+
+def _memoized_ocr_batch(items):
+    """
+    OCR (processed image, image key, config) items, reusing the stage memo's results.
+    
+    Items the memo does not answer are OCRed with one perform_ocr_batch call per config.
+    """
+    memo = get_stage_memo()
+    backend = get_backend()
+    results, keys = [None] * len(items), [None] * len(items)
+    pending = {}
+    for i, (processed_img, image_key, config) in enumerate(items):
+        if memo and image_key is not None:
+            keys[i] = stage_key(image_key, 'ocr', {'config': config, 'backend': backend.name})
+            hit = memo.get(keys[i])
+            if hit is not None:
+                results[i] = hit[0]
+                continue
+        pending.setdefault(config, []).append(i)
+    for config, indices in pending.items():
+        batch = perform_ocr_batch([items[i][0] for i in indices], backend=backend, config=config)
+        for i, result in zip(indices, batch):
+            results[i] = result
+            if keys[i] is not None:
+                memo.put(keys[i], result, {},
+                         size=int(result['words'].memory_usage(deep=True).sum()) + len(result['text']))
+    return results
+
+def _memoized_ocr(processed_img, image_key, config):
+    """OCR a preprocessed page, reusing the stage memo's result for the same image and config."""
+    return _memoized_ocr_batch([(processed_img, image_key, config)])[0]
+
+def _mean_conf(words):
+    return float(words['conf'].mean()) if not words.empty else -1.0
+
+def _reprocess_lines(page, lines, settings, oem):
+    """
+    OCR weak lines cropped from a lightly preprocessed page with REGION_VARIANTS, in order.
+    
+    Each variant OCRs the crops of all lines still below REPROCESS_MIN_CONF
+    in one perform_ocr_batch call. A line stops at the first variant whose
+    reading reaches REPROCESS_MIN_CONF; otherwise its most confident reading
+    is kept.
+    
+    Args:
+        page: Lightly preprocessed page image
+        lines: Dict of line id (block, paragraph, line number) -> word DataFrame
+        settings: Pipeline settings (see check_settings)
+        oem: OCR engine mode, or None for the default
+        
+    Returns:
+        Dict of line id -> word DataFrame of the line's best reading in page
+        coordinates, with the block/paragraph/line numbers of the original line
+    """
+    height, width = page.shape[:2]
+    crops = {}
+    for line_id, line_words in lines.items():
+        left = max(0, int(line_words['left'].min()) - REGION_PADDING)
+        top = max(0, int(line_words['top'].min()) - REGION_PADDING)
+        right = min(width, int((line_words['left'] + line_words['width']).max()) + REGION_PADDING)
+        bottom = min(height, int((line_words['top'] + line_words['height']).max()) + REGION_PADDING)
+        if right > left and bottom > top:
+            crops[line_id] = (page[top:bottom, left:right], left, top)
+    config = ocr_config(LINE_SEGMENTATION_MODE, oem)
+    
+    best = {}
+    pending = list(crops)
+    for variant in REGION_VARIANTS:
+        if not pending:
+            break
+        images = [preprocess_region(crops[line_id][0], variant, settings) for line_id in pending]
+        for line_id, result in zip(pending, perform_ocr_batch(images, config=config)):
+            words = result['words']
+            if not words.empty and (line_id not in best or _mean_conf(words) > _mean_conf(best[line_id][0])):
+                best[line_id] = (words, variant['scale'])
+        pending = [line_id for line_id in pending
+                   if line_id not in best or _mean_conf(best[line_id][0]) < REPROCESS_MIN_CONF]
+    
+    readings = {}
+    for line_id, (words, scale) in best.items():
+        # Map boxes back from the (scaled) crop to the page and keep the line's position in the page
+        _, left, top = crops[line_id]
+        words = words.copy()
+        for column, offset in (('left', left), ('top', top), ('width', 0), ('height', 0)):
+            words[column] = (words[column] / scale).round().astype(int) + offset
+        for column, value in zip(('block_num', 'par_num', 'line_num'), line_id):
+            words[column] = value
+        words['word_num'] = range(1, len(words) + 1)
+        readings[line_id] = words
+    return readings
+
+def ocr_two_tier(image, settings=None, report=None, config=None):
+    """
+    OCR a page with light preprocessing, reprocessing only low-confidence lines.
+    
+    The page is resized, converted to grayscale and deskewed, but neither
+    denoised nor thresholded, and OCRed. Lines whose mean word confidence is
+    below REPROCESS_MIN_CONF are cropped and OCRed again with heavier
+    REGION_VARIANTS (see _reprocess_lines), keeping a reading only if it is
+    more confident.
+    When most lines are weak, the page is preprocessed in full instead.
+    
+    Args:
+        image: Page image as an OpenCV array
+        settings: Pipeline settings (see check_settings)
+        report: Optional dict that receives preprocessing decisions
+        config: Tesseract configuration of the page pass (None = OCR_CONFIG)
+        
+    Returns:
+        Dict with 'text' and 'words', as returned by ocr_page_data
+    """
+    settings = settings or {}
+    report = {} if report is None else report
+    config = config or OCR_CONFIG
+    
+    with stage('preprocess'):
+        light, light_key = run_preprocessing(image, dict(settings, **LIGHT_PARAMS), report)
+    result = _memoized_ocr(light, light_key, config)
+    words = result['words']
+    
+    line_columns = ['block_num', 'par_num', 'line_num']
+    line_conf = words.groupby(line_columns, sort=False)['conf'].mean()
+    weak = line_conf[line_conf < REPROCESS_MIN_CONF]
+    report['ocr_mode'] = 'two-tier'
+    report['weak_lines'] = len(weak)
+    
+    if words.empty or len(weak) > REPROCESS_MAX_LINE_SHARE * len(line_conf):
+        report['reprocessed'] = 'page'
+        with stage('preprocess'):
+            processed, key = run_preprocessing(image, settings, report)
+        full = _memoized_ocr(processed, key, config)
+        return full if _mean_conf(full['words']) >= _mean_conf(words) else result
+    if weak.empty:
+        return result
+    
+    report['reprocessed'] = 'lines'
+    with stage('reprocess'):
+        lines = {line_id: line_words for line_id, line_words in words.groupby(line_columns, sort=False)
+                 if line_id in weak.index}
+        readings = _reprocess_lines(light, lines, settings, settings.get('oem'))
+    replacements = {line_id: better for line_id, better in readings.items()
+                    if _mean_conf(better) > weak[line_id]}
+    report['improved_lines'] = len(replacements)
+    if not replacements:
+        return result
+    
+    kept = words[~words.set_index(line_columns).index.isin(list(replacements))]
+    words = pd.concat([kept] + list(replacements.values()), ignore_index=True)
+    words = words.sort_values(line_columns + ['word_num'], kind='stable').reset_index(drop=True)
+    return {'text': words_to_text(words), 'words': words[WORD_COLUMNS]}
+
+def _line_key(text):
+    """Letters and digits of a line, lowercased, for comparing two readings of it."""
+    return re.sub(r'[^0-9a-z]', '', text.lower())
+
+def _stack_crops(crops, gap=2 * REGION_PADDING):
+    """
+    Stack image crops vertically, left-aligned on white, for a single OCR pass.
+    
+    Returns:
+        (image, tops) where tops[i] is the row at which crop i starts
+    """
+    width = max(crop.shape[1] for crop in crops)
+    tops = np.cumsum([0] + [crop.shape[0] + gap for crop in crops[:-1]])
+    height = int(tops[-1]) + crops[-1].shape[0]
+    stacked = np.full((height, width) + crops[0].shape[2:], 255, dtype=crops[0].dtype)
+    for top, crop in zip(tops, crops):
+        stacked[top:top + crop.shape[0], :crop.shape[1]] = crop
+    return stacked, tops
+
+def _verify_field_lines(page, words, oem=None):
+    """
+    OCR again the lines of a reused page record that can hold field values, cropped from `page`.
+    
+    These are lines with digits (amounts, dates, account numbers), lines with
+    a field keyword and the line after each, since values wrap. They are what
+    differs between otherwise identical pages, e.g. two pay stubs of the same
+    employer, and a changed digit or name is too small to tell from scanning
+    noise visually. The line crops are stacked into one image and OCRed in a
+    single pass, so verification costs one engine call whatever the backend.
+    
+    Returns:
+        Number of lines checked, or None if any line reads differently or
+        there are more than VERIFY_MAX_LINES of them
+    """
+    words = pd.DataFrame(words)
+    if words.empty:
+        return 0
+    height, width = page.shape[:2]
+    crops, expected = [], []
+    after_keyword = False
+    for _, line_words in words.groupby(['block_num', 'par_num', 'line_num'], sort=False):
+        text = ' '.join(line_words['text'].astype(str))
+        has_keyword = bool(_FIELD_KEYWORDS.search(text))
+        checked = has_keyword or after_keyword or any(c.isdigit() for c in text)
+        after_keyword = has_keyword
+        if not checked or not _line_key(text):
+            continue
+        left = max(0, int(line_words['left'].min()) - REGION_PADDING)
+        top = max(0, int(line_words['top'].min()) - REGION_PADDING)
+        right = min(width, int((line_words['left'] + line_words['width']).max()) + REGION_PADDING)
+        bottom = min(height, int((line_words['top'] + line_words['height']).max()) + REGION_PADDING)
+        if right <= left or bottom <= top:
+            return None
+        crops.append(page[top:bottom, left:right])
+        expected.append(_line_key(text))
+    if not crops:
+        return 0
+    if len(crops) > VERIFY_MAX_LINES:
+        return None
+    
+    stacked, tops = _stack_crops(crops)
+    read = ocr_page_data(stacked, config=ocr_config(PAGE_SEGMENTATION_MODE, oem))['words']
+    # Each word belongs to the crop its vertical center falls in
+    centers = (read['top'] + read['height'] / 2).to_numpy()
+    crop_index = np.searchsorted(tops, centers, side='right') - 1
+    texts = [''] * len(crops)
+    for i, text in zip(crop_index, read['text']):
+        texts[i] += str(text)
+    if any(_line_key(text) != key for text, key in zip(texts, expected)):
+        return None
+    return len(crops)
+
+def _reuse_near_duplicate(page_num, light, index, index_params, settings, report):
+    """Return the record of a verified near-duplicate of a page OCRed before, or None."""
+    match = index.lookup(light, index_params)
+    if match is None:
+        return None
+    record = match['record']
+    words = record['words']
+    if words:
+        # Word boxes follow the new scan's position on the page
+        dx, dy = match['offset']
+        words = dict(words, left=[round(v + dx) for v in words['left']],
+                     top=[round(v + dy) for v in words['top']])
+    with stage('verify_lines'):
+        checked = _verify_field_lines(light, words, (settings or {}).get('oem'))
+    report['near_duplicate'] = {'distance': match['distance'], 'verified_lines': checked,
+                                'reused': checked is not None}
+    if checked is None:
+        return None
+    return {'page': page_num, 'text': record['text'], 'words': words, 'error': None,
+            'source': record['source'], 'page_type': record['page_type'], 'preprocessing': report}
+
+def _prepare_page(page_num, image, report, settings=None, index=None):
+    """
+    Run everything before a page's OCR pass: classification, near-duplicate lookup and preprocessing.
+    
+    `index` is the PageIndex to use (None = default index, False = none).
+    
+    Returns:
+        (record, None) for pages that need no separate OCR pass (blank,
+        reused and two-tier pages), or (None, job) where job holds the
+        processed image, image key and config to OCR and is completed with
+        _finish_page
+    """
+    page_type = classify_page_image(image)
+    profile = PAGE_PROFILES[page_type]
+    if profile['skip']:
+        return {'page': page_num, 'text': '', 'words': None, 'error': None, 'source': 'skipped',
+                'page_type': page_type, 'preprocessing': report}, None
+    
+    if index is None:
+        index = get_default_index()
+    job = {'page': page_num, 'report': report, 'index': index or None, 'light': None,
+           'index_params': None}
+    if job['index'] is not None:
+        # Pages are indexed after light preprocessing, so resolution and skew
+        # differences between scans do not matter, and word boxes line up
+        with stage('preprocess'):
+            job['light'], _ = run_preprocessing(image, dict(settings or {}, **LIGHT_PARAMS), report)
+        job['index_params'] = params_fingerprint(ocr_params(False, settings))
+        record = _reuse_near_duplicate(page_num, job['light'], job['index'], job['index_params'],
+                                       settings, report)
+        if record is not None:
+            return record, None
+    
+    config = ocr_config(oem=(settings or {}).get('oem'))
+    if (settings or {}).get('ocr_mode', DEFAULT_OCR_MODE) == 'two-tier':
+        return _finish_page(job, ocr_two_tier(image, settings, report, config)), None
+    # Stages whose inputs and parameters are unchanged are reused from the stage memo
+    with stage('preprocess'):
+        processed_img, image_key = run_preprocessing(image, settings, report)
+    job['ocr'] = (processed_img, image_key, config)
+    return None, job
+
+def _finish_page(job, result):
+    """Build the record of a page prepared by _prepare_page from its OCR result."""
+    record = {'page': job['page'], 'text': result['text'], 'words': result['words'].to_dict('list'),
+              'error': None, 'source': 'ocr', 'page_type': classify_page_text(result['text']),
+              'preprocessing': job['report']}
+    if job['index'] is not None:
+        job['index'].add(job['light'], job['index_params'],
+                         {key: record[key] for key in ('text', 'words', 'source', 'page_type')})
+    return record
+
+def _ocr_page(page_num, image, report, settings=None, index=None):
+    """
+    Classify a page image, then preprocess and OCR it as its page profile says.
+    
+    With the page index enabled, a page that is a verified near-duplicate of
+    a page OCRed before with the same parameters reuses that page's result.
+    """
+    record, job = _prepare_page(page_num, image, report, settings, index)
+    if job is None:
+        return record
+    return _finish_page(job, _memoized_ocr(*job['ocr']))
+
+def _error_record(page_num, error, report):
+    return {'page': page_num, 'text': '', 'words': None, 'error': f"{type(error).__name__}: {error}",
+            'source': 'ocr', 'page_type': None, 'preprocessing': report}
+
+def ocr_page_image(page_num, image, settings=None, index=None):
+    """
+    Classify, preprocess and OCR a single page image.
+    
+    Args:
+        page_num: 1-based page number, used for reporting
+        image: Page image as an OpenCV (BGR or grayscale) array
+        settings: Pipeline settings overriding PREPROCESSING_PARAMS and the OCR engine mode
+        index: PageIndex of near-duplicate pages (None = default index, False = none)
+        
+    Returns:
+        Page record dict with 'page', 'text', 'words', 'error', 'source',
+        'page_type', 'preprocessing' and 'timings' keys. 'words' holds the
+        WORD_COLUMNS of the OCR result as a dict of lists (see page_words) and
+        'timings' the stage spans measured for the page. Blank pages are not
+        OCRed and have source 'skipped'. Failures are captured in 'error'
+        instead of being raised.
+    """
+    report = {}
+    with trace(page=page_num) as spans:
+        try:
+            record = _ocr_page(page_num, image, report, settings, index)
+        except Exception as e:
+            record = _error_record(page_num, e, report)
+    record['timings'] = spans
+    return record
+
+def ocr_page_window(pages, settings=None, index=None):
+    """
+    Classify, preprocess and OCR a window of pages with one batched OCR call.
+    
+    Pages are prepared one by one as in ocr_page_image, then every page that
+    needs an OCR pass goes to the engine in a single perform_ocr_batch call,
+    so backends such as tesseract-batch start once per window instead of
+    once per page.
+    
+    Args:
+        pages: List of (page_num, image) pairs
+        settings: Pipeline settings (see check_settings)
+        index: PageIndex of near-duplicate pages (None = default index, False = none)
+        
+    Returns:
+        Page records as returned by ocr_page_image, in the order of `pages`.
+        The batched OCR spans are shared out equally among the window's
+        OCRed pages in their 'timings'.
+    """
+    records, timings, jobs = {}, {}, []
+    for page_num, image in pages:
+        report = {}
+        with trace(page=page_num) as spans:
+            try:
+                records[page_num], job = _prepare_page(page_num, image, report, settings, index)
+            except Exception as e:
+                records[page_num], job = _error_record(page_num, e, report), None
+        timings[page_num] = spans
+        if job is not None:
+            jobs.append(job)
+    
+    if jobs:
+        with trace() as batch_spans:
+            try:
+                results = _memoized_ocr_batch([job['ocr'] for job in jobs])
+            except Exception as e:
+                results = [e] * len(jobs)
+        for job, result in zip(jobs, results):
+            page_num = job['page']
+            timings[page_num] += [
+                dict(span, page=page_num, wall=span['wall'] / len(jobs), cpu=span['cpu'] / len(jobs))
+                for span in batch_spans
+            ]
+            with trace(page=page_num) as spans:
+                try:
+                    if isinstance(result, Exception):
+                        raise result
+                    records[page_num] = _finish_page(job, result)
+                except Exception as e:
+                    records[page_num] = _error_record(page_num, e, job['report'])
+            timings[page_num] += spans
+    
+    for page_num, _ in pages:
+        records[page_num]['timings'] = timings[page_num]
+    return [records[page_num] for page_num, _ in pages]
+
+def _ocr_shared_page(page_num, handle, settings=None, index=None):
+    """Worker entry point: OCR a page read in place from a shared page buffer."""
+    return ocr_page_image(page_num, open_page(handle), settings, index)
+
+def iter_ocr_pages(images, workers=None, page_nums=None, settings=None, index=None):
+    """
+    OCR an iterable of page images, yielding page records in page order.
+    
+    Pages are pulled from `images` lazily. Sequentially, backends that OCR
+    several images in one call (see OCRBackend.batch_pages) get windows of
+    pages (see ocr_page_window). In parallel mode at most two pages per
+    worker are in flight at once, so memory stays bounded for long documents.
+    Each page is copied once into a shared-memory buffer that workers read in
+    place, instead of being pickled to them (see page_buffers).
+    
+    Args:
+        images: Iterable of page images as OpenCV arrays
+        workers: Number of worker processes (1 = sequential, None = DEFAULT_OCR_WORKERS)
+        page_nums: Page numbers matching `images` (defaults to 1, 2, ...)
+        settings: Pipeline settings (see check_settings)
+        index: PageIndex of near-duplicate pages (None = default index, False = none)
+        
+    Yields:
+        Page records as returned by ocr_page_image
+    """
+    workers = DEFAULT_OCR_WORKERS if workers is None else workers
+    numbered = zip(page_nums, images) if page_nums is not None else enumerate(images, start=1)
+    
+    if workers <= 1:
+        window_size = get_backend().batch_pages
+        if window_size <= 1:
+            for page_num, image in numbered:
+                yield ocr_page_image(page_num, image, settings, index)
+            return
+        # Backends that OCR a batch in one call get windows of pages
+        window = []
+        for page_num, image in numbered:
+            window.append((page_num, image))
+            if len(window) >= window_size:
+                yield from ocr_page_window(window, settings, index)
+                window = []
+        if window:
+            yield from ocr_page_window(window, settings, index)
+        return
+    
+    # One buffer per page in flight; a buffer is reused once its page's result is back
+    pool = create_pool(2 * workers)
+    
+    def submit(page_num, image):
+        if pool is None:
+            return executor.submit(ocr_page_image, page_num, image, settings, index), None
+        with stage('page_handoff', page=page_num):
+            handle = pool.put(image)
+        return executor.submit(_ocr_shared_page, page_num, handle, settings, index), handle
+    
+    def collect(task):
+        future, handle = task
+        try:
+            record = future.result()
+        finally:
+            if handle is not None:
+                pool.release(handle)
+        # Spans measured in the worker count towards this process's metrics
+        merge_spans(record['timings'])
+        return record
+    
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker)
+    try:
+        pending = deque()
+        for page_num, image in numbered:
+            pending.append(submit(page_num, image))
+            # Results are collected in submission order, so page order is kept
+            if len(pending) >= 2 * workers:
+                yield collect(pending.popleft())
+        while pending:
+            yield collect(pending.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Workers are gone, so no page buffer is mapped for reading anymore
+        if pool is not None:
+            pool.close()
+
+@timed('text_layer')
+def extract_pdf_text_layer(pdf):
+    """
+    Extract the embedded text layer of every page of a PDF with poppler's pdftotext.
+    
+    Args:
+        pdf: Path to the PDF file, or the PDF's bytes
+        
+    Returns:
+        List with one string per page (empty for pages without text), or None
+        if pdftotext is unavailable or fails on the file
+    """
+    # In-memory PDFs are piped through stdin
+    in_memory = not is_path(pdf)
+    try:
+        with subprocess_cpu():
+            result = subprocess.run(
+                ['pdftotext', '-layout', '-enc', 'UTF-8', '-' if in_memory else str(pdf), '-'],
+                input=pdf if in_memory else None, capture_output=True, check=True
+            )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.info("No text layer extracted from %s: %s", 'PDF data' if in_memory else pdf, e)
+        return None
+    
+    # pdftotext terminates every page with a form feed
+    pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+    return pages[:-1] if len(pages) > 1 else pages
+
+def has_usable_text_layer(text):
+    """Check whether a page's embedded text is substantial and not garbled."""
+    stripped = ''.join(text.split())
+    alnum = sum(ch.isalnum() for ch in stripped)
+    if alnum < MIN_TEXT_LAYER_CHARS:
+        return False
+    # Broken font encodings show up as replacement or control characters
+    garbled = sum(ch == '\ufffd' or not ch.isprintable() for ch in stripped)
+    return garbled / len(stripped) < 0.05
+
+def ocr_pages(images, workers=None):
+    """
+    OCR a sequence of page images, optionally across a process pool.
+    
+    Args:
+        images: Iterable of page images as OpenCV arrays
+        workers: Number of worker processes (1 = sequential, None = DEFAULT_OCR_WORKERS)
+        
+    Returns:
+        List of page records in page order
+    """
+    return list(iter_ocr_pages(images, workers=workers))
+
+def _iter_pdf_pages_text(pdf, workers=None, use_text_layer=True, settings=None, index=None):
+    """Yield page records for a PDF, using the text layer where usable and OCR elsewhere."""
+    text_layer = extract_pdf_text_layer(pdf) if use_text_layer else None
+    
+    scanned = None
+    if text_layer is not None:
+        scanned = [n for n, text in enumerate(text_layer, start=1) if not has_usable_text_layer(text)]
+    
+    # Rasterize lazily, straight at the OCR working resolution
+    images = iter_pdf_pages_for_ocr(pdf, page_numbers=scanned, params=settings)
+    ocr_results = iter_ocr_pages(images, workers=workers, page_nums=scanned, settings=settings, index=index)
+    
+    if text_layer is None:
+        yield from ocr_results
+        return
+    
+    scanned = set(scanned)
+    for page_num, text in enumerate(text_layer, start=1):
+        if page_num in scanned:
+            yield next(ocr_results)
+        else:
+            yield {'page': page_num, 'text': text, 'words': None, 'error': None, 'source': 'text_layer',
+                   'page_type': classify_page_text(text)}
+
+@lru_cache(maxsize=1)
+def _tesseract_version():
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return 'unknown'
+
+def _ocr_mode_params(mode):
+    if mode != 'two-tier':
+        return mode
+    return {
+        'mode': mode,
+        'light': LIGHT_PARAMS,
+        'variants': REGION_VARIANTS,
+        'min_conf': REPROCESS_MIN_CONF,
+        'max_line_share': REPROCESS_MAX_LINE_SHARE,
+        'padding': REGION_PADDING,
+        'line_psm': LINE_SEGMENTATION_MODE,
+    }
+
+def ocr_params(use_text_layer=True, settings=None):
+    """Return every parameter that affects extracted page text, for cache keys."""
+    return {
+        'preprocessing': resolve_params(settings),
+        'ocr_config': ocr_config(oem=(settings or {}).get('oem')),
+        'ocr_mode': _ocr_mode_params((settings or {}).get('ocr_mode', DEFAULT_OCR_MODE)),
+        'ocr_backend': get_backend().name,
+        'tesseract': _tesseract_version(),
+        'text_layer': use_text_layer and MIN_TEXT_LAYER_CHARS,
+        'profiles': profile_params(),
+    }
+
+# Leading bytes of TIFF and BigTIFF files, little- and big-endian
+TIFF_SIGNATURES = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+
+def document_type(file_path, file_name=None):
+    """
+    Return 'pdf', 'tiff', 'text' or 'image' for a document.
+    
+    The type comes from the extension of `file_name` or of the path. In-memory
+    documents without a name are recognized as PDF or TIFF by their signature
+    and treated as images otherwise.
+    """
+    name = file_name or (str(file_path) if is_path(file_path) else None)
+    if name:
+        file_ext = os.path.splitext(name)[1].lower()
+        if file_ext == '.pdf':
+            return 'pdf'
+        if file_ext in ['.tif', '.tiff']:
+            return 'tiff'
+        if file_ext in ['.txt', '.text']:
+            return 'text'
+        return 'image'
+    if file_path[:5] == b'%PDF-':
+        return 'pdf'
+    return 'tiff' if file_path[:4] in TIFF_SIGNATURES else 'image'
+
+def document_page_count(file_path, file_name=None):
+    """
+    Return the number of pages of a document without rasterizing or OCRing it.
+    
+    Args:
+        file_path: Path to the document, or its contents as bytes
+        file_name: Original file name of in-memory contents (see document_type)
+        
+    Returns:
+        Page count; images and text files have one page
+    """
+    doc_type = document_type(file_path, file_name)
+    if doc_type == 'pdf':
+        return get_pdf_page_count(file_path)
+    if doc_type == 'tiff':
+        return get_tiff_page_count(file_path)
+    return 1
+
+def _iter_pages_uncached(file_path, doc_type, workers=None, use_text_layer=True, settings=None,
+                         index=None):
+    """Extract page records from a PDF, TIFF or image without consulting the OCR cache."""
+    if doc_type in ('pdf', 'tiff'):
+        if doc_type == 'pdf':
+            name = file_path if is_path(file_path) else 'in-memory PDF'
+            pages = _iter_pdf_pages_text(file_path, workers=workers, use_text_layer=use_text_layer,
+                                         settings=settings, index=index)
+        else:
+            # TIFF scans have no text layer; every page is read lazily and OCRed
+            name = file_path if is_path(file_path) else 'in-memory TIFF'
+            pages = iter_ocr_pages(iter_tiff_pages_for_ocr(file_path, params=settings), workers=workers,
+                                   settings=settings, index=index)
+        for page in pages:
+            if page['error']:
+                logger.warning("OCR failed on page %d of %s: %s", page['page'], name, page['error'])
+            yield page
+    else:
+        # Process single image file; unlike PDF pages, failures are raised
+        report = {}
+        with trace(page=1) as spans:
+            page = _ocr_page(1, load_image(file_path), report, settings, index)
+        page['timings'] = spans
+        yield page
+
+def iter_pages_from_file(file_path, workers=None, use_text_layer=True, cache=None, file_name=None,
+                         settings=None, index=None, digest=None):
     """
-    file_ext = os.path.splitext(file_path)[1].lower()
+    Extract text page by page from an image, PDF file, or text file.
+    
+    PDF pages with a usable embedded text layer are read directly; the rest are
+    rasterized and OCRed one at a time, so the first page's record is yielded
+    before later pages are rendered. Multi-page TIFF scans are read the same
+    way, one page at a time from the memory-mapped file. Results of images and PDFs are looked up in
+    and stored to the OCR cache, keyed by file content and pipeline parameters.
+    
+    Documents can also be passed in memory (bytes or a readable buffer such as
+    a Streamlit upload); they are decoded and rasterized without temp files.
+    
+    Args:
+        file_path: Path to the image, PDF, or text file, or its contents
+        workers: Number of worker processes used for PDF and TIFF pages
+        use_text_layer: Read embedded PDF text instead of OCRing where possible
+        cache: OCRCache to use (None = default cache, False = no caching)
+        file_name: Original file name of in-memory contents, used to tell the
+            document type (see document_type)
+        settings: Pipeline settings overriding PREPROCESSING_PARAMS and the OCR
+            engine mode, e.g. {'threshold_type': 'otsu', 'oem': 1}
+        index: PageIndex used to reuse the OCR of near-duplicate pages (None =
+            default index, False = none). cache=False turns it off as well,
+            so no earlier result is reused.
+        digest: SHA-256 of the document if already computed (see
+            ocr_cache.file_digest), used for the cache key instead of hashing
+            the document again
+        
+    Yields:
+        Page records ({'page', 'text', 'words', 'error', 'source', 'page_type'}) in page order
+    """
+    check_settings(settings)
+    if not is_path(file_path):
+        file_path = as_bytes(file_path)
+    doc_type = document_type(file_path, file_name)
     
     # Handle text files directly
-    if file_ext in ['.txt', '.text']:
+    if doc_type == 'text':
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            if is_path(file_path):
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    text = file.read()
+            else:
+                text = file_path.decode('utf-8')
         except Exception as e:
             raise ValueError(f"Error reading text file: {e}")
+        yield {'page': 1, 'text': text, 'words': None, 'error': None, 'source': 'text',
+               'page_type': classify_page_text(text)}
+        return
     
-    elif file_ext == '.pdf':
-        # Convert PDF to images
-        images = convert_pdf_to_images(file_path)
-        
-        # Process each page and perform OCR
-        texts = []
-        for img in images:
-            # Convert PIL image to OpenCV format
-            open_cv_image = np.array(img) 
-            # Convert RGB to BGR (OpenCV format)
-            open_cv_image = open_cv_image[:, :, ::-1].copy() 
-            
-            processed_img = process_image_for_ocr(open_cv_image)
-            texts.append(perform_ocr(processed_img))
+    if cache is None:
+        cache = get_default_cache()
+    if cache is False and index is None:
+        index = False
+    
+    key = None
+    if cache:
+        with stage('cache_lookup'):
+            key = make_cache_key(file_path, ocr_params(use_text_layer, settings), digest=digest)
+            cached_pages = cache.get(key)
+        if cached_pages is not None:
+            yield from cached_pages
+            return
+    
+    pages = []
+    for page in _iter_pages_uncached(file_path, doc_type, workers=workers, use_text_layer=use_text_layer,
+                                     settings=settings, index=index):
+        pages.append(page)
+        yield page
+    
+    # Only complete, error-free results are cached so transient failures are retried.
+    # Timings describe this run only and are not cached.
+    if key is not None and not any(page['error'] for page in pages):
+        with stage('cache_store'):
+            cache.put(key, [{k: v for k, v in page.items() if k != 'timings'} for page in pages])
+
+def extract_pages_from_file(file_path, workers=None, use_text_layer=True, cache=None, file_name=None,
+                            settings=None, index=None, digest=None):
+    """
+    Extract text page by page from an image, PDF file, or text file.
+    
+    Args:
+        file_path: Path to the image, PDF, or text file, or its contents as bytes/buffer
+        workers: Number of worker processes used for PDF pages
+        use_text_layer: Read embedded PDF text instead of OCRing where possible
+        cache: OCRCache to use (None = default cache, False = no caching)
+        file_name: Original file name of in-memory contents
+        settings: Pipeline settings (see iter_pages_from_file)
+        index: PageIndex of near-duplicate pages (see iter_pages_from_file)
+        digest: SHA-256 of the document if already computed (see iter_pages_from_file)
         
-        return "\n\n".join(texts)
-    else:
-        # Process single image file
-        processed_img = process_image_for_ocr(file_path)
-        return perform_ocr(processed_img)
+    Returns:
+        List of page records ({'page', 'text', 'words', 'error', 'source'}) in page order
+    """
+    return list(iter_pages_from_file(file_path, workers=workers, use_text_layer=use_text_layer,
+                                     cache=cache, file_name=file_name, settings=settings, index=index,
+                                     digest=digest))
+
+def extract_text_from_file(file_path, workers=None, use_text_layer=True, cache=None, file_name=None,
+                           settings=None, index=None):
+    """
+    Extract text from an image, PDF file, or text file.
+    
+    Args:
+        file_path: Path to the image, PDF, or text file, or its contents as bytes/buffer
+        workers: Number of worker processes used for PDF pages
+        use_text_layer: Read embedded PDF text instead of OCRing where possible
+        cache: OCRCache to use (None = default cache, False = no caching)
+        file_name: Original file name of in-memory contents
+        settings: Pipeline settings (see iter_pages_from_file)
+        index: PageIndex of near-duplicate pages (see iter_pages_from_file)
+        
+    Returns:
+        Extracted text as a string. Pages that failed OCR are left out and
+        logged; use extract_pages_from_file to inspect per-page errors.
+    """
+    pages = extract_pages_from_file(file_path, workers=workers, use_text_layer=use_text_layer,
+                                    cache=cache, file_name=file_name, settings=settings, index=index)
+    return "\n\n".join(page['text'] for page in pages if not page['error'])
+
+# Value building blocks: text values stay on the keyword's line (or the next
+# one, past separator lines such as '-----') and must start with a letter or
+# digit, numbers tolerate common OCR digit confusions
+_LABEL = r'[^\S\n]*:[^\S\n]*\n?(?:[^\S\n]*[-=_][-=_ \t]*\n)*[^\S\n]*'
+_TEXT = r"([A-Za-z0-9][A-Za-z0-9 \t.,#'/&-]*)"
+_NAME = r"([A-Za-z][A-Za-z \t.'-]*)"
+_NUMBER = r'([0-9][0-9OolI,.]*)'
+
+# Field extraction rules: (keywords, value pattern matched right after a
+# keyword, value type used for cleaning). Keywords are lowercase regexes that
+# start with a literal letter.
+FIELD_RULES = {
+    'loan_amount': (('loan amount',), r'[:\s]*[$]?\s*' + _NUMBER, 'number'),
+    'interest_rate': (('interest rate',), r'[:\s]*' + _NUMBER + r'\s*%?', 'number'),
+    'loan_term': (('loan term',), r'[:\s]*([0-9]+)\s+(years|months)', 'term'),
+    'loan_type': (('loan type',), _LABEL + _TEXT, 'text'),
+    'borrower_name': ((r"borrower(?:'s)?\s+name",), _LABEL + _NAME, 'name'),
+    'borrower_address': (('address', 'residence'), _LABEL + _TEXT, 'text'),
+    'borrower_phone': (('phone', 'telephone'), r'[:\s]*\(?([0-9]{3})\)?[\s.-]?([0-9]{3})[\s.-]?([0-9]{4})', 'phone'),
+    'borrower_email': (('email',), r'[:\s]*([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})', 'email'),
+    'social_security': (('ssn', 'social security'), r'[:\s]*([0-9]{3})-?([0-9]{2})-?([0-9]{4})', 'ssn'),
+    'application_date': (('application', 'date'), r'[:\s]*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', 'date'),
+    'lender_name': ((r'lender(?:\s+name)?',), _LABEL + _NAME, 'name'),
+    'collateral': (('collateral',), _LABEL + _TEXT, 'text'),
+}
 
-# Extraction patterns for common loan document fields
+# Fields that must be found before incremental extraction stops (comma-separated
+# REQUIRED_FIELDS environment variable; default: every field)
+DEFAULT_REQUIRED_FIELDS = tuple(
+    field.strip() for field in os.environ.get("REQUIRED_FIELDS", ",".join(FIELD_RULES)).split(",")
+    if field.strip()
+)
+
+# Extraction patterns for common loan document fields (keyword followed by value)
 PATTERNS = {
-    'loan_amount': r'loan amount[:\s]*[$]?([0-9,\.]+)',
-    'interest_rate': r'interest rate[:\s]*([0-9\.]+)[%]?',
-    'loan_term': r'loan term[:\s]*([0-9]+)\s+(years|months)',
-    'loan_type': r'loan type[:\s]*([A-Za-z\s]+)',
-    'borrower_name': r'borrower(?:\'s)?\s+name[:\s]*([A-Za-z\s]+)',
-    'borrower_address': r'(?:address|residence)[:\s]*([A-Za-z0-9\s\.,#-]+)',
-    'borrower_phone': r'(?:phone|telephone)[:\s]*\(?([0-9]{3})\)?[\s.-]?([0-9]{3})[\s.-]?([0-9]{4})',
-    'borrower_email': r'email[:\s]*([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
-    'social_security': r'(?:SSN|social security)[:\s]*([0-9]{3})-?([0-9]{2})-?([0-9]{4})',
-    'application_date': r'(?:application|date)[:\s]*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-    'lender_name': r'lender[:\s]*([A-Za-z\s]+)',
-    'collateral': r'collateral[:\s]*([A-Za-z0-9\s\.,#-]+)'
+    field: '(?:' + '|'.join(keywords) + ')' + value
+    for field, (keywords, value, _) in FIELD_RULES.items()
 }
 
-def clean_extracted_value(value):
-    """Clean extracted values from OCR text."""
+# Any field keyword; lines with one are OCRed again before a near-duplicate page is reused
+_FIELD_KEYWORDS = re.compile(
+    '|'.join(keyword for keywords, _, _ in FIELD_RULES.values() for keyword in keywords), re.IGNORECASE
+)
+
+# Characters OCR commonly reads in place of digits
+_OCR_DIGIT_FIXES = str.maketrans({'O': '0', 'o': '0', 'l': '1', 'I': '1'})
+
+def clean_extracted_value(value, field_type='text'):
+    """
+    Clean extracted values from OCR text according to the field's type.
+    
+    Args:
+        value: Raw extracted value
+        field_type: "number", "date", "name", "email" or "text"
+        
+    Returns:
+        Cleaned value
+    """
     if value is None:
         return None
     
     # Remove extra whitespace
     value = re.sub(r'\s+', ' ', value).strip()
     
-    # Replace common OCR errors
-    value = value.replace('l', '1')
-    value = value.replace('O', '0')
+    # Replace common OCR errors only where letters cannot be valid
+    if field_type in ('number', 'date'):
+        value = value.translate(_OCR_DIGIT_FIXES).rstrip('.,')
+    elif field_type == 'email':
+        value = value.lower()
+    elif field_type == 'name':
+        value = value.strip(" .,;-")
+        if value.isupper() or value.islower():
+            value = value.title()
+    else:
+        value = value.rstrip(" .,;-")
     
     return value
 
-def extract_loan_details(text):
+class FieldExtractor:
+    """
+    Compiled single-pass extractor for loan document fields.
+    
+    All field keywords are located in one scan of a lowercased copy of the
+    text with a combined keyword pattern. Each field's value pattern is then
+    only tried right after its keyword, within `window` characters, on the
+    original text so values keep their case. The scan stops as soon as every
+    requested field has been found.
     """
-    Extract loan details from OCR text using regex patterns.
+    
+    def __init__(self, rules=None, window=200):
+        rules = FIELD_RULES if rules is None else rules
+        self.fields = list(rules)
+        self.window = window
+        
+        # Every alternative starts with a literal character, which lets the regex
+        # engine skip positions that cannot start a keyword. Group names encode
+        # the field index; word boundaries are checked on the (rare) matches.
+        alternatives = '|'.join(
+            f'{kw[0]}(?P<f{i}_{j}>{kw[1:]})'
+            for i, (keywords, _, _) in enumerate(rules.values()) for j, kw in enumerate(keywords)
+        )
+        self.anchor_re = re.compile(alternatives)
+        self.anchor_re_ci = re.compile(alternatives, re.IGNORECASE)
+        self.value_res = [re.compile(value, re.IGNORECASE) for _, value, _ in rules.values()]
+        self.types = [field_type for _, _, field_type in rules.values()]
+    
+    def extract(self, text, fields=None):
+        """
+        Extract fields from text.
+        
+        Args:
+            text: Text to search
+            fields: Optional subset of field names to extract
+            
+        Returns:
+            Dictionary of cleaned field values, in rule order
+        """
+        wanted = set(self.fields if fields is None else fields)
+        found = {}
+        
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            anchors = self.anchor_re.finditer(lowered)
+        else:
+            # Some characters change length when lowercased; offsets would not line up
+            anchors = self.anchor_re_ci.finditer(text)
+        
+        for anchor in anchors:
+            index = int(anchor.lastgroup[1:].partition('_')[0])
+            field = self.fields[index]
+            if field in found or field not in wanted:
+                continue
+            
+            # Keywords must start at a word boundary
+            if anchor.start() > 0 and (text[anchor.start() - 1].isalnum() or text[anchor.start() - 1] == '_'):
+                continue
+            
+            start = anchor.end()
+            match = self.value_res[index].match(text, start, start + self.window)
+            if match is None:
+                continue
+            
+            field_type = self.types[index]
+            if field_type == 'phone':
+                found[field] = f"({match.group(1)}) {match.group(2)}-{match.group(3)}"
+            elif field_type == 'ssn':
+                found[field] = f"{match.group(1)}-{match.group(2)}-{match.group(3)}"
+            elif field_type == 'term':
+                found[field] = f"{match.group(1)} {match.group(2).lower()}"
+            else:
+                found[field] = clean_extracted_value(match.group(1), field_type)
+            
+            if len(found) == len(wanted):
+                break
+        
+        return {field: found[field] for field in self.fields if field in found}
+
+_field_extractor = FieldExtractor()
+
+@timed('extract_fields')
+def extract_loan_details(text, fields=None):
+    """
+    Extract loan details from OCR text in a single pass over the text.
     
     Args:
-        text: OCR extracted text
+        text: OCR extracted text, or an OCR result / page record with a 'text' key
+        fields: Optional subset of field names to extract
         
     Returns:
         Dictionary of extracted loan details
     """
-    # Standardize text for easier pattern matching
-    text = text.lower()
-    
-    # Dict to store the extracted information
-    extracted_info = {}
-    
-    # Apply each pattern and extract information
-    for field, pattern in PATTERNS.items():
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            if field == 'borrower_phone':
-                # Format phone number
-                extracted_info[field] = f"({match.group(1)}) {match.group(2)}-{match.group(3)}"
-            elif field == 'social_security':
-                # Format SSN
-                extracted_info[field] = f"{match.group(1)}-{match.group(2)}-{match.group(3)}"
-            elif field == 'loan_term':
-                # Combine term number and unit
-                extracted_info[field] = f"{match.group(1)} {match.group(2)}"
-            else:
-                extracted_info[field] = match.group(1)
-                
-            # Clean extracted value
-            extracted_info[field] = clean_extracted_value(extracted_info[field])
+    if isinstance(text, dict):
+        text = text['text']
     
-    return extracted_info
+    return _field_extractor.extract(text, fields)
 
-def extract_table_data(image, table_area=None):
+def extract_document_fields(pages):
+    """
+    Classify a document and extract the loan fields its type carries.
+    
+    Args:
+        pages: Page records, as returned by extract_pages_from_file
+        
+    Returns:
+        Tuple of (document type, dictionary of extracted loan details); see
+        document_profiles for the types and the fields searched for each
+    """
+    doc_type = classify_document(pages)
+    text = "\n\n".join(page['text'] for page in pages if not page['error'])
+    return doc_type, extract_loan_details(text, fields=document_fields(doc_type))
+
+class IncrementalExtraction:
+    """
+    Extracts loan fields page by page and stops once the required fields are found.
+    
+    Pages are pulled lazily from iter_pages_from_file, so pages after the
+    stopping point are never rasterized or OCRed. Calling extract() again
+    with more required fields, or finish(), resumes where processing stopped.
+    Fields keep the value from the first page they appear on, as with
+    extract_loan_details on the whole text. The document type is classified
+    from the first page with text; fields its profile does not carry are
+    neither searched nor waited for.
+    
+    Usage:
+        with IncrementalExtraction(path) as extraction:
+            fields = extraction.extract(['loan_amount', 'borrower_name'])
+    """
+    
+    def __init__(self, file_path, workers=None, use_text_layer=True, cache=None, file_name=None,
+                 settings=None, digest=None):
+        if not is_path(file_path):
+            file_path = as_bytes(file_path)
+        self._file_path, self._file_name = file_path, file_name
+        self._page_count = None
+        self._page_iter = iter_pages_from_file(file_path, workers=workers, use_text_layer=use_text_layer,
+                                               cache=cache, file_name=file_name, settings=settings,
+                                               digest=digest)
+        self.pages = []
+        self.exhausted = False
+        self.document_type = None
+        self._searched = list(FIELD_RULES)
+        self._found = {}
+    
+    @property
+    def fields(self):
+        """Fields found so far, in rule order."""
+        return {field: self._found[field] for field in FIELD_RULES if field in self._found}
+    
+    @property
+    def complete(self):
+        """
+        Whether every page of the document has been processed.
+        
+        Extraction can stop on the last page before the page iterator reports
+        its end, so the pages processed are compared with the page count.
+        """
+        if self.exhausted:
+            return True
+        if self._page_count is None:
+            self._page_count = document_page_count(self._file_path, self._file_name)
+        return len(self.pages) >= self._page_count
+    
+    def _next_page(self):
+        page = next(self._page_iter, None)
+        if page is None:
+            self.exhausted = True
+            return None
+        self.pages.append(page)
+        if self.document_type is None and not page['error'] and page['text'].strip():
+            self.document_type = classify_document([page])
+            self._searched = document_fields(self.document_type) or list(FIELD_RULES)
+        if not page['error']:
+            missing = [field for field in self._searched if field not in self._found]
+            if missing:
+                self._found.update(extract_loan_details(page['text'], fields=missing))
+        return page
+    
+    def extract(self, required_fields=None):
+        """
+        Process pages until every required field is found or the document ends.
+        
+        Args:
+            required_fields: Field names that must be found (None = DEFAULT_REQUIRED_FIELDS)
+            
+        Returns:
+            Dictionary of the fields found so far
+        """
+        required = set(DEFAULT_REQUIRED_FIELDS if required_fields is None else required_fields)
+        while not self.exhausted and not required.intersection(self._searched).issubset(self._found):
+            self._next_page()
+        return self.fields
+    
+    def finish(self):
+        """Process all remaining pages and return the fields."""
+        while not self.exhausted:
+            self._next_page()
+        return self.fields
+    
+    def close(self):
+        """Stop processing; pending pages and any OCR workers are released."""
+        self._page_iter.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def extract_table_data(image=None, table_area=None, ocr_result=None):
     """
     Extract tabular data from document images.
     
     Args:
-        image: Image containing table
-        table_area: Optional bounding box of table area (x, y, width, height)
+        image: Image containing table (not needed when ocr_result is given)
+        table_area: Optional bounding box of table area (x, y, width, height).
+            With ocr_result, it is given in the OCRed page's coordinates.
+        ocr_result: Existing OCR result or page record to reuse instead of
+            running OCR again
         
     Returns:
         DataFrame with extracted table data
     """
-    # If table area is specified, crop the image
-    if table_area is not None:
-        x, y, w, h = table_area
-        image = image[y:y+h, x:x+w]
+    if ocr_result is not None:
+        words = ocr_result['words']
+        if not isinstance(words, pd.DataFrame):
+            words = page_words(ocr_result)
+        if words is None:
+            return pd.DataFrame()
+        
+        # Keep words whose center falls inside the table area
+        if table_area is not None:
+            x, y, w, h = table_area
+            cx = words['left'] + words['width'] / 2
+            cy = words['top'] + words['height'] / 2
+            words = words[(cx >= x) & (cx < x + w) & (cy >= y) & (cy < y + h)]
+        table_data = words
+    else:
+        # If table area is specified, crop the image
+        if table_area is not None:
+            x, y, w, h = table_area
+            image = image[y:y+h, x:x+w]
+        
+        # Process image for better OCR results
+        processed = process_image_for_ocr(image)
+        table_data = ocr_page_data(processed)['words']
+    
+    return build_table(table_data)
+
+# Currency, percent and thousands separators are dropped; "(5.00)" reads as -5.00
+_NUMBER_TRANSLATION = str.maketrans('(', '-', '$,%) ')
+
+def _to_numbers(values):
+    """Parse an object array of strings to floats (NaN where not numeric)."""
+    cleaned = np.array([value.translate(_NUMBER_TRANSLATION) for value in values.ravel()], dtype=object)
+    return pd.to_numeric(cleaned, errors='coerce').reshape(values.shape)
+
+def _join_runs(texts, starts):
+    """Join the consecutive runs of strings that begin at each index in `starts`."""
+    texts = np.asarray(texts, dtype=object)
+    ends = np.r_[starts[1:], len(texts)]
+    joined = texts[starts]
+    # Most runs are a single word; only multi-word runs need a Python join
+    for i in np.flatnonzero(ends - starts > 1):
+        joined[i] = ' '.join(texts[starts[i]:ends[i]])
+    return joined
+
+@timed('table')
+def build_table(words, min_conf=50, cell_gap=1.2):
+    """
+    Reconstruct a table from OCR word rows with vectorized NumPy/pandas operations.
+    
+    Rows are the Tesseract lines (block/paragraph/line). Within a row, words
+    closer than `cell_gap` times the median word height form one cell. Columns
+    come from clustering the x-extents of cells, and every column whose values
+    all parse as numbers is converted to a numeric dtype.
+    
+    Args:
+        words: DataFrame with WORD_COLUMNS
+        min_conf: Words at or below this confidence are dropped
+        cell_gap: Horizontal gap, relative to word height, that separates cells
+        
+    Returns:
+        DataFrame with one row per table line and one column per detected column
+    """
+    words = words[words['conf'] > min_conf]
+    text = words['text'].astype(str).str.strip()
+    # Drop empty words and ruling characters such as | and ----
+    keep = (text != '') & ~text.str.fullmatch(r'[|\-_=+]+')
+    words = words[keep].assign(text=text[keep])
+    if words.empty:
+        return pd.DataFrame()
     
-    # Process image for better OCR results
-    processed = process_image_for_ocr(image)
+    # Rows: one per Tesseract line, in reading order
+    words = words.sort_values(['block_num', 'par_num', 'line_num', 'left'], kind='stable')
+    row = words.groupby(['block_num', 'par_num', 'line_num'], sort=False).ngroup().to_numpy()
+    left = words['left'].to_numpy()
+    right = left + words['width'].to_numpy()
+    texts = words['text'].to_numpy(dtype=object)
     
-    # Use pytesseract to extract table data
-    table_data = pytesseract.image_to_data(processed, output_type=pytesseract.Output.DATAFRAME)
+    # Cells: runs of words in a row separated by less than the cell gap
+    max_gap = cell_gap * float(np.median(words['height']))
+    prev_right = np.r_[-np.inf, right[:-1]]
+    new_row = np.r_[True, row[1:] != row[:-1]]
+    cell_start = np.flatnonzero(new_row | (left - prev_right > max_gap))
+    cell_row = row[cell_start]
+    cell_left = left[cell_start]
+    cell_right = np.maximum.reduceat(right, cell_start)
+    cell_text = _join_runs(texts, cell_start)
     
-    # Filter out rows with low confidence
-    table_data = table_data[table_data['conf'] > 50]
+    # Keep the block of lines from the first to the last multi-cell row, so a
+    # page title or key/value preamble doesn't end up in the table
+    multi = np.bincount(cell_row)[cell_row] > 1
+    if multi.any():
+        in_table = (cell_row >= cell_row[multi].min()) & (cell_row <= cell_row[multi].max())
+        anchors = multi[in_table]
+        cell_row, cell_left, cell_right, cell_text = (
+            cell_row[in_table], cell_left[in_table], cell_right[in_table], cell_text[in_table])
+    else:
+        anchors = np.ones(len(cell_row), dtype=bool)
     
-    # Group by line number
-    lines = {}
-    for _, row in table_data.iterrows():
-        if row['text'].strip():
-            if row['block_num'] not in lines:
-                lines[row['block_num']] = []
-            lines[row['block_num']].append(row['text'])
+    # Columns: merge overlapping x-extents of the multi-cell rows' cells
+    order = np.argsort(cell_left[anchors], kind='stable')
+    starts = cell_left[anchors][order]
+    reach = np.maximum.accumulate(cell_right[anchors][order])
+    col_starts = starts[np.r_[True, starts[1:] > reach[:-1]]]
+    column = np.clip(np.searchsorted(col_starts, cell_left, side='right') - 1, 0, None)
     
-    # Create DataFrame from extracted lines
-    rows = []
-    for _, line in lines.items():
-        if line:  # Skip empty lines
-            rows.append(line)
+    # Cells are ordered by row and then x, so cells sharing a grid slot are adjacent
+    slot = cell_row * len(col_starts) + column
+    slot_start = np.flatnonzero(np.r_[True, slot[1:] != slot[:-1]])
+    _, grid_row = np.unique(cell_row[slot_start], return_inverse=True)
+    grid = np.full((grid_row.max() + 1, len(col_starts)), '', dtype=object)
+    grid[grid_row, column[slot_start]] = _join_runs(cell_text, slot_start)
+    numeric = _to_numbers(grid)
     
-    # Create DataFrame (handling varying column counts)
-    max_cols = max(len(row) for row in rows) if rows else 0
-    for i, row in enumerate(rows):
-        while len(row) < max_cols:
-            row.append('')
+    # Use the first row as the header when it has no numbers but the rows below do
+    header = None
+    if len(grid) > 1 and np.isnan(numeric[0]).all() and not np.isnan(numeric[1:]).all():
+        header = [name or str(i) for i, name in enumerate(grid[0])]
+        grid, numeric = grid[1:], numeric[1:]
+    table = pd.DataFrame(grid, columns=header)
     
-    df = pd.DataFrame(rows)
+    # Type a column as numeric only when every non-empty value parses
+    filled = grid != ''
+    parsed = ~np.isnan(numeric)
+    for i in np.flatnonzero(filled.any(axis=0) & (parsed | ~filled).all(axis=0)):
+        table.isetitem(i, numeric[:, i])
     
-    return df 
\ No newline at end of file
+    return table
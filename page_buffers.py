@@ -0,0 +1,125 @@
+import os
+import logging
+import threading
+from collections import namedtuple
+from contextlib import suppress
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Set SHARED_PAGE_BUFFERS=0 to pickle page images to OCR worker processes instead
+ENABLED = os.environ.get("SHARED_PAGE_BUFFERS", "1") != "0"
+
+# Location and layout of a page in a pool buffer; pickled in place of the pixels
+PageHandle = namedtuple('PageHandle', ['slot', 'name', 'shape', 'dtype'])
+
+# Buffers mapped by this (worker) process, by slot
+_attached = {}
+
+class PageBufferPool:
+    """
+    Fixed set of reusable shared-memory page buffers.
+
+    The owning process copies each page into a free buffer once with put()
+    and hands the returned PageHandle to worker processes, which map the
+    pixels with open_page() instead of unpickling a copy. Once a worker's
+    result is back, the owner release()s the handle and the buffer is reused
+    for a later page; it is only reallocated when a page does not fit.
+    close() unlinks every buffer, so the pool should be used as a context
+    manager.
+    """
+
+    def __init__(self, slots):
+        self._segments = [None] * slots
+        self._free = list(range(slots))
+        self._cond = threading.Condition()
+
+    def put(self, image, timeout=None):
+        """
+        Copy a page image into a free buffer, waiting for one if all are in use.
+
+        Args:
+            image: Page image as a NumPy array
+            timeout: Seconds to wait for a free buffer (None = wait indefinitely)
+
+        Returns:
+            PageHandle to pass to open_page in another process
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                raise TimeoutError("No free page buffer")
+            slot = self._free.pop()
+        try:
+            segment = self._segments[slot]
+            if segment is None or segment.size < image.nbytes:
+                if segment is not None:
+                    segment.close()
+                    segment.unlink()
+                    self._segments[slot] = None
+                segment = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+                self._segments[slot] = segment
+            np.ndarray(image.shape, image.dtype, buffer=segment.buf)[...] = image
+        except BaseException:
+            self._release_slot(slot)
+            raise
+        return PageHandle(slot, segment.name, image.shape, image.dtype.str)
+
+    def release(self, handle):
+        """Return a page's buffer to the pool once no worker reads it anymore."""
+        self._release_slot(handle.slot)
+
+    def _release_slot(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify()
+
+    def close(self):
+        """Unlink all buffers. Workers' mappings stay valid until they drop them."""
+        for i, segment in enumerate(self._segments):
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+                self._segments[i] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def open_page(handle):
+    """
+    Map a page written by PageBufferPool.put, without copying it.
+
+    The returned array is read-only and valid until the owner releases the
+    handle, so it must not be kept beyond processing the page.
+    """
+    segment = _attached.get(handle.slot)
+    if segment is None or segment.name != handle.name:
+        if segment is not None:
+            # The slot was reallocated for a larger page; drop the old mapping
+            with suppress(BufferError):
+                segment.close()
+        # Pool workers share the owner's resource tracker, so attaching here
+        # does not make the buffer outlive (or die with) this process
+        segment = shared_memory.SharedMemory(name=handle.name)
+        _attached[handle.slot] = segment
+    page = np.ndarray(handle.shape, np.dtype(handle.dtype), buffer=segment.buf)
+    page.flags.writeable = False
+    return page
+
+def create_pool(slots):
+    """Return a PageBufferPool, or None if disabled or shared memory is unavailable."""
+    if not ENABLED:
+        return None
+    try:
+        # Probe once so an unusable /dev/shm falls back to pickling up front
+        probe = shared_memory.SharedMemory(create=True, size=1)
+        probe.close()
+        probe.unlink()
+    except OSError as e:
+        logger.warning("Shared memory unavailable, page images will be pickled: %s", e)
+        return None
+    return PageBufferPool(slots)
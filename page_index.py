@@ -0,0 +1,344 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from ocr_cache import DEFAULT_CACHE_DIR
+from document_profiles import INK_CONTRAST
+from instrumentation import timed
+
+# Set PAGE_INDEX=0 to OCR every page even when a near-identical page was OCRed before
+ENABLED = os.environ.get("PAGE_INDEX", "1") != "0"
+
+# Size limit of the page index in megabytes; least recently used pages are evicted first
+DEFAULT_INDEX_MAX_MB = int(os.environ.get("PAGE_INDEX_MAX_MB", "1024"))
+
+# Largest Hamming distance (of 64 bits) between the perceptual hashes of pages
+# considered near-duplicates. Hashes are split into MAX_DISTANCE + 1 bands, so
+# any page within the distance shares at least one band exactly with the query.
+MAX_DISTANCE = int(os.environ.get("PAGE_INDEX_MAX_DISTANCE", "4"))
+
+# Visual verification: pages are compared as ink masks VERIFY_WIDTH pixels wide,
+# in cells of VERIFY_CELL pixels that may each shift by up to VERIFY_SHIFT pixels.
+# A candidate is rejected when any cell still differs in more than
+# VERIFY_MAX_CELL_PIXELS pixels, or when the page heights differ by more than
+# VERIFY_MAX_ASPECT_CHANGE.
+VERIFY_WIDTH = 850
+VERIFY_CELL = 16
+VERIFY_SHIFT = 1
+VERIFY_MAX_CELL_PIXELS = int(os.environ.get("PAGE_INDEX_MAX_CELL_PIXELS", "8"))
+VERIFY_MAX_ASPECT_CHANGE = 0.02
+
+# Candidates verified per lookup, closest hash first
+VERIFY_CANDIDATES = 3
+
+_HASH_BITS = 64
+_default_index = None
+
+def page_hash(gray, mask=None):
+    """
+    Return the 64-bit perceptual (DCT) hash of a grayscale page image.
+
+    Only the bounding box of the page's ink (`mask`, see ink_mask) is hashed,
+    so a scan placed differently on the glass hashes the same.
+    """
+    ys, xs = np.nonzero(ink_mask(gray) if mask is None else mask)
+    if len(ys):
+        scale = gray.shape[1] / VERIFY_WIDTH
+        top, bottom = int(ys.min() * scale), int((ys.max() + 1) * scale)
+        left, right = int(xs.min() * scale), int((xs.max() + 1) * scale)
+        gray = gray[top:max(bottom, top + 1), left:max(right, left + 1)]
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:8, :8].flatten()
+    bits = np.packbits(low > np.median(low))
+    return int.from_bytes(bits.tobytes(), 'big')
+
+def ink_mask(gray):
+    """Return the ink of a grayscale page as a boolean mask VERIFY_WIDTH pixels wide."""
+    height = max(1, round(gray.shape[0] * VERIFY_WIDTH / gray.shape[1]))
+    small = cv2.resize(gray, (VERIFY_WIDTH, height), interpolation=cv2.INTER_AREA)
+    return small < np.median(small) - INK_CONTRAST
+
+def hash_bands(value, bands):
+    """Split a hash into `bands` contiguous bit ranges, as (band, bits) pairs."""
+    bounds = [round(i * _HASH_BITS / bands) for i in range(bands + 1)]
+    return [
+        (i, (value >> (_HASH_BITS - end)) & ((1 << (end - start)) - 1))
+        for i, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << _HASH_BITS) if value >= 1 << (_HASH_BITS - 1) else value
+
+@timed('verify_page')
+def compare_masks(stored, mask):
+    """
+    Visually compare a stored page with a new one.
+
+    The new page is first aligned to the stored one as a whole (phase
+    correlation), then every cell may shift by VERIFY_SHIFT pixels more and
+    ink within one pixel counts as matching, which absorbs rescan jitter but
+    not changed words.
+
+    Returns:
+        (dx, dy) shift in mask pixels that moves the new page onto the
+        stored one, or None if the pages differ
+    """
+    if abs(len(stored) - len(mask)) > VERIFY_MAX_ASPECT_CHANGE * len(stored):
+        return None
+    height = min(len(stored), len(mask))
+    stored = stored[:height].astype(np.uint8)
+    mask = mask[:height].astype(np.uint8)
+    (dx, dy), _ = cv2.phaseCorrelate(np.float32(mask), np.float32(stored))
+    if max(abs(dx), abs(dy)) > VERIFY_WIDTH / 20:
+        return None
+    shift = np.float32([[1, 0, dx], [0, 1, dy]])
+    mask = cv2.warpAffine(mask, shift, (VERIFY_WIDTH, height), flags=cv2.INTER_NEAREST)
+
+    kernel = np.ones((3, 3), np.uint8)
+    stored_near = cv2.dilate(stored, kernel)
+    pad = VERIFY_SHIFT
+    padded = np.pad(mask, pad)
+    padded_near = np.pad(cv2.dilate(mask, kernel), pad)
+    rows, cols = height // VERIFY_CELL, VERIFY_WIDTH // VERIFY_CELL
+    best = None
+    for sy in range(-pad, pad + 1):
+        for sx in range(-pad, pad + 1):
+            moved = padded[pad + sy:pad + sy + height, pad + sx:pad + sx + VERIFY_WIDTH]
+            moved_near = padded_near[pad + sy:pad + sy + height, pad + sx:pad + sx + VERIFY_WIDTH]
+            diff = (moved > stored_near) | (stored > moved_near)
+            cells = diff[:rows * VERIFY_CELL, :cols * VERIFY_CELL].reshape(
+                rows, VERIFY_CELL, cols, VERIFY_CELL).sum(axis=(1, 3))
+            best = cells if best is None else np.minimum(best, cells)
+    if best is not None and best.size and best.max() > VERIFY_MAX_CELL_PIXELS:
+        return None
+    return dx, dy
+
+class PageIndex:
+    """
+    Persistent index of OCRed pages by perceptual hash, for reusing the OCR
+    result of a near-identical page (a rescan or re-export of a page seen before).
+
+    Pages are looked up by multi-index hashing: the 64-bit hash is split into
+    MAX_DISTANCE + 1 bands stored in an indexed table, candidates share at
+    least one band with the query, and only their hashes are compared in full.
+    A lookup therefore reads a handful of rows even with millions of pages.
+    Candidates within MAX_DISTANCE are verified against the stored ink mask
+    (see compare_masks) before their record is returned.
+
+    Like OCRCache, entries live in a size-bounded SQLite database in WAL mode
+    that several worker processes can share.
+    """
+
+    def __init__(self, index_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_INDEX_MAX_MB * 1024 * 1024,
+                 max_distance=MAX_DISTANCE):
+        if not 0 <= max_distance < 16:
+            raise ValueError("max_distance must be between 0 and 15")
+        self.index_dir = Path(index_dir)
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.index_dir / "page_index.sqlite"
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " id INTEGER PRIMARY KEY,"
+                " params TEXT NOT NULL,"
+                " hash INTEGER NOT NULL,"
+                " mask BLOB NOT NULL,"
+                " height INTEGER NOT NULL,"
+                " record BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_lru ON pages (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_hash ON pages (hash, params)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bands ("
+                " band INTEGER NOT NULL,"
+                " value INTEGER NOT NULL,"
+                " page_id INTEGER NOT NULL,"
+                " PRIMARY KEY (band, value, page_id)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._check_bands(conn)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # A fresh connection per operation keeps the index safe to use after fork
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _check_bands(self, conn):
+        """Rebuild the band table when MAX_DISTANCE changed since it was written."""
+        row = conn.execute("SELECT value FROM meta WHERE key = 'bands'").fetchone()
+        if row is not None and int(row[0]) == self.bands:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM bands")
+            for page_id, value in conn.execute("SELECT id, hash FROM pages").fetchall():
+                self._insert_bands(conn, page_id, value & ((1 << _HASH_BITS) - 1))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bands', ?)", (str(self.bands),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _insert_bands(self, conn, page_id, value):
+        conn.executemany(
+            "INSERT OR IGNORE INTO bands (band, value, page_id) VALUES (?, ?, ?)",
+            [(band, bits, page_id) for band, bits in hash_bands(value, self.bands)]
+        )
+
+    @timed('page_index')
+    def lookup(self, gray, params):
+        """
+        Find a verified near-duplicate of a page OCRed with the same parameters.
+
+        Args:
+            gray: Grayscale page image
+            params: Fingerprint of the parameters that affect OCR output
+
+        Returns:
+            Dict with the stored page 'record', the hash 'distance' and the
+            'offset' (dx, dy) in `gray` pixels of the new page against the
+            stored one, to add to stored word boxes; or None
+        """
+        mask = ink_mask(gray)
+        value = page_hash(gray, mask)
+        conn = self._connect()
+        try:
+            candidates = {}
+            for band, bits in hash_bands(value, self.bands):
+                rows = conn.execute(
+                    "SELECT p.id, p.hash FROM bands b JOIN pages p ON p.id = b.page_id"
+                    " WHERE b.band = ? AND b.value = ? AND p.params = ?",
+                    (band, bits, params)
+                )
+                for page_id, stored in rows:
+                    candidates[page_id] = bin((stored & ((1 << _HASH_BITS) - 1)) ^ value).count('1')
+            close = sorted((d, page_id) for page_id, d in candidates.items() if d <= self.max_distance)
+            if not close:
+                return None
+
+            for distance, page_id in close[:VERIFY_CANDIDATES]:
+                data, height, record = conn.execute(
+                    "SELECT mask, height, record FROM pages WHERE id = ?", (page_id,)
+                ).fetchone()
+                stored = np.unpackbits(np.frombuffer(zlib.decompress(data), np.uint8),
+                                       count=height * VERIFY_WIDTH).reshape(height, VERIFY_WIDTH)
+                offset = compare_masks(stored, mask)
+                if offset is None:
+                    continue
+                conn.execute("UPDATE pages SET last_access = ? WHERE id = ?", (time.time(), page_id))
+                scale = gray.shape[1] / VERIFY_WIDTH
+                return {
+                    'record': json.loads(zlib.decompress(record).decode('utf-8')),
+                    'distance': distance,
+                    'offset': (-offset[0] * scale, -offset[1] * scale),
+                }
+        finally:
+            conn.close()
+        return None
+
+    @timed('page_index')
+    def add(self, gray, params, record):
+        """
+        Store the OCR record of a page under its hash and ink mask.
+
+        A page stored before with the same hash and parameters (e.g. one whose
+        reuse failed verification) is replaced, so rescans of a page never
+        pile up as duplicate rows.
+        """
+        mask = ink_mask(gray)
+        value = page_hash(gray, mask)
+        mask_data = zlib.compress(np.packbits(mask).tobytes())
+        record_data = zlib.compress(json.dumps(record).encode('utf-8'))
+        size = len(mask_data) + len(record_data)
+        if size > self.max_bytes:
+            return
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM pages WHERE hash = ? AND params = ?", (_to_signed(value), params)
+            ).fetchone()
+            if row is None:
+                cursor = conn.execute(
+                    "INSERT INTO pages (params, hash, mask, height, record, size, last_access)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (params, _to_signed(value), mask_data, len(mask), record_data, size, time.time())
+                )
+                self._insert_bands(conn, cursor.lastrowid, value)
+            else:
+                # Same hash, so the page's bands are already in place
+                conn.execute(
+                    "UPDATE pages SET mask = ?, height = ?, record = ?, size = ?, last_access = ?"
+                    " WHERE id = ?",
+                    (mask_data, len(mask), record_data, size, time.time(), row[0])
+                )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        """Delete least recently used pages until the index fits in max_bytes."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evict = []
+        for page_id, value, size in conn.execute("SELECT id, hash, size FROM pages ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            evict.append((page_id, value & ((1 << _HASH_BITS) - 1)))
+            total -= size
+        conn.executemany("DELETE FROM pages WHERE id = ?", [(page_id,) for page_id, _ in evict])
+        conn.executemany(
+            "DELETE FROM bands WHERE band = ? AND value = ? AND page_id = ?",
+            [(band, bits, page_id) for page_id, value in evict for band, bits in hash_bands(value, self.bands)]
+        )
+
+    def clear(self):
+        """Remove all indexed pages."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM pages")
+            conn.execute("DELETE FROM bands")
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Return the number of indexed pages and total stored bytes."""
+        conn = self._connect()
+        try:
+            count, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages"
+            ).fetchone()
+        finally:
+            conn.close()
+        return {'pages': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+def get_default_index():
+    """Return the process-wide page index, or None if disabled."""
+    global _default_index
+    if not ENABLED or DEFAULT_INDEX_MAX_MB <= 0:
+        return None
+    if _default_index is None:
+        _default_index = PageIndex()
+    return _default_index
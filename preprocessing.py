@@ -1,25 +1,67 @@
+import io
+import os
+import logging
+import json
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict
 import cv2
 import numpy as np
 from skimage import filters
 from PIL import Image
 
+from instrumentation import stage, timed, subprocess_cpu
+
+logger = logging.getLogger(__name__)
+
+# Parameters of the preprocessing pipeline. They are part of the OCR cache key,
+# so changing any of them invalidates previously cached results.
+PREPROCESSING_PARAMS = {
+    'resize_width': 1700,
+    'pdf_grayscale': True,
+    'denoise_method': 'auto',
+    'noise_low': 2.0,
+    'noise_high': 8.0,
+    'denoise_h': 10,
+    'denoise_template_window': 7,
+    'denoise_search_window': 21,
+    'deskew_max_width': 800,
+    'deskew_tolerance': 0.1,
+    'threshold_type': 'adaptive',
+}
+
+# Rows of a TIFF page decoded at a time when it is read in bands
+TIFF_BAND_ROWS = 512
+
+# Size limit of the in-memory memo of intermediate preprocessing and OCR results
+DEFAULT_STAGE_MEMO_MB = int(os.environ.get("STAGE_MEMO_MB", "256"))
+
+@timed('resize')
 def resize_image(image, width=1700):
     """Resize image while maintaining aspect ratio."""
     h, w = image.shape[:2]
+    if w == width:
+        return image
     ratio = width / w
     return cv2.resize(image, (width, int(h * ratio)))
 
+@timed('grayscale')
 def convert_to_grayscale(image):
     """Convert image to grayscale."""
     return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
+@timed('threshold')
 def apply_threshold(image, threshold_type="adaptive"):
     """Apply thresholding to improve OCR accuracy.
     
     Args:
         image: Grayscale image
-        threshold_type: Type of thresholding ("adaptive", "otsu", "binary")
+        threshold_type: Type of thresholding ("adaptive", "otsu", "binary", or "none"
+            to leave binarization to Tesseract)
     """
+    if threshold_type == "none":
+        return image
     if threshold_type == "adaptive":
         return cv2.adaptiveThreshold(
             image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
@@ -31,79 +73,598 @@ def apply_threshold(image, threshold_type="adaptive"):
         _, thresholded = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
         return thresholded
 
-def denoise_image(image):
-    """Remove noise from the image."""
-    return cv2.fastNlMeansDenoising(image, None, 10, 7, 21)
+@timed('noise_estimate')
+def estimate_noise(image):
+    """Estimate the standard deviation of pixel noise in a grayscale image.
+    
+    Uses Immerkaer's Laplacian-difference operator with a median (MAD) estimate,
+    so the sparse strong edges of printed text don't inflate the result.
+    """
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    # Pixel noise is independent, so decimating first keeps the estimate and
+    # quarters the cost
+    response = cv2.filter2D(image[::2, ::2], cv2.CV_32F, kernel)
+    sample = np.abs(response[1:-1, 1:-1]).ravel()
+    if sample.size == 0:
+        return 0.0
+    # The kernel has an L2 norm of 6; 1.4826 converts a MAD to a standard deviation
+    return float(np.median(sample) * 1.4826 / 6)
+
+def select_denoise_method(noise_sigma, noise_low=2.0, noise_high=8.0):
+    """Pick the cheapest denoising method adequate for the estimated noise level."""
+    if noise_sigma < noise_low:
+        return "none"
+    if noise_sigma < noise_high:
+        return "median"
+    return "nlmeans"
+
+@timed('denoise')
+def denoise_image(image, method="nlmeans", h=10, template_window=7, search_window=21):
+    """Remove noise from the image.
+    
+    Args:
+        image: Grayscale image
+        method: "nlmeans" (slow, strongest), "median", "bilateral" or "none"
+    """
+    if method == "none":
+        return image
+    if method == "median":
+        return cv2.medianBlur(image, 3)
+    if method == "bilateral":
+        return cv2.bilateralFilter(image, 5, 50, 50)
+    return cv2.fastNlMeansDenoising(image, None, h, template_window, search_window)
 
-def deskew_image(image):
-    """Correct the skew in a document image."""
-    # Calculate skew angle
-    gray = image.copy() if len(image.shape) == 2 else convert_to_grayscale(image)
+def estimate_skew_angle(image, max_width=800):
+    """Estimate the skew angle of a document image in degrees.
+    
+    Lines are detected on a copy downscaled to at most `max_width` pixels, and
+    the angle filtering and median are computed with vectorized NumPy.
+    """
+    gray = image if len(image.shape) == 2 else convert_to_grayscale(image)
+    
+    # Downscale and shrink the Hough parameters by the same factor
+    scale = min(1.0, max_width / gray.shape[1])
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+    
     edges = cv2.Canny(gray, 50, 150, apertureSize=3)
-    lines = cv2.HoughLinesP(edges, 1, np.pi/180, 100, minLineLength=100, maxLineGap=10)
+    lines = cv2.HoughLinesP(edges, 1, np.pi/180, max(int(100 * scale), 20),
+                            minLineLength=max(int(100 * scale), 20), maxLineGap=max(int(10 * scale), 2))
     
     if lines is None or len(lines) == 0:
-        return image
+        return 0.0
     
-    angles = []
-    for line in lines:
-        x1, y1, x2, y2 = line[0]
-        if x2 - x1 == 0:  # Avoid division by zero
-            continue
-        angle = np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi
-        if -45 < angle < 45:  # Filter out vertical lines
-            angles.append(angle)
+    x1, y1, x2, y2 = lines.reshape(-1, 4).T.astype(np.float64)
+    dx = x2 - x1
+    angles = np.degrees(np.arctan2(y2 - y1, dx))
+    # Drop vertical lines and anything steeper than 45 degrees
+    angles = angles[(dx != 0) & (angles > -45) & (angles < 45)]
     
-    if not angles:
-        return image
+    if angles.size == 0:
+        return 0.0
+    return float(np.median(angles))
+
+@timed('deskew')
+def deskew_image(image, tolerance=0.1, max_width=800):
+    """Correct the skew in a document image.
     
-    # Calculate median angle
-    median_angle = np.median(angles)
+    Args:
+        image: Document image
+        tolerance: Angles (degrees) smaller than this are left uncorrected
+        max_width: Width of the downscaled copy used to estimate the angle
+    """
+    angle = estimate_skew_angle(image, max_width)
+    if abs(angle) < tolerance:
+        return image
     
     # Rotate image to correct skew
     h, w = image.shape[:2]
     center = (w // 2, h // 2)
-    M = cv2.getRotationMatrix2D(center, median_angle, 1.0)
+    M = cv2.getRotationMatrix2D(center, angle, 1.0)
     return cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
 
-def enhance_image(image):
-    """Enhance image for better OCR using multiple techniques."""
-    # Resize image
-    image = resize_image(image)
-    
+def _resize_stage(image, params, report):
+    return resize_image(image, params['resize_width'])
+
+def _grayscale_stage(image, params, report):
     # Convert to grayscale if not already
-    if len(image.shape) == 3:
-        gray = convert_to_grayscale(image)
-    else:
-        gray = image.copy()
+    return convert_to_grayscale(image) if len(image.shape) == 3 else image
+
+def _denoise_stage(image, params, report):
+    # Skip denoising or use a cheaper filter on clean pages
+    method = params['denoise_method']
+    if method == "auto":
+        noise_sigma = estimate_noise(image)
+        method = select_denoise_method(noise_sigma, params['noise_low'], params['noise_high'])
+        report['noise_sigma'] = round(noise_sigma, 3)
+    report['denoise_method'] = method
+    return denoise_image(image, method, params['denoise_h'], params['denoise_template_window'],
+                         params['denoise_search_window'])
+
+def _deskew_stage(image, params, report):
+    return deskew_image(image, params['deskew_tolerance'], params['deskew_max_width'])
+
+def _threshold_stage(image, params, report):
+    return apply_threshold(image, params['threshold_type'])
+
+# Preprocessing graph in execution order: stage name, function, and the
+# PREPROCESSING_PARAMS the stage's output depends on
+PREPROCESSING_STAGES = [
+    ('resize', _resize_stage, ('resize_width',)),
+    ('grayscale', _grayscale_stage, ()),
+    ('denoise', _denoise_stage, ('denoise_method', 'noise_low', 'noise_high', 'denoise_h',
+                                 'denoise_template_window', 'denoise_search_window')),
+    ('deskew', _deskew_stage, ('deskew_tolerance', 'deskew_max_width')),
+    ('threshold', _threshold_stage, ('threshold_type',)),
+]
+
+# Overrides of PREPROCESSING_PARAMS for the light first pass of two-tier OCR:
+# no denoising and no binarization, which Tesseract does itself
+LIGHT_PARAMS = {'denoise_method': 'none', 'threshold_type': 'none'}
+
+# Heavier variants tried on low-confidence regions of a lightly preprocessed
+# page: upscaling factor, denoising method and thresholding
+REGION_VARIANTS = [
+    {'scale': 2.0, 'denoise_method': 'nlmeans', 'threshold_type': 'otsu'},
+    {'scale': 2.0, 'denoise_method': 'median', 'threshold_type': 'adaptive'},
+    {'scale': 1.0, 'denoise_method': 'nlmeans', 'threshold_type': 'adaptive'},
+]
+
+@timed('region_preprocess')
+def preprocess_region(image, variant, params=None):
+    """Apply one of REGION_VARIANTS to a grayscale region cropped from a page."""
+    params = resolve_params(params)
+    if variant['scale'] != 1.0:
+        image = cv2.resize(image, None, fx=variant['scale'], fy=variant['scale'], interpolation=cv2.INTER_CUBIC)
+    image = denoise_image(image, variant['denoise_method'], params['denoise_h'],
+                          params['denoise_template_window'], params['denoise_search_window'])
+    return apply_threshold(image, variant['threshold_type'])
+
+def resolve_params(params=None):
+    """Return PREPROCESSING_PARAMS with the preprocessing keys of `params` overridden."""
+    if not params:
+        return PREPROCESSING_PARAMS
+    return {**PREPROCESSING_PARAMS, **{k: v for k, v in params.items() if k in PREPROCESSING_PARAMS}}
+
+class StageMemo:
+    """
+    Thread-safe in-memory LRU of intermediate stage results, bounded by total bytes.
+    
+    Entries are keyed by stage_key, i.e. by the input image and every stage
+    parameter up to that point, so a memoized result is never stale. Stored
+    values are shared between callers and must not be modified in place.
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return (value, report) stored under `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+    
+    def put(self, key, value, report, size=None):
+        """Store a stage result and the preprocessing report up to that stage."""
+        size = value.nbytes if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[2]
+            self._entries[key] = (value, dict(report), size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+_stage_memo = None
+
+# Memo value of a stage that returned its input unchanged
+PASS_THROUGH = object()
+
+def get_stage_memo():
+    """Return the process-wide stage memo, or False when disabled (STAGE_MEMO_MB=0)."""
+    global _stage_memo
+    if _stage_memo is None:
+        _stage_memo = StageMemo(DEFAULT_STAGE_MEMO_MB * 1024 * 1024) if DEFAULT_STAGE_MEMO_MB > 0 else False
+    return _stage_memo
+
+def image_digest(image):
+    """Return a hash of an image array's shape, type and pixels."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.shape}:{image.dtype}".encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+def stage_key(input_key, name, params):
+    """Return the memo key of stage `name` run with `params` on the input identified by `input_key`."""
+    payload = json.dumps([input_key, name, params], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+def run_preprocessing(image, params=None, report=None, memo=None):
+    """Run the preprocessing graph, resuming after the last memoized stage.
+    
+    Args:
+        image: OpenCV image (BGR or grayscale)
+        params: Overrides of PREPROCESSING_PARAMS
+        report: Optional dict that receives per-page preprocessing decisions
+        memo: StageMemo to use (None = process-wide memo, False = no memoization)
     
-    # Denoise
-    denoised = denoise_image(gray)
+    Returns:
+        Tuple of (preprocessed image, memo key of the result or None)
+    """
+    params = resolve_params(params)
+    memo = get_stage_memo() if memo is None else memo
+    report = {} if report is None else report
     
-    # Deskew
-    deskewed = deskew_image(denoised)
+    stages = PREPROCESSING_STAGES
+    keys = [None] * len(stages)
+    start = 0
+    if memo:
+        key = image_digest(image)
+        for i, (name, _, names) in enumerate(stages):
+            key = keys[i] = stage_key(key, name, {n: params[n] for n in names})
+        # Changing a parameter changes the keys of its stage and every later one,
+        # so the deepest memoized stage whose image can be recovered is where
+        # work resumes
+        hits = [memo.get(key) for key in keys]
+        for i in range(len(stages) - 1, -1, -1):
+            resumed = _resume_image(hits, i, image)
+            if resumed is not None:
+                image = resumed
+                report.update(hits[i][1])
+                start = i + 1
+                break
+        if start:
+            report['reused_stages'] = [name for name, _, _ in stages[:start]]
     
-    # Apply threshold
-    thresholded = apply_threshold(deskewed, "adaptive")
+    for i in range(start, len(stages)):
+        name, func, _ = stages[i]
+        output = func(image, params, report)
+        if memo:
+            stage_report = {k: v for k, v in report.items() if k != 'reused_stages'}
+            # A stage that passes its input through (e.g. deskew of a straight
+            # page) still did its estimation work. It is memoized as a marker
+            # rather than the image, which may be a caller's buffer (e.g. a
+            # shared page buffer) that is reused later.
+            if output is image:
+                memo.put(keys[i], PASS_THROUGH, stage_report, size=0)
+            else:
+                memo.put(keys[i], output, stage_report)
+        image = output
+    return image, keys[-1]
+
+def _resume_image(hits, i, image):
+    """
+    Return the image after stage i from memo hits, or None if it is unknown.
     
-    return thresholded
+    Pass-through markers stand for the image of the stage before them, back
+    to the first stored image or the input `image`.
+    """
+    for j in range(i, -1, -1):
+        if hits[j] is None:
+            return None
+        if hits[j][0] is not PASS_THROUGH:
+            return hits[j][0]
+    return image
 
-def process_image_for_ocr(image_path):
-    """Process an image for optimal OCR performance."""
-    # Read image
-    image = cv2.imread(str(image_path))
+def enhance_image(image, report=None, params=None):
+    """Enhance image for better OCR using multiple techniques.
+    
+    Args:
+        image: OpenCV image (BGR or grayscale)
+        report: Optional dict that receives per-page preprocessing decisions
+        params: Optional overrides of PREPROCESSING_PARAMS (see run_preprocessing)
+    """
+    return run_preprocessing(image, params, report)[0]
+
+def is_path(source):
+    """Return True if a document source is a file path rather than in-memory data."""
+    return isinstance(source, (str, os.PathLike))
+
+def as_bytes(source):
+    """Return the contents of an in-memory document (bytes-like object or readable buffer)."""
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source.read()
+    raise TypeError(f"Unsupported document source: {type(source).__name__}")
+
+def decode_image(data):
+    """Decode an encoded image (PNG, JPEG, TIFF, ...) from memory into an OpenCV array."""
+    image = cv2.imdecode(np.frombuffer(as_bytes(data), dtype=np.uint8), cv2.IMREAD_COLOR)
     if image is None:
-        raise ValueError(f"Could not read image at {image_path}")
+        raise ValueError("Could not decode image data")
+    return image
+
+def load_image(source):
+    """Read or decode an image (file path or encoded bytes/buffer); OpenCV arrays pass through."""
+    if is_path(source):
+        image = cv2.imread(str(source))
+        if image is None:
+            raise ValueError(f"Could not read image at {source}")
+        return image
+    if not isinstance(source, np.ndarray):
+        return decode_image(source)
+    return source
+
+@timed('preprocess')
+def process_image_for_ocr(image, report=None, params=None):
+    """Process an image (file path, encoded bytes/buffer or OpenCV array) for optimal OCR performance.
+    
+    If `report` is a dict, preprocessing decisions for the page are recorded in it.
+    `params` overrides PREPROCESSING_PARAMS.
+    """
+    image = load_image(image)
     
     # Apply all enhancements
-    processed = enhance_image(image)
+    processed = enhance_image(image, report=report, params=params)
     
     return processed
 
+@timed('rasterize')
 def convert_pdf_to_images(pdf_path):
     """Convert PDF to images using pdf2image library."""
     try:
         from pdf2image import convert_from_path
+    except ImportError:
+        raise ImportError("pdf2image is required. Install it with: pip install pdf2image")
+    with subprocess_cpu():
         return convert_from_path(pdf_path, dpi=300)
+
+def get_pdf_page_count(pdf):
+    """Return the number of pages in a PDF (path or bytes) without rasterizing it."""
+    if not is_path(pdf):
+        # Poppler tools read the document from stdin when given "-"
+        result = subprocess.run(['pdfinfo', '-'], input=as_bytes(pdf), capture_output=True, check=True)
+        for line in result.stdout.decode('utf-8', errors='replace').splitlines():
+            if line.startswith('Pages:'):
+                return int(line.split(':', 1)[1])
+        raise ValueError("Could not read the page count of the PDF")
+    try:
+        from pdf2image import pdfinfo_from_path
+    except ImportError:
+        raise ImportError("pdf2image is required. Install it with: pip install pdf2image")
+    return int(pdfinfo_from_path(pdf)["Pages"])
+
+def _rasterize_pdf_bytes(data, dpi, first_page, last_page, width=None, grayscale=False):
+    """Rasterize pages of an in-memory PDF by piping it through pdftoppm, without temp files."""
+    from pdf2image.parsers import parse_buffer_to_pgm, parse_buffer_to_ppm
+    
+    args = ['pdftoppm', '-r', str(dpi), '-f', str(first_page), '-l', str(last_page)]
+    if grayscale:
+        args.append('-gray')
+    if width:
+        args += ['-scale-to-x', str(int(width)), '-scale-to-y', '-1']
+    # Read the PDF from stdin; without an output root the images are written to stdout
+    args.append('-')
+    with subprocess_cpu():
+        result = subprocess.run(args, input=data, capture_output=True, check=True)
+    parse = parse_buffer_to_pgm if grayscale else parse_buffer_to_ppm
+    return parse(result.stdout)
+
+def iter_pdf_pages(pdf, dpi=300, window=1, page_numbers=None, width=None, grayscale=False):
+    """Yield PDF pages as PIL images, rasterizing at most `window` pages at a time.
+    
+    Unlike convert_pdf_to_images, memory use stays flat regardless of page count
+    and the first page is available before the rest of the document is rendered.
+    `pdf` is a file path, or the PDF's bytes (or a buffer), which are piped to
+    poppler without touching disk.
+    If `page_numbers` (1-based, ascending) is given, only those pages are rendered.
+    If `width` is given, pages are rendered straight at that pixel width instead of
+    at `dpi`, and `grayscale` renders single-channel images.
+    """
+    try:
+        from pdf2image import convert_from_path
     except ImportError:
-        raise ImportError("pdf2image is required. Install it with: pip install pdf2image") 
\ No newline at end of file
+        raise ImportError("pdf2image is required. Install it with: pip install pdf2image")
+    
+    if not is_path(pdf):
+        pdf = as_bytes(pdf)
+    size = (width, None) if width else None
+    if page_numbers is None:
+        page_numbers = range(1, get_pdf_page_count(pdf) + 1)
+    
+    # Group requested pages into runs of consecutive pages, at most `window` long
+    runs = []
+    for page_num in page_numbers:
+        if runs and page_num == runs[-1][-1] + 1 and len(runs[-1]) < window:
+            runs[-1].append(page_num)
+        else:
+            runs.append([page_num])
+    
+    for run in runs:
+        with stage('rasterize', page=run[0] if len(run) == 1 else None):
+            if is_path(pdf):
+                with subprocess_cpu():
+                    images = convert_from_path(pdf, dpi=dpi, first_page=run[0], last_page=run[-1],
+                                               size=size, grayscale=grayscale)
+            else:
+                images = _rasterize_pdf_bytes(pdf, dpi, run[0], run[-1], width=width, grayscale=grayscale)
+        while images:
+            # Hand pages over one by one so each is released once the consumer is done
+            yield images.pop(0)
+
+def iter_pdf_pages_for_ocr(pdf, page_numbers=None, params=None):
+    """Yield PDF pages as arrays rendered directly at the OCR working resolution.
+    
+    Pages come out at the 'resize_width' of PREPROCESSING_PARAMS (or of the
+    `params` overrides) and, by default, as single-channel images, so
+    enhance_image needs no color conversion or resize.
+    """
+    params = resolve_params(params)
+    for img in iter_pdf_pages(pdf, page_numbers=page_numbers, width=params['resize_width'],
+                              grayscale=params['pdf_grayscale']):
+        image = np.asarray(img)
+        # pdftoppm renders RGB; OpenCV expects BGR
+        yield image if image.ndim == 2 else image[:, :, ::-1]
+
+# TIFF photometric interpretations streamed band by band; others are decoded with PIL
+_MINISWHITE, _MINISBLACK, _RGB = 0, 1, 2
+
+def _open_tiff(tiff):
+    try:
+        import tifffile
+    except ImportError:
+        raise ImportError("tifffile is required. Install it with: pip install tifffile")
+    return tifffile.TiffFile(str(tiff) if is_path(tiff) else io.BytesIO(as_bytes(tiff)))
+
+def get_tiff_page_count(tiff):
+    """Return the number of pages in a TIFF (path or bytes) without decoding any."""
+    with _open_tiff(tiff) as tif:
+        return len(tif.pages)
+
+def _iter_mapped_bands(tiff, index, height):
+    """Yield row bands of an uncompressed page, memory-mapped from the file."""
+    import tifffile
+    pixels = tifffile.memmap(str(tiff), page=index, mode='r')
+    for top in range(0, height, TIFF_BAND_ROWS):
+        yield top, pixels[top:top + TIFF_BAND_ROWS]
+
+def _iter_decoded_bands(page, height, width):
+    """Yield row bands of a page, decoding one row of strips or tiles at a time."""
+    band, band_top = None, None
+    for segment, (_, _, top, left, _), shape in page.segments():
+        if band is not None and top != band_top:
+            yield band_top, band
+            band = None
+        if band is None:
+            band_top = top
+            band = np.zeros((min(shape[1], height - top), width, page.samplesperpixel), dtype=page.dtype)
+        if segment is not None:
+            # Edge tiles are padded beyond the image
+            rows, cols = band.shape[0], min(segment.shape[2], width - left)
+            band[:, left:left + cols] = segment[0, :rows, :cols]
+    if band is not None:
+        yield band_top, band
+
+def _regroup_bands(bands):
+    """Merge consecutive bands (e.g. single-row strips) into bands of about TIFF_BAND_ROWS rows."""
+    pending, pending_top = [], None
+    for top, band in bands:
+        if not pending:
+            pending_top = top
+        pending.append(band)
+        if sum(len(b) for b in pending) >= TIFF_BAND_ROWS:
+            yield pending_top, pending[0] if len(pending) == 1 else np.concatenate(pending)
+            pending = []
+    if pending:
+        yield pending_top, pending[0] if len(pending) == 1 else np.concatenate(pending)
+
+def _normalize_tiff_band(band, photometric, grayscale):
+    """Convert a band to 8-bit BGR or grayscale with black text on white."""
+    if band.dtype == bool:
+        band = band.view(np.uint8) * 255
+    elif band.dtype == np.uint16:
+        band = (band >> 8).astype(np.uint8)
+    elif band.dtype != np.uint8:
+        raise ValueError(f"Unsupported TIFF sample type {band.dtype}")
+    if photometric == _MINISWHITE:
+        band = 255 - band
+    if band.ndim == 3:
+        if band.shape[2] == 1:
+            band = band[:, :, 0]
+        else:
+            # Drop alpha; RGB becomes BGR (or gray) as OpenCV expects
+            band = np.ascontiguousarray(band[:, :, :3])
+            band = cv2.cvtColor(band, cv2.COLOR_RGB2GRAY if grayscale else cv2.COLOR_RGB2BGR)
+    return band
+
+def _assemble_page(bands, height, width, out_width=None):
+    """Build a page from row bands, downscaling each band to `out_width` as it arrives."""
+    scale = out_width / width if out_width and out_width < width else 1.0
+    out_height, out_width = max(1, round(height * scale)), max(1, round(width * scale))
+    page = None
+    for top, band in bands:
+        if page is None:
+            page = np.empty((out_height, out_width) + band.shape[2:], dtype=np.uint8)
+        if scale == 1.0:
+            page[top:top + len(band)] = band
+            continue
+        # Output rows covered by this band; rounding both ends keeps bands seamless
+        first, last = round(top * scale), min(out_height, round((top + len(band)) * scale))
+        if last > first:
+            page[first:last] = cv2.resize(band, (out_width, last - first), interpolation=cv2.INTER_AREA)
+    return page
+
+def _read_tiff_page_pil(tiff, index, width=None, grayscale=False):
+    """Decode a whole TIFF page with PIL, for codecs and layouts tifffile cannot stream."""
+    with Image.open(str(tiff) if is_path(tiff) else io.BytesIO(as_bytes(tiff))) as img:
+        img.seek(index)
+        # Bilevel and gray pages stay single-channel, as when they are streamed
+        image = np.asarray(img.convert('L' if grayscale or img.mode in ('1', 'L') else 'RGB'))
+    if image.ndim == 3:
+        image = image[:, :, ::-1]
+    if width and width < image.shape[1]:
+        image = cv2.resize(image, (width, round(image.shape[0] * width / image.shape[1])),
+                           interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(image)
+
+def read_tiff_page(tif, index, source, width=None, grayscale=False):
+    """Read one page of an open TiffFile at most `width` pixels wide, streaming it in bands.
+    
+    Uncompressed pages of files on disk are memory-mapped; compressed pages are
+    decoded one row of strips or tiles at a time. Either way each band is
+    downscaled before the next is read, so a large scan never exists in memory
+    at full resolution. Pages tifffile cannot decode without the optional
+    imagecodecs package (e.g. Group 4 or LZW) are decoded whole with PIL.
+    """
+    page = tif.pages[index]
+    height, width_px = page.shape[:2]
+    streamable = (page.photometric in (_MINISWHITE, _MINISBLACK, _RGB)
+                  and (page.samplesperpixel == 1 or page.planarconfig == 1))
+    if streamable:
+        try:
+            if is_path(source) and page.is_memmappable:
+                bands = _iter_mapped_bands(source, index, height)
+            else:
+                bands = _iter_decoded_bands(page, height, width_px)
+            bands = (
+                (top, _normalize_tiff_band(band, page.photometric, grayscale))
+                for top, band in _regroup_bands(bands)
+            )
+            return _assemble_page(bands, height, width_px, width)
+        except (ValueError, NotImplementedError) as e:
+            logger.debug("Streaming TIFF page %d failed, decoding with PIL: %s", index + 1, e)
+    return _read_tiff_page_pil(source, index, width=width, grayscale=grayscale)
+
+def iter_tiff_pages(tiff, page_numbers=None, width=None, grayscale=False):
+    """Yield the pages of a (multi-page) TIFF as OpenCV arrays, one at a time.
+    
+    `tiff` is a file path, or the TIFF's bytes (or a buffer). If `page_numbers`
+    (1-based) is given, only those pages are read. If `width` is given, larger
+    pages are downscaled to that width while they are read (see read_tiff_page),
+    and `grayscale` returns single-channel images.
+    """
+    if not is_path(tiff):
+        tiff = as_bytes(tiff)
+    with _open_tiff(tiff) as tif:
+        if page_numbers is None:
+            page_numbers = range(1, len(tif.pages) + 1)
+        for page_num in page_numbers:
+            with stage('rasterize', page=page_num):
+                image = read_tiff_page(tif, page_num - 1, tiff, width=width, grayscale=grayscale)
+            yield image
+
+def iter_tiff_pages_for_ocr(tiff, page_numbers=None, params=None):
+    """Yield TIFF pages at the OCR working resolution, like iter_pdf_pages_for_ocr."""
+    params = resolve_params(params)
+    yield from iter_tiff_pages(tiff, page_numbers=page_numbers, width=params['resize_width'],
+                               grayscale=params['pdf_grayscale'])
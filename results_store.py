@@ -0,0 +1,167 @@
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+
+from ocr_utils import PATTERNS, WORD_COLUMNS, page_words
+from ocr_cache import file_digest
+
+# Root directory of the Parquet datasets
+DEFAULT_RESULTS_DIR = os.environ.get("RESULTS_DIR", "results")
+
+# Extracted loan fields, one string column each
+FIELD_NAMES = list(PATTERNS)
+
+DOCUMENT_SCHEMA = pa.schema(
+    [
+        ('doc_id', pa.string()),
+        ('file_name', pa.string()),
+        ('processed_at', pa.timestamp('ms', tz='UTC')),
+        ('pages', pa.int32()),
+        ('error', pa.string()),
+        ('edited', pa.bool_()),
+    ]
+    + [(field, pa.string()) for field in FIELD_NAMES]
+    + [('processed_date', pa.string())]
+)
+
+WORD_SCHEMA = pa.schema(
+    [
+        ('doc_id', pa.string()),
+        ('page', pa.int32()),
+    ]
+    + [(column, pa.int32()) for column in WORD_COLUMNS if column not in ('conf', 'text')]
+    + [
+        ('conf', pa.float32()),
+        ('text', pa.string()),
+        ('processed_at', pa.timestamp('ms', tz='UTC')),
+        ('processed_date', pa.string()),
+    ]
+)
+
+class ParquetResultWriter:
+    """
+    Buffers extraction results and appends them to Parquet datasets in batches.
+
+    Two datasets are written under `root`, both hive-partitioned by processing
+    date:
+
+    - documents/: one row per document with the extracted PATTERNS fields
+    - words/: one row per OCR word (page, box, confidence, text) keyed by doc_id
+
+    Every flush writes new files and never rewrites existing ones, so several
+    runs (or processes) can append to the same datasets. When a document is
+    stored more than once, for example after manual edits, the row with the
+    latest processed_at is the current one; its word rows are those with the
+    latest processed_at among the document's words.
+    """
+
+    def __init__(self, root=DEFAULT_RESULTS_DIR, batch_size=500, max_buffered_words=1_000_000):
+        self.root = root
+        self.batch_size = batch_size
+        self.max_buffered_words = max_buffered_words
+        self._documents = []
+        self._words = []
+        self._buffered_words = 0
+
+    def add(self, doc_id, fields, pages=None, file_name=None, error=None, edited=False):
+        """
+        Queue one document's results for writing.
+
+        Args:
+            doc_id: Stable document identifier (see document_id)
+            fields: Dict of extracted fields, as returned by extract_loan_details
+            pages: Optional list of page records; OCR word data is stored from
+                them. Leave out when only the fields changed, e.g. after edits
+            file_name: Original file name, for reference
+            error: Document-level error message, if processing failed
+            edited: True when the fields were corrected by a user
+        """
+        # Millisecond precision, as stored, so word rows match their document row
+        processed_at = datetime.now(timezone.utc)
+        processed_at = processed_at.replace(microsecond=processed_at.microsecond // 1000 * 1000)
+        processed_date = processed_at.strftime('%Y-%m-%d')
+
+        row = {
+            'doc_id': doc_id,
+            'file_name': file_name,
+            'processed_at': processed_at,
+            'pages': len(pages) if pages is not None else None,
+            'error': error,
+            'edited': edited,
+            'processed_date': processed_date,
+        }
+        for field in FIELD_NAMES:
+            value = fields.get(field)
+            row[field] = None if value is None else str(value)
+        self._documents.append(row)
+
+        for page in pages or []:
+            words = page_words(page)
+            if words is None or words.empty:
+                continue
+            words = words.assign(doc_id=doc_id, page=page['page'], processed_at=processed_at,
+                                 processed_date=processed_date)
+            self._words.append(pa.Table.from_pandas(words, schema=WORD_SCHEMA, preserve_index=False))
+            self._buffered_words += len(words)
+
+        if len(self._documents) >= self.batch_size or self._buffered_words >= self.max_buffered_words:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows as new Parquet files."""
+        if self._documents:
+            table = pa.Table.from_pylist(self._documents, schema=DOCUMENT_SCHEMA)
+            self._write(table, 'documents')
+            self._documents = []
+        if self._words:
+            table = pa.concat_tables(self._words)
+            self._write(table, 'words')
+            self._words = []
+            self._buffered_words = 0
+
+    def _write(self, table, name):
+        pq.write_to_dataset(
+            table,
+            root_path=os.path.join(self.root, name),
+            partition_cols=['processed_date'],
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore',
+            compression='zstd',
+        )
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def document_id(file_path):
+    """Return the content hash used as doc_id, so the same file always maps to one id."""
+    return file_digest(file_path)
+
+def save_document_result(doc_id, fields, pages=None, file_name=None, root=DEFAULT_RESULTS_DIR,
+                         edited=False):
+    """Append a single document's results to the Parquet datasets."""
+    with ParquetResultWriter(root, batch_size=1) as writer:
+        writer.add(doc_id, fields, pages=pages, file_name=file_name, edited=edited)
+
+def open_dataset(name, root=DEFAULT_RESULTS_DIR):
+    """
+    Open the 'documents' or 'words' dataset for scanning.
+
+    Args:
+        name: Dataset name, 'documents' or 'words'
+        root: Root directory of the datasets
+
+    Returns:
+        pyarrow.dataset.Dataset; filter and project with to_table/to_batches
+    """
+    schema = {'documents': DOCUMENT_SCHEMA, 'words': WORD_SCHEMA}[name]
+    return ds.dataset(os.path.join(root, name), schema=schema, format='parquet', partitioning='hive')
@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+SAMPLE_DOCS = ROOT / "sample_docs"
+
+@pytest.fixture
+def sample_text():
+    """Return a loader for the text of a sample document by name."""
+    def load(name):
+        return (SAMPLE_DOCS / f"{name}.txt").read_text()
+    return load
@@ -0,0 +1,87 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import batch_process
+from batch_process import load_checkpoint, run_batch
+from ocr_cache import file_digest
+
+@pytest.fixture
+def docs(tmp_path, sample_text):
+    folder = tmp_path / 'docs'
+    folder.mkdir()
+    for name in ('loan_application', 'loan_agreement', 'mortgage_loan'):
+        (folder / f'{name}.txt').write_text(sample_text(name))
+    return folder
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """Run documents in threads and record each stubbed extraction with its digest."""
+    calls = {}
+
+    def extract_pages_from_file(path, workers=None, digest=None):
+        calls[path] = digest
+        with open(path, encoding='utf-8') as file:
+            text = file.read()
+        return [{'page': 1, 'text': text, 'words': None, 'error': None, 'source': 'text', 'page_type': 'text'}]
+
+    monkeypatch.setattr(batch_process, 'extract_pages_from_file', extract_pages_from_file)
+    monkeypatch.setattr(batch_process, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    return calls
+
+def read_records(path):
+    with open(path, encoding='utf-8') as output:
+        return [json.loads(line) for line in output]
+
+def test_restart_skips_finished_documents(docs, tmp_path, extracted):
+    output = tmp_path / 'results.jsonl'
+    assert run_batch(str(docs), str(output), workers=2, report_interval=60) == 3
+    assert len(extracted) == 3
+
+    extracted.clear()
+    assert run_batch(str(docs), str(output), workers=2, report_interval=60) == 0
+    assert extracted == {}
+    assert len(read_records(output)) == 3
+
+def test_interrupted_run_resumes(docs, tmp_path, extracted):
+    output = tmp_path / 'results.jsonl'
+    run_batch(str(docs), str(output), workers=1, report_interval=60)
+    records = read_records(output)
+    # Keep one finished document and a line cut short by the interruption
+    with open(output, 'w', encoding='utf-8') as file:
+        file.write(json.dumps(records[0]) + '\n' + json.dumps(records[1])[:20])
+
+    extracted.clear()
+    assert run_batch(str(docs), str(output), workers=1, report_interval=60) == 2
+    assert sorted(extracted) == sorted(record['path'] for record in records[1:])
+    assert load_checkpoint(output) == {record['path'] for record in records}
+
+def test_retry_failed_documents(docs, tmp_path, extracted):
+    output = tmp_path / 'results.jsonl'
+    run_batch(str(docs), str(output), workers=1, report_interval=60)
+    records = read_records(output)
+    records[0]['error'] = 'RuntimeError: OCR failed'
+    with open(output, 'w', encoding='utf-8') as file:
+        file.writelines(json.dumps(record) + '\n' for record in records)
+
+    extracted.clear()
+    assert run_batch(str(docs), str(output), workers=1, report_interval=60) == 0
+    assert run_batch(str(docs), str(output), workers=1, report_interval=60, retry_failed=True) == 1
+    assert list(extracted) == [records[0]['path']]
+
+def test_file_is_hashed_once(docs, extracted, monkeypatch):
+    hashed = []
+
+    def digest(path):
+        hashed.append(path)
+        return file_digest(path)
+
+    monkeypatch.setattr(batch_process, 'file_digest', digest)
+    path = str(docs / 'loan_application.txt')
+    record = batch_process.process_file(path)
+    assert record['error'] is None
+    assert record['document_type'] == 'loan_application'
+    assert hashed == [path]
+    # The digest doubles as the OCR cache key of the document
+    assert extracted[path] == record['doc_id'] == file_digest(path)
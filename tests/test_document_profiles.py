@@ -0,0 +1,39 @@
+import pytest
+
+from document_profiles import classify_document
+
+def page(text, error=None):
+    return {'text': text, 'error': error}
+
+@pytest.mark.parametrize('name, doc_type', [
+    ('loan_application', 'loan_application'),
+    ('loan_agreement', 'loan_agreement'),
+    ('mortgage_loan', 'mortgage'),
+    ('amortization_schedule', 'amortization_schedule'),
+])
+def test_sample_documents(sample_text, name, doc_type):
+    assert classify_document([page(sample_text(name))]) == doc_type
+
+def test_body_keywords_are_not_titles():
+    text = ("PERSONAL LOAN AGREEMENT\n\n"
+            "Agreement Date: 06/01/2023\n\n"
+            "Lender: First National Bank\n\n"
+            "The Borrower shall repay the loan according to the payment schedule\n"
+            "attached as Exhibit A.\n")
+    assert classify_document([page(text)]) == 'loan_agreement'
+
+def test_title_lines_after_letterhead():
+    text = "First National Bank\n\n555 Financial Blvd\nLOAN APPLICATION\nApplicant: John A. Smith\n"
+    assert classify_document([page(text)]) == 'loan_application'
+
+def test_specific_type_wins_on_one_title_line():
+    assert classify_document([page("Mortgage Loan Agreement\n")]) == 'mortgage'
+    assert classify_document([page("Loan Agreement Payment Schedule\n")]) == 'amortization_schedule'
+
+def test_first_page_with_text_decides():
+    pages = [page('', error='unreadable'), page('\n \n'), page("Promissory Note\n"), page("Loan Application\n")]
+    assert classify_document(pages) == 'loan_agreement'
+
+def test_unknown_without_title():
+    text = "Borrower: John A. Smith\nAmount: $25,000\nDate: 06/01/2023\nSee the payment schedule below.\n"
+    assert classify_document([page(text)]) == 'unknown'
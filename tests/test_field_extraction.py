@@ -0,0 +1,112 @@
+import pytest
+
+from ocr_utils import FIELD_RULES, clean_extracted_value, extract_loan_details
+
+def test_loan_application_fields(sample_text):
+    details = extract_loan_details(sample_text("loan_application"))
+    assert details == {
+        'loan_amount': '25,000',
+        'interest_rate': '7.5',
+        'loan_term': '5 years',
+        'loan_type': 'Personal Unsecured',
+        'borrower_name': 'John A. Smith',
+        'borrower_address': '123 Main Street, Apt 4B, San Francisco, CA 94105',
+        'borrower_phone': '(415) 555-7890',
+        'borrower_email': 'johnsmith@email.com',
+        'social_security': '123-45-6789',
+        'application_date': '05/15/2023',
+    }
+
+def test_mortgage_loan_fields(sample_text):
+    details = extract_loan_details(sample_text("mortgage_loan"))
+    assert details['loan_amount'] == '360,000'
+    assert details['interest_rate'] == '4.25'
+    assert details['loan_term'] == '30 years'
+    assert details['loan_type'] == 'Fixed-Rate Mortgage'
+    assert details['borrower_name'] == 'Maria R. Garcia'
+    assert details['lender_name'] == 'Pacific Northwest Mortgage Company'
+    assert details['application_date'] == '08/15/2023'
+    # The value follows a dashed separator line under the label
+    assert details['collateral'] == 'The property described above shall serve as collateral for this mortgage loan'
+
+def test_separator_lines_between_label_and_value():
+    details = extract_loan_details("Loan Type:\n=========\nPersonal Loan\nCollateral:\n\nLender: First Bank")
+    assert details['loan_type'] == 'Personal Loan'
+    # A blank line is not a separator; the value would belong to the next label
+    assert 'collateral' not in details
+
+def test_loan_agreement_fields(sample_text):
+    details = extract_loan_details(sample_text("loan_agreement"))
+    assert details['lender_name'] == 'First National Bank'
+    assert details['collateral'] == 'This loan is unsecured'
+    assert details['social_security'] == '123-45-6789'
+    # Prose numbers ("LOAN AMOUNT: The Lender agrees ...") are not values
+    assert 'loan_amount' not in details
+
+def test_amortization_schedule_fields(sample_text):
+    details = extract_loan_details(sample_text("amortization_schedule"))
+    assert details['loan_amount'] == '25,000.00'
+    assert details['interest_rate'] == '7.5'
+    assert details['loan_term'] == '5 years'
+
+def test_every_field_type_is_covered(sample_text):
+    found = {}
+    for name in ("loan_application", "mortgage_loan", "loan_agreement", "amortization_schedule"):
+        found.update(extract_loan_details(sample_text(name)))
+    assert set(found) == set(FIELD_RULES)
+
+def test_subset_of_fields(sample_text):
+    details = extract_loan_details(sample_text("loan_application"), fields=['loan_amount', 'borrower_email'])
+    assert details == {'loan_amount': '25,000', 'borrower_email': 'johnsmith@email.com'}
+
+def test_page_record_input(sample_text):
+    page = {'text': sample_text("loan_application")}
+    assert extract_loan_details(page)['loan_term'] == '5 years'
+
+@pytest.mark.parametrize("raw, expected", [
+    ("Loan Amount: $25,OOO", '25,000'),
+    ("Loan Amount: $1l,5I0", '11,510'),
+    ("Interest Rate: 7.O%", '7.0'),
+    ("Loan Amount: $2o,000.", '20,000'),
+])
+def test_ocr_digit_confusions_in_numbers(raw, expected):
+    field = 'interest_rate' if raw.startswith('Interest') else 'loan_amount'
+    assert extract_loan_details(raw)[field] == expected
+
+def test_digit_fixes_do_not_touch_text_fields():
+    details = extract_loan_details("Loan Type: Ol1 Line of Credit\nBorrower Name: OLIVIA LI")
+    assert details['loan_type'] == 'Ol1 Line of Credit'
+    assert details['borrower_name'] == 'Olivia Li'
+
+def test_clean_extracted_value_types():
+    assert clean_extracted_value('O5/l5/2O23', 'date') == '05/15/2023'
+    assert clean_extracted_value('John.Smith@Email.COM', 'email') == 'john.smith@email.com'
+    assert clean_extracted_value('  JOHN   SMITH ,', 'name') == 'John Smith'
+    assert clean_extracted_value('123 Main St.;', 'text') == '123 Main St'
+    assert clean_extracted_value(None) is None
+
+def test_formatted_types():
+    details = extract_loan_details(
+        "Phone 415.555.7890\nSSN 123456789\nLoan Term: 60 MONTHS"
+    )
+    assert details['borrower_phone'] == '(415) 555-7890'
+    assert details['social_security'] == '123-45-6789'
+    assert details['loan_term'] == '60 months'
+
+def test_label_without_colon():
+    text = "Loan Amount $25,000\nInterest Rate 7.5%\nLoan Type Personal Unsecured\nBorrower Name John Smith"
+    details = extract_loan_details(text)
+    # Numeric values are unambiguous right after their keyword
+    assert details['loan_amount'] == '25,000'
+    assert details['interest_rate'] == '7.5'
+    # Free-text values need the colon, so prose mentioning a keyword isn't captured
+    assert 'loan_type' not in details
+    assert 'borrower_name' not in details
+
+def test_label_value_on_next_line():
+    details = extract_loan_details("Borrower Name:\nJane Doe\nLoan Type:\n  Auto Loan")
+    assert details['borrower_name'] == 'Jane Doe'
+    assert details['loan_type'] == 'Auto Loan'
+
+def test_keyword_inside_word_is_ignored():
+    assert 'borrower_email' not in extract_loan_details("Reemail: a@b.com")
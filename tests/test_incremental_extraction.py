@@ -0,0 +1,35 @@
+import numpy as np
+import tifffile
+
+from batch_process import process_file
+from conftest import SAMPLE_DOCS
+from ocr_utils import IncrementalExtraction, document_page_count
+
+def test_single_page_document_is_complete():
+    path = str(SAMPLE_DOCS / "loan_application.txt")
+    with IncrementalExtraction(path) as extraction:
+        fields = extraction.extract(['loan_amount'])
+        assert fields['loan_amount'] == '25,000'
+        # The page iterator has not reported its end yet
+        assert not extraction.exhausted
+        assert extraction.complete
+
+def test_process_file_reports_complete():
+    record = process_file(str(SAMPLE_DOCS / "loan_application.txt"), required_fields=['loan_amount'])
+    assert record['error'] is None
+    assert record['pages'] == 1
+    assert record['complete'] is True
+
+def test_document_page_count(tmp_path):
+    path = tmp_path / "scan.tif"
+    tifffile.imwrite(path, np.full((3, 20, 20), 255, np.uint8), photometric='minisblack')
+    assert document_page_count(str(path)) == 3
+    assert document_page_count(path.read_bytes()) == 3
+    assert document_page_count(str(SAMPLE_DOCS / "mortgage_loan.txt")) == 1
+
+def test_unread_pages_are_incomplete(tmp_path):
+    path = tmp_path / "scan.tif"
+    tifffile.imwrite(path, np.full((3, 20, 20), 255, np.uint8), photometric='minisblack')
+    with IncrementalExtraction(str(path), cache=False) as extraction:
+        # Nothing has been processed yet
+        assert not extraction.complete
@@ -0,0 +1,88 @@
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from instrumentation import MetricsRegistry, stage, subprocess_cpu, summarize, trace
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def test_stage_records_span():
+    with trace(page=3) as spans:
+        with stage('work'):
+            busy(0.02)
+    [span] = spans
+    assert span['stage'] == 'work'
+    assert span['page'] == 3
+    assert span['wall'] >= 0.02
+    assert span['cpu'] > 0.01
+
+def test_cpu_time_excludes_other_threads():
+    worker = threading.Thread(target=busy, args=(0.2,))
+    with trace() as spans:
+        with stage('wait'):
+            worker.start()
+            worker.join()
+    assert spans[0]['wall'] >= 0.2
+    assert spans[0]['cpu'] < 0.1
+
+def test_subprocess_cpu_counts_only_wrapped_children():
+    code = "import time\nend = time.perf_counter() + 0.2\nwhile time.perf_counter() < end: pass"
+    with trace() as spans:
+        with stage('outer'):
+            with stage('unwrapped'):
+                subprocess.run([sys.executable, '-c', code], check=True)
+            with stage('wrapped'):
+                with subprocess_cpu():
+                    subprocess.run([sys.executable, '-c', code], check=True)
+    cpu = {span['stage']: span['cpu'] for span in spans}
+    assert cpu['unwrapped'] < 0.1
+    assert cpu['wrapped'] >= 0.15
+    # Enclosing stages include their inner stages' subprocesses
+    assert cpu['outer'] >= 0.15
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="RSS is read from /proc")
+def test_rss_delta_of_kept_allocation():
+    with trace() as spans:
+        with stage('allocate'):
+            kept = np.ones(64 * 1024 * 1024, np.uint8)
+    assert spans[0]['rss_delta'] >= 48 * 1024 * 1024
+    assert spans[0]['rss_peak'] >= spans[0]['rss_delta']
+    del kept
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="RSS is read from /proc")
+def test_rss_peak_of_freed_allocation():
+    with trace() as spans:
+        with stage('outer'):
+            with stage('allocate'):
+                scratch = np.ones(64 * 1024 * 1024, np.uint8)
+                time.sleep(0.1)
+                del scratch
+    for span in spans:
+        # The memory is returned before the stages end, but their peak keeps it
+        assert span['rss_delta'] < 16 * 1024 * 1024
+        assert span['rss_peak'] >= 48 * 1024 * 1024
+
+def test_aggregates():
+    spans = [
+        {'stage': 'ocr', 'page': 1, 'wall': 0.5, 'cpu': 0.4, 'rss_peak': 150, 'rss_delta': 100},
+        {'stage': 'ocr', 'page': 2, 'wall': 1.5, 'cpu': 1.2, 'rss_peak': 300, 'rss_delta': -50},
+        {'stage': 'table', 'page': 1, 'wall': 0.01, 'cpu': 0.01, 'rss_peak': None, 'rss_delta': None},
+    ]
+    summary = summarize(spans)
+    assert summary['ocr'] == {'count': 2, 'wall': 2.0, 'cpu': 1.6, 'rss_peak': 300, 'rss_delta': 100}
+    assert summary['table']['rss_peak'] is None
+
+    registry = MetricsRegistry(buckets=(1.0,))
+    for span in spans:
+        registry.observe(span)
+    text = registry.render()
+    assert 'loan_doc_stage_seconds_bucket{stage="ocr",le="1.0"} 1' in text
+    assert 'loan_doc_stage_rss_peak_growth_bytes{stage="ocr"} 300' in text
+    assert 'loan_doc_stage_rss_peak_growth_bytes{stage="table"}' not in text
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+import job_service
+from job_service import CANCELLED, DONE, QUEUED, JobQueue, QueueFullError
+
+def page(number, text):
+    return {'page': number, 'text': text, 'words': None, 'error': None, 'source': 'text', 'page_type': 'text'}
+
+def wait_for(jobs, job_id, states, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = jobs.status(job_id)
+        if status['status'] in states:
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"job still {jobs.status(job_id)['status']}")
+
+@pytest.fixture
+def paged(monkeypatch):
+    """Page iterator stub that yields its second page only once `next_page` is set."""
+    next_page, closed = threading.Event(), threading.Event()
+
+    def iter_pages_from_file(data, file_name=None, settings=None):
+        try:
+            yield page(1, "LOAN APPLICATION\nLoan Amount: $25,000")
+            next_page.wait(5)
+            yield page(2, "Interest Rate: 6.5%")
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(job_service, 'iter_pages_from_file', iter_pages_from_file)
+    return next_page, closed
+
+def test_full_queue_rejects_submissions():
+    # No workers, so submitted jobs stay queued
+    jobs = JobQueue(workers=0, max_pending=2)
+    first = jobs.submit(b'a', 'a.txt')
+    jobs.submit(b'b', 'b.txt')
+    with pytest.raises(QueueFullError):
+        jobs.submit(b'c', 'c.txt')
+    assert jobs.stats()[QUEUED] == 2
+
+    # Cancelling a queued job frees its place
+    assert jobs.cancel(first)['status'] == CANCELLED
+    jobs.submit(b'c', 'c.txt')
+    stats = jobs.stats()
+    assert (stats[QUEUED], stats[CANCELLED]) == (2, 1)
+
+def test_unsupported_file_type_is_rejected():
+    jobs = JobQueue(workers=0)
+    with pytest.raises(ValueError):
+        jobs.submit(b'a', 'a.docx')
+
+def test_job_runs_to_completion(paged):
+    next_page, closed = paged
+    next_page.set()
+    jobs = JobQueue(workers=1)
+    job_id = jobs.submit(b'data', 'doc.txt')
+    status = wait_for(jobs, job_id, (DONE,))
+    assert status['pages_done'] == 2
+    result = jobs.result(job_id)
+    assert result['fields']['loan_amount'] == '25,000'
+    assert result['document_type'] == 'loan_application'
+    assert closed.is_set()
+
+def test_running_job_is_cancelled_between_pages(paged):
+    next_page, closed = paged
+    jobs = JobQueue(workers=1)
+    job_id = jobs.submit(b'data', 'doc.txt')
+    deadline = time.monotonic() + 5
+    while jobs.status(job_id)['pages_done'] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    jobs.cancel(job_id)
+    next_page.set()
+    status = wait_for(jobs, job_id, (CANCELLED,))
+    # The page after the cancellation is not kept, and the iterator is closed
+    assert status['pages_done'] == 1
+    assert jobs.result(job_id) is None
+    assert closed.is_set()
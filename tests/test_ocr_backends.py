@@ -0,0 +1,76 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import ocr_backends
+from ocr_backends import TesserocrBackend, get_backend
+
+TSV = "1\t1\t0\t0\t0\t0\t0\t0\t100\t40\t-1\t\n5\t1\t1\t1\t1\t1\t10\t12\t60\t18\t91.5\tLoan\n"
+
+class FakeAPI:
+    instances = []
+
+    def __init__(self, lang='eng', oem=3):
+        assert isinstance(oem, int)
+        self.lang, self.oem = lang, oem
+        self.psm, self.ended = None, False
+        FakeAPI.instances.append(self)
+
+    def SetPageSegMode(self, psm):
+        assert isinstance(psm, int)
+        self.psm = psm
+
+    def SetImage(self, image):
+        self.image = image
+
+    def Recognize(self):
+        pass
+
+    def GetUTF8Text(self):
+        return "Loan\n"
+
+    def GetTSVText(self, page):
+        return TSV
+
+    def End(self):
+        self.ended = True
+
+@pytest.fixture
+def fake_tesserocr(monkeypatch):
+    """Install a stand-in tesserocr module; like the real one, OEM/PSM only hold int constants."""
+    module = types.ModuleType('tesserocr')
+    module.PyTessBaseAPI = FakeAPI
+    module.OEM = type('OEM', (), {'DEFAULT': 3, 'LSTM_ONLY': 1})
+    module.PSM = type('PSM', (), {'SINGLE_BLOCK': 6, 'SINGLE_LINE': 7})
+    monkeypatch.setitem(sys.modules, 'tesserocr', module)
+    monkeypatch.setattr(ocr_backends, '_backends', {})
+    FakeAPI.instances = []
+    return module
+
+def test_tesserocr_modes_are_passed_as_ints(fake_tesserocr):
+    backend = TesserocrBackend()
+    image = np.full((40, 100), 255, np.uint8)
+    data = backend.image_to_data(image, '--oem 1 --psm 6')
+    assert data['text'].tolist()[-1] == 'Loan'
+    assert data['conf'].tolist()[-1] == 91.5
+    [api] = FakeAPI.instances
+    assert (api.oem, api.psm) == (1, 6)
+
+    # The engine stays warm across page segmentation modes, and is replaced for another OEM
+    assert backend.image_to_string(image, '--oem 1 --psm 7') == "Loan\n"
+    assert len(FakeAPI.instances) == 1 and api.psm == 7
+    backend.image_to_string(image, '--oem 3 --psm 6')
+    assert len(FakeAPI.instances) == 2 and api.ended
+
+    backend.close()
+    assert FakeAPI.instances[1].ended
+
+def test_auto_prefers_tesserocr(fake_tesserocr):
+    assert get_backend('auto').name == 'tesserocr'
+
+def test_auto_falls_back_without_tesserocr(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'tesserocr', None)
+    monkeypatch.setattr(ocr_backends, '_backends', {})
+    assert get_backend('auto').name == 'pytesseract'
@@ -0,0 +1,83 @@
+import itertools
+
+import pytest
+
+import ocr_cache
+from ocr_cache import OCRCache, make_cache_key
+
+PAGES = [{'page': 1, 'text': 'Loan Amount: $25,000', 'words': None, 'error': None}]
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Make cache access times strictly increasing."""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(ocr_cache.time, 'time', lambda: float(next(ticks)))
+
+def test_put_and_get(tmp_path):
+    cache = OCRCache(tmp_path)
+    assert cache.get('missing') is None
+    cache.put('key', PAGES)
+    assert cache.get('key') == PAGES
+    # Another instance on the same directory sees the entry
+    assert OCRCache(tmp_path).get('key') == PAGES
+
+def test_put_replaces_entry(tmp_path):
+    cache = OCRCache(tmp_path)
+    cache.put('key', PAGES)
+    cache.put('key', [])
+    assert cache.get('key') == []
+    assert cache.stats()['entries'] == 1
+
+def test_lru_eviction(tmp_path, clock):
+    cache = OCRCache(tmp_path)
+    pages = [{'page': 1, 'text': 'x' * 100}]
+    for key in ('a', 'b', 'c'):
+        cache.put(key, pages)
+    size = cache.stats()['bytes'] // 3
+    cache.get('a')
+
+    cache.max_bytes = 3 * size
+    cache.put('d', pages)
+    assert cache.get('b') is None
+    assert cache.get('a') == pages
+    assert cache.get('c') == pages
+    assert cache.get('d') == pages
+
+def test_oversized_entry_is_not_stored(tmp_path):
+    cache = OCRCache(tmp_path, max_bytes=10)
+    cache.put('key', PAGES)
+    assert cache.get('key') is None
+
+def test_clear_and_stats(tmp_path):
+    cache = OCRCache(tmp_path, max_bytes=1 << 20)
+    cache.put('a', PAGES)
+    cache.put('b', PAGES)
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['bytes'] > 0
+    assert stats['max_bytes'] == 1 << 20
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+    assert cache.get('a') is None
+
+def test_make_cache_key(sample_text, tmp_path):
+    path = tmp_path / 'doc.txt'
+    path.write_text(sample_text("loan_application"))
+    params = {'preprocessing': 'default', 'ocr_config': '--psm 6'}
+    key = make_cache_key(str(path), params)
+    # Same bytes give the same key whether read from disk or passed directly
+    assert key == make_cache_key(path.read_bytes(), params)
+    assert key != make_cache_key(path.read_bytes(), dict(params, ocr_config='--psm 4'))
+    assert key != make_cache_key(b'other', params)
+
+def test_make_cache_key_reuses_known_digest(sample_text, tmp_path, monkeypatch):
+    path = tmp_path / 'doc.txt'
+    path.write_text(sample_text("loan_application"))
+    params = {'preprocessing': 'default'}
+    key = make_cache_key(str(path), params)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("document hashed again")
+
+    monkeypatch.setattr(ocr_cache, 'file_digest', fail)
+    assert make_cache_key(str(path), params, digest=key.split(':')[0]) == key
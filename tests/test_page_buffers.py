@@ -0,0 +1,85 @@
+from contextlib import suppress
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+import page_buffers
+from page_buffers import PageBufferPool, open_page
+
+@pytest.fixture(autouse=True)
+def attached(monkeypatch):
+    """Give each test its own worker-side mappings and drop them afterwards."""
+    mappings = {}
+    monkeypatch.setattr(page_buffers, '_attached', mappings)
+    yield mappings
+    for segment in mappings.values():
+        with suppress(BufferError):
+            segment.close()
+
+def page(value, shape=(40, 30)):
+    return np.full(shape, value, np.uint8)
+
+def test_put_and_open_page():
+    with PageBufferPool(2) as pool:
+        image = np.arange(40 * 30 * 3, dtype=np.uint8).reshape(40, 30, 3)
+        handle = pool.put(image)
+        mapped = open_page(handle)
+        assert np.array_equal(mapped, image)
+        assert not mapped.flags.writeable
+        del mapped
+        pool.release(handle)
+
+def test_full_pool_waits_for_release():
+    with PageBufferPool(1) as pool:
+        handle = pool.put(page(1))
+        with pytest.raises(TimeoutError):
+            pool.put(page(2), timeout=0.01)
+        pool.release(handle)
+        pool.release(pool.put(page(2), timeout=0.01))
+
+def test_released_slot_is_reused_in_place():
+    with PageBufferPool(1) as pool:
+        first = pool.put(page(1))
+        pool.release(first)
+        second = pool.put(page(2, shape=(20, 30)))
+        assert (second.slot, second.name) == (first.slot, first.name)
+        assert np.array_equal(open_page(second), page(2, shape=(20, 30)))
+
+def test_larger_page_reallocates_its_slot():
+    with PageBufferPool(1) as pool:
+        small = pool.put(page(1))
+        pool.release(small)
+        large = pool.put(page(2, shape=(400, 300)))
+        assert large.slot == small.slot and large.name != small.name
+        # The outgrown buffer is unlinked
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=small.name)
+
+def test_open_page_reattaches_after_reallocation(attached):
+    with PageBufferPool(1) as pool:
+        small = pool.put(page(1))
+        assert np.array_equal(open_page(small), page(1))
+        pool.release(small)
+        large = pool.put(page(2, shape=(400, 300)))
+        assert np.array_equal(open_page(large), page(2, shape=(400, 300)))
+        assert attached[large.slot].name == large.name
+
+def test_failed_allocation_frees_the_slot(monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("No space left on device")
+
+    with PageBufferPool(1) as pool:
+        with monkeypatch.context() as patch:
+            patch.setattr(page_buffers.shared_memory, 'SharedMemory', fail)
+            with pytest.raises(OSError):
+                pool.put(page(1))
+        pool.release(pool.put(page(1), timeout=0.01))
+
+def test_close_unlinks_buffers():
+    pool = PageBufferPool(2)
+    names = [pool.put(page(1)).name, pool.put(page(2)).name]
+    pool.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
@@ -0,0 +1,146 @@
+import contextlib
+import io
+
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import SAMPLE_DOCS
+from convert_to_image import text_to_image
+from page_index import PageIndex, hash_bands, page_hash
+
+RECORD = {'text': 'Loan Amount: $25,000', 'words': None, 'source': 'ocr', 'page_type': 'text'}
+
+@pytest.fixture
+def render(tmp_path):
+    """Return a renderer of a sample document's first page as a grayscale image."""
+    def render_page(name):
+        output = tmp_path / f"{name}.png"
+        # The generator reports every file it writes
+        with contextlib.redirect_stdout(io.StringIO()):
+            text_to_image(str(SAMPLE_DOCS / f"{name}.txt"), str(output))
+        return cv2.imread(str(output), cv2.IMREAD_GRAYSCALE)
+    return render_page
+
+def shifted(gray, dx, dy):
+    """The page moved by (dx, dy) pixels on a white background, like a rescan."""
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(gray, matrix, gray.shape[::-1], borderValue=255)
+
+def test_hash_bands_cover_all_bits():
+    value = (1 << 64) - 1
+    bands = hash_bands(value, 5)
+    assert [band for band, _ in bands] == list(range(5))
+    assert sum(bits.bit_length() for _, bits in bands) == 64
+
+def test_exact_page_is_found(tmp_path, render):
+    index = PageIndex(tmp_path / "index")
+    page = render("loan_application")
+    index.add(page, 'params', RECORD)
+    match = index.lookup(page, 'params')
+    assert match['record'] == RECORD
+    assert match['distance'] == 0
+    # Offsets are in page pixels, measured on the smaller verification mask
+    assert all(abs(v) <= 2 for v in match['offset'])
+
+def test_rescanned_page_is_found_with_offset(tmp_path, render):
+    index = PageIndex(tmp_path / "index")
+    page = render("loan_application")
+    index.add(page, 'params', RECORD)
+    match = index.lookup(shifted(page, 12, -8), 'params')
+    assert match is not None
+    assert match['distance'] <= index.max_distance
+    dx, dy = match['offset']
+    assert abs(dx - 12) <= 2 and abs(dy + 8) <= 2
+    assert page_hash(shifted(page, 12, -8)) == page_hash(page)
+
+def test_different_page_or_params_miss(tmp_path, render):
+    index = PageIndex(tmp_path / "index")
+    index.add(render("loan_application"), 'params', RECORD)
+    assert index.lookup(render("mortgage_loan"), 'params') is None
+    assert index.lookup(render("loan_application"), 'other params') is None
+
+def test_same_page_replaces_row(tmp_path, render):
+    index = PageIndex(tmp_path / "index")
+    page = render("loan_application")
+    index.add(page, 'params', RECORD)
+    index.add(page, 'params', dict(RECORD, text='Loan Amount: $26,000'))
+    assert index.stats()['pages'] == 1
+    assert index.lookup(page, 'params')['record']['text'] == 'Loan Amount: $26,000'
+    # Other parameters are a separate entry
+    index.add(page, 'other params', RECORD)
+    assert index.stats()['pages'] == 2
+
+def test_size_limit_and_clear(tmp_path, render):
+    index = PageIndex(tmp_path / "index")
+    first, second = render("loan_application"), render("mortgage_loan")
+    index.add(first, 'params', RECORD)
+    index.add(second, 'params', RECORD)
+    index.max_bytes = index.stats()['bytes'] - 1
+    index.add(first, 'params', dict(RECORD, text='Loan Amount: $26,000 (rescan)'))
+    # The least recently used page was evicted to make room
+    assert index.stats()['pages'] == 1
+    assert index.lookup(first, 'params')['record']['text'] == 'Loan Amount: $26,000 (rescan)'
+    index.clear()
+    assert index.stats()['pages'] == 0
+
+def test_invalid_max_distance(tmp_path):
+    with pytest.raises(ValueError):
+        PageIndex(tmp_path, max_distance=16)
+
+def line_words(lines):
+    """Word rows of a page with one word per line, 30 pixels apart."""
+    return {
+        'block_num': [1] * len(lines), 'par_num': [1] * len(lines),
+        'line_num': list(range(1, len(lines) + 1)), 'word_num': [1] * len(lines),
+        'left': [20] * len(lines), 'top': [30 * i + 10 for i in range(len(lines))],
+        'width': [200] * len(lines), 'height': [16] * len(lines),
+        'conf': [95] * len(lines), 'text': list(lines),
+    }
+
+@pytest.fixture
+def stacked_ocr(monkeypatch):
+    """OCR stub for the stacked field lines, reading `readings[i]` on line crop i."""
+    import ocr_utils
+    calls, readings = [], []
+    stack = ocr_utils._stack_crops
+    
+    def stack_crops(crops):
+        image, tops = stack(crops)
+        calls.append((image, tops, [crop.shape[0] for crop in crops]))
+        return image, tops
+    
+    def ocr_page_data(image, backend=None, config=None):
+        _, tops, heights = calls[-1]
+        return {'text': '', 'words': pd.DataFrame({
+            'block_num': 1, 'par_num': 1, 'line_num': range(1, len(tops) + 1), 'word_num': 1,
+            'left': 6, 'top': [int(t) + 4 for t in tops], 'width': 200,
+            'height': [h - 8 for h in heights], 'conf': 90, 'text': readings[:len(tops)],
+        }, columns=ocr_utils.WORD_COLUMNS)}
+    
+    monkeypatch.setattr(ocr_utils, '_stack_crops', stack_crops)
+    monkeypatch.setattr(ocr_utils, 'ocr_page_data', ocr_page_data)
+    return calls, readings
+
+def test_field_lines_verified_in_one_pass(stacked_ocr):
+    from ocr_utils import _verify_field_lines
+    calls, readings = stacked_ocr
+    page = np.full((400, 400), 255, np.uint8)
+    words = line_words(['Loan Amount:', '$25,000', 'Thanks', 'Ref', '12/01/2023'])
+    
+    # The amount keyword line, the line after it and the date are checked
+    readings[:] = ['Loan Amount', '$25,000', '12/01/2023']
+    assert _verify_field_lines(page, words) == 3
+    assert len(calls) == 1
+    
+    readings[:] = ['Loan Amount', '$26,000', '12/01/2023']
+    assert _verify_field_lines(page, words) is None
+
+def test_field_lines_over_cap_are_not_verified(stacked_ocr, monkeypatch):
+    import ocr_utils
+    calls, _ = stacked_ocr
+    monkeypatch.setattr(ocr_utils, 'VERIFY_MAX_LINES', 2)
+    page = np.full((400, 400), 255, np.uint8)
+    assert ocr_utils._verify_field_lines(page, line_words(['1', '2', '3'])) is None
+    assert not calls
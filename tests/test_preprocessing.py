@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+import pytest
+
+import preprocessing
+from preprocessing import PASS_THROUGH, StageMemo, run_preprocessing
+
+@pytest.fixture
+def clean_page():
+    """A straight, noise-free page at the working width: denoise and deskew pass it through."""
+    page = np.full((600, 1700, 3), 255, np.uint8)
+    for y in range(60, 560, 40):
+        cv2.line(page, (100, y), (1500, y), (0, 0, 0), 3)
+    return page
+
+@pytest.fixture
+def estimates(monkeypatch):
+    """Count the noise and skew estimations."""
+    calls = {'noise': 0, 'skew': 0}
+    estimate_noise, estimate_skew_angle = preprocessing.estimate_noise, preprocessing.estimate_skew_angle
+
+    def noise(image):
+        calls['noise'] += 1
+        return estimate_noise(image)
+
+    def skew(image, max_width=800):
+        calls['skew'] += 1
+        return estimate_skew_angle(image, max_width)
+
+    monkeypatch.setattr(preprocessing, 'estimate_noise', noise)
+    monkeypatch.setattr(preprocessing, 'estimate_skew_angle', skew)
+    return calls
+
+def test_pass_through_stages_are_not_redone(clean_page, estimates):
+    memo = StageMemo(64 * 1024 * 1024)
+    first_report, second_report = {}, {}
+    first, _ = run_preprocessing(clean_page, {'threshold_type': 'otsu'}, first_report, memo=memo)
+    assert first_report['denoise_method'] == 'none'
+    assert estimates == {'noise': 1, 'skew': 1}
+
+    second, _ = run_preprocessing(clean_page, {'threshold_type': 'binary'}, second_report, memo=memo)
+    assert estimates == {'noise': 1, 'skew': 1}
+    assert second_report['reused_stages'] == ['resize', 'grayscale', 'denoise', 'deskew']
+    assert second_report['noise_sigma'] == first_report['noise_sigma']
+    expected, _ = run_preprocessing(clean_page, {'threshold_type': 'binary'}, memo=False)
+    assert np.array_equal(second, expected)
+
+def test_pass_through_of_the_input_is_resumed(estimates):
+    # Already gray and at the working width: every stage up to deskew passes through
+    page = np.full((400, 1700), 255, np.uint8)
+    cv2.line(page, (100, 200), (1500, 200), 0, 3)
+    memo = StageMemo(64 * 1024 * 1024)
+    run_preprocessing(page, {'threshold_type': 'none'}, memo=memo)
+    output, _ = run_preprocessing(page, {'threshold_type': 'none'}, memo=memo)
+    assert output is page
+    assert estimates == {'noise': 1, 'skew': 1}
+
+def test_markers_need_every_earlier_stage(clean_page, estimates):
+    memo = StageMemo(64 * 1024 * 1024)
+    _, key = run_preprocessing(clean_page, memo=memo)
+    # Drop the grayscale result: the pass-through markers after it no longer tell the image
+    for entry_key, (value, _, _) in list(memo._entries.items()):
+        if value is not PASS_THROUGH and value.ndim == 2 and entry_key != key:
+            del memo._entries[entry_key]
+    report = {}
+    run_preprocessing(clean_page, {'threshold_type': 'binary'}, report, memo=memo)
+    assert report['reused_stages'] == ['resize']
+    assert estimates['noise'] == 2
@@ -0,0 +1,33 @@
+import time
+
+from ocr_utils import WORD_COLUMNS
+from results_store import open_dataset, save_document_result
+
+def page(text):
+    words = {column: [1] for column in WORD_COLUMNS}
+    words.update(text=[text], conf=[90.0])
+    return {'page': 1, 'words': words}
+
+def test_edits_resolve_to_latest_write(tmp_path):
+    save_document_result('doc', {'loan_amount': '25,000'}, pages=[page('25,000')], root=tmp_path)
+    time.sleep(0.002)
+    save_document_result('doc', {'loan_amount': '26,000'}, root=tmp_path, edited=True)
+
+    documents = open_dataset('documents', tmp_path).to_table().to_pandas()
+    current = documents.sort_values('processed_at').iloc[-1]
+    assert current['loan_amount'] == '26,000'
+    assert current['edited']
+
+    # Saving edits without pages does not append word rows again
+    words = open_dataset('words', tmp_path).to_table().to_pandas()
+    assert len(words) == 1
+    assert words['processed_at'].iloc[0] == documents.sort_values('processed_at')['processed_at'].iloc[0]
+
+def test_rewritten_words_carry_their_write_time(tmp_path):
+    save_document_result('doc', {}, pages=[page('old')], root=tmp_path)
+    # Write times are stored in milliseconds
+    time.sleep(0.002)
+    save_document_result('doc', {}, pages=[page('new')], root=tmp_path)
+    words = open_dataset('words', tmp_path).to_table().to_pandas()
+    latest = words[words['processed_at'] == words['processed_at'].max()]
+    assert latest['text'].tolist() == ['new']
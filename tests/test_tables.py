@@ -0,0 +1,65 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from ocr_utils import WORD_COLUMNS, build_table, extract_table_data
+
+CHAR_WIDTH = 10
+LINE_HEIGHT = 20
+
+def layout_words(text, conf=90):
+    """Lay out text as OCR word rows, one Tesseract line per text line."""
+    rows = []
+    for line_num, line in enumerate(text.splitlines(), start=1):
+        for word_num, match in enumerate(re.finditer(r'\S+', line), start=1):
+            rows.append((1, 1, line_num, word_num, match.start() * CHAR_WIDTH, line_num * LINE_HEIGHT,
+                         len(match.group()) * CHAR_WIDTH, 12, conf, match.group()))
+    return pd.DataFrame(rows, columns=WORD_COLUMNS)
+
+def schedule_text(sample_text):
+    """The payment table of the amortization schedule sample."""
+    lines = sample_text("amortization_schedule").splitlines()
+    start = next(i for i, line in enumerate(lines) if line.startswith('Payment #'))
+    end = lines.index('...', start)
+    return '\n'.join(lines[start:end])
+
+def test_amortization_schedule_table(sample_text):
+    table = build_table(layout_words(schedule_text(sample_text)))
+    assert list(table.columns) == ['Payment #', 'Date', 'Payment', 'Principal', 'Interest', 'Balance']
+    # The opening balance row has no payment number
+    assert len(table) == 13
+    assert table['Date'].iloc[1] == '07/01/2023'
+    assert table['Balance'].iloc[0] == 25000.0
+    assert table['Principal'].iloc[1] == 344.32
+    assert table['Payment'].dtype == np.float64
+    assert table['Date'].dtype == object
+
+def test_preamble_is_excluded(sample_text):
+    text = "Payment Schedule:\n" + schedule_text(sample_text)
+    table = build_table(layout_words(text))
+    assert table.columns[0] == 'Payment #'
+
+def test_low_confidence_words_are_dropped():
+    words = layout_words("Item    Amount\nFee     $25\nTax     $3\nTotal   $28")
+    words.loc[words['text'] == '$3', 'conf'] = 20
+    table = build_table(words)
+    assert table['Item'].tolist() == ['Fee', 'Tax', 'Total']
+    assert table['Amount'].isna().tolist() == [False, True, False]
+
+def test_multi_word_cells():
+    table = build_table(layout_words("Description      Amount\nLate fee         $25\nOrigination fee  $100"))
+    assert table['Description'].tolist() == ['Late fee', 'Origination fee']
+    assert table['Amount'].tolist() == [25.0, 100.0]
+
+def test_empty_input():
+    assert build_table(layout_words("| ---- |")).empty
+    assert extract_table_data(ocr_result={'words': None}).empty
+
+def test_extract_table_data_area(sample_text):
+    text = "Loan Amount: $25,000\n\n" + schedule_text(sample_text)
+    words = layout_words(text)
+    top = 3 * LINE_HEIGHT - 5
+    table = extract_table_data(ocr_result={'words': words}, table_area=(0, top, 2000, 2000))
+    assert table.columns[0] == 'Payment #'
+    assert len(table) == 13
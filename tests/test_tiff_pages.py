@@ -0,0 +1,107 @@
+import io
+
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image
+
+import preprocessing
+from preprocessing import get_tiff_page_count, iter_tiff_pages
+
+def make_pages():
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (300, 200), np.uint8) for _ in range(3)]
+
+@pytest.fixture(autouse=True)
+def small_bands(monkeypatch):
+    # Several bands per page, so pages are assembled rather than read whole
+    monkeypatch.setattr(preprocessing, 'TIFF_BAND_ROWS', 64)
+
+@pytest.fixture
+def fallback(monkeypatch):
+    """Record the pages decoded whole with PIL."""
+    calls = []
+    read = preprocessing._read_tiff_page_pil
+
+    def read_pil(tiff, index, width=None, grayscale=False):
+        calls.append(index)
+        return read(tiff, index, width=width, grayscale=grayscale)
+
+    monkeypatch.setattr(preprocessing, '_read_tiff_page_pil', read_pil)
+    return calls
+
+def test_multipage_memmap_matches_imread(tmp_path, fallback):
+    path = tmp_path / 'scan.tif'
+    tifffile.imwrite(path, np.stack(make_pages()), photometric='minisblack')
+    pages = list(iter_tiff_pages(path))
+    assert get_tiff_page_count(path) == 3
+    for i, page in enumerate(pages):
+        assert np.array_equal(page, tifffile.imread(path, key=i))
+    assert fallback == []
+
+def test_rgb_pages_are_bgr(tmp_path):
+    rgb = np.random.default_rng(1).integers(0, 256, (200, 150, 3), np.uint8)
+    path = tmp_path / 'color.tif'
+    tifffile.imwrite(path, rgb, photometric='rgb')
+    page, = iter_tiff_pages(path)
+    assert np.array_equal(page, rgb[:, :, ::-1])
+
+def test_compressed_bytes_stream_by_segments(fallback):
+    buffer = io.BytesIO()
+    with tifffile.TiffWriter(buffer) as tif:
+        for page in make_pages():
+            tif.write(page, compression='zlib', rowsperstrip=16)
+    data = buffer.getvalue()
+    pages = list(iter_tiff_pages(data))
+    expected = tifffile.imread(io.BytesIO(data), key=range(3))
+    assert all(np.array_equal(page, want) for page, want in zip(pages, expected))
+    assert fallback == []
+
+def test_tiled_pages_crop_edge_tiles(fallback):
+    image = make_pages()[0]
+    buffer = io.BytesIO()
+    tifffile.imwrite(buffer, image, tile=(64, 64), compression='zlib')
+    page, = iter_tiff_pages(buffer.getvalue())
+    assert np.array_equal(page, image)
+    assert fallback == []
+
+@pytest.mark.parametrize('compression', ['tiff_lzw', 'packbits'])
+def test_pil_compressions(tmp_path, fallback, compression):
+    images = [Image.fromarray(page) for page in make_pages()]
+    path = tmp_path / 'scan.tif'
+    images[0].save(path, save_all=True, append_images=images[1:], compression=compression)
+    pages = list(iter_tiff_pages(path))
+    for i, page in enumerate(pages):
+        assert np.array_equal(page, tifffile.imread(path, key=i) if compression == 'packbits'
+                              else np.asarray(images[i]))
+    if compression == 'tiff_lzw':
+        # LZW needs imagecodecs, so every page is decoded with PIL instead
+        assert fallback == [0, 1, 2]
+
+def test_page_numbers_selection(tmp_path, fallback):
+    pages = make_pages()
+    path = tmp_path / 'scan.tif'
+    tifffile.imwrite(path, np.stack(pages), photometric='minisblack')
+    selected = list(iter_tiff_pages(path, page_numbers=[3, 1]))
+    assert len(selected) == 2
+    assert np.array_equal(selected[0], pages[2])
+    assert np.array_equal(selected[1], pages[0])
+
+def test_width_downscales_while_reading(tmp_path):
+    page = np.full((300, 200), 255, np.uint8)
+    page[100:200, 50:150] = 0
+    path = tmp_path / 'scan.tif'
+    tifffile.imwrite(path, page)
+    small, = iter_tiff_pages(path, width=100)
+    assert small.shape == (150, 100)
+    assert small[75, 50] == 0 and small[10, 10] == 255
+
+def test_bilevel_fallback_matches_streamed(tmp_path, fallback):
+    bits = make_pages()[0] > 127
+    plain, fax = tmp_path / 'plain.tif', tmp_path / 'fax.tif'
+    tifffile.imwrite(plain, bits, photometric='minisblack')
+    Image.fromarray(bits).save(fax, compression='group4')
+    streamed, = iter_tiff_pages(plain)
+    decoded, = iter_tiff_pages(fax)
+    assert fallback == [0]
+    assert np.array_equal(decoded, streamed)
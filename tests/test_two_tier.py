@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ocr_utils
+from ocr_utils import REPROCESS_MIN_CONF, WORD_COLUMNS, _reprocess_lines
+
+def line(line_num, text, conf=40):
+    return pd.DataFrame([(1, 1, line_num, 1, 20, 30 * line_num, 200, 16, conf, text)], columns=WORD_COLUMNS)
+
+@pytest.fixture
+def batch_ocr(monkeypatch):
+    """OCR stub reading confidences per variant call from `confs[call][image]`."""
+    calls, confs = [], []
+    
+    def perform_ocr_batch(images, backend=None, config=None):
+        calls.append(len(images))
+        results = []
+        for conf in confs[len(calls) - 1][:len(images)]:
+            words = pd.DataFrame([(1, 1, 1, 1, 4, 4, 100, 20, conf, f'v{len(calls)}')], columns=WORD_COLUMNS)
+            results.append({'text': '', 'words': words})
+        return results
+    
+    monkeypatch.setattr(ocr_utils, 'perform_ocr_batch', perform_ocr_batch)
+    monkeypatch.setattr(ocr_utils, 'preprocess_region', lambda image, variant, params=None: image)
+    return calls, confs
+
+def test_lines_stop_at_first_confident_variant(batch_ocr):
+    calls, confs = batch_ocr
+    page = np.full((200, 400), 255, np.uint8)
+    lines = {(1, 1, 1): line(1, 'a'), (1, 1, 2): line(2, 'b'), (1, 1, 3): line(3, 'c')}
+    high, low = REPROCESS_MIN_CONF + 10, REPROCESS_MIN_CONF - 10
+    # Variant 1 fixes the first line, variant 2 the second, the third never gets there
+    confs[:] = [[high, low, low], [high, low - 5], [low + 5]]
+    readings = _reprocess_lines(page, lines, {}, None)
+    
+    # One batched call per variant, with only the lines still weak
+    assert calls == [3, 2, 1]
+    assert readings[(1, 1, 1)]['text'].tolist() == ['v1']
+    assert readings[(1, 1, 2)]['text'].tolist() == ['v2']
+    assert readings[(1, 1, 3)]['text'].tolist() == ['v3']
+    # Boxes are mapped back to the page and keep the original line number
+    assert readings[(1, 1, 2)]['line_num'].tolist() == [2]
+    assert readings[(1, 1, 2)]['top'].tolist() == [30 * 2 - ocr_utils.REGION_PADDING + 2]
+
+def test_confident_first_variant_needs_one_call(batch_ocr):
+    calls, confs = batch_ocr
+    page = np.full((200, 400), 255, np.uint8)
+    confs[:] = [[REPROCESS_MIN_CONF + 1]]
+    _reprocess_lines(page, {(1, 1, 1): line(1, 'a')}, {}, None)
+    assert calls == [1]